@@ -0,0 +1,122 @@
+"""
+Measures the cost of computing the spatial fields to index for a dataset.
+
+It generates a synthetic corpus of extents (axis-aligned rectangles, points
+and other polygons) and reports, for each search backend and kind of
+extent, the time spent per dataset indexing them one by one and in
+batches, starting with an empty geometry cache. Use --shapely-only to
+disable the fast path for points and rectangles and compare.
+
+It needs to run in an environment where ckanext-spatial is installed, eg:
+
+    python bin/spatial_index_benchmark.py --datasets 20000
+"""
+import argparse
+import json
+import logging
+import random
+import time
+
+from ckanext.spatial.lib import extents
+from ckanext.spatial.lib.geometry_cache import get_geometry_cache
+from ckanext.spatial.search import search_backends
+
+
+def random_rectangle(rnd):
+    minx = round(rnd.uniform(-180, 170), rnd.randint(0, 6))
+    miny = round(rnd.uniform(-90, 80), rnd.randint(0, 6))
+    maxx = round(minx + rnd.uniform(0.01, 10), 6)
+    maxy = round(miny + rnd.uniform(0.01, 10), 6)
+    return {
+        "type": "Polygon",
+        "coordinates": [[
+            [minx, miny], [maxx, miny], [maxx, maxy], [minx, maxy], [minx, miny]
+        ]],
+    }
+
+
+def random_point(rnd):
+    return {
+        "type": "Point",
+        "coordinates": [round(rnd.uniform(-180, 180), 4),
+                        round(rnd.uniform(-90, 90), 4)],
+    }
+
+
+def random_polygon(rnd):
+    x, y = rnd.uniform(-170, 160), rnd.uniform(-80, 70)
+    return {
+        "type": "Polygon",
+        "coordinates": [[
+            [x, y], [x + 5, y + 1], [x + 8, y + 6], [x + 3, y + 9],
+            [x - 1, y + 4], [x, y]
+        ]],
+    }
+
+
+generators = {
+    "rectangle": random_rectangle,
+    "point": random_point,
+    "polygon": random_polygon,
+}
+
+
+def disable_fast_path():
+    extents.point_coordinates = lambda geometry: None
+    extents.rectangle_ring = lambda geometry: None
+    extents.simple_bounds = lambda geometry: None
+
+
+def run(backend, values, batch_size):
+    # Parsed extents are cached, measure the cost of parsing them
+    get_geometry_cache().clear()
+    start = time.time()
+    for value in values:
+        backend.index_dataset({"spatial": value})
+    single = time.time() - start
+
+    get_geometry_cache().clear()
+    start = time.time()
+    for i in range(0, len(values), batch_size):
+        backend.index_datasets(
+            [{"spatial": value} for value in values[i:i + batch_size]])
+    batch = time.time() - start
+
+    return single, batch
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--backends", default=",".join(sorted(search_backends)),
+                        help="Comma separated list of backends")
+    parser.add_argument("--datasets", type=int, default=10000,
+                        help="Number of datasets of each kind of extent")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--shapely-only", action="store_true",
+                        help="Disable the fast path for points and rectangles")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    if args.shapely_only:
+        disable_fast_path()
+
+    rnd = random.Random(args.seed)
+    corpus = {
+        kind: [json.dumps(generator(rnd)) for _ in range(args.datasets)]
+        for kind, generator in generators.items()
+    }
+
+    print("{:<22}{:<12}{:>16}{:>16}".format(
+        "Backend", "Extent", "single (us)", "batch (us)"))
+    for name in args.backends.split(","):
+        backend = search_backends[name]()
+        for kind, values in corpus.items():
+            single, batch = run(backend, values, args.batch_size)
+            print("{:<22}{:<12}{:>16.1f}{:>16.1f}".format(
+                name, kind,
+                single * 1e6 / len(values), batch * 1e6 / len(values)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Compares the spatial filters of the search backends on a synthetic corpus.
+
+It indexes a number of datasets with random extents in a Solr core (which
+must have the fields needed by the compared backends, see the spatial search
+documentation), runs the same random bounding box queries with the filters
+of each backend and reports the query times and number of results.
+
+It needs to run in an environment where ckanext-spatial is installed, eg:
+
+    python bin/spatial_search_benchmark.py http://localhost:8983/solr/ckan \\
+        --datasets 100000 --queries 500
+
+The benchmark datasets are removed from the index at the end, unless
+--keep is used.
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+
+import requests
+
+from ckanext.spatial.search import search_backends
+
+SITE_ID = "spatial-benchmark"
+
+
+def random_extent(rnd):
+    """Returns a (minx, miny, maxx, maxy) extent of a random size"""
+    width = rnd.choice([0.01, 0.1, 1, 5, 20, 60])
+    height = rnd.choice([0.01, 0.1, 1, 5, 20, 40])
+    minx = rnd.uniform(-180, 180 - width)
+    miny = rnd.uniform(-90, 90 - height)
+    return minx, miny, minx + width, miny + height
+
+
+def extent_geojson(extent):
+    minx, miny, maxx, maxy = extent
+    return json.dumps({
+        "type": "Polygon",
+        "coordinates": [[
+            [minx, miny], [maxx, miny], [maxx, maxy], [minx, maxy], [minx, miny]
+        ]],
+    })
+
+
+def get_backends(names, max_tokens):
+    backends = {}
+    for name in names:
+        backend = search_backends[name]()
+        if max_tokens and hasattr(backend, "get_max_tokens"):
+            backend.get_max_tokens = lambda: max_tokens
+        backends[name] = backend
+    return backends
+
+
+def index_corpus(solr_url, backends, count, batch_size, rnd):
+    start = time.time()
+    tokens = []
+    for batch_start in range(0, count, batch_size):
+        docs = []
+        for i in range(batch_start, min(batch_start + batch_size, count)):
+            doc = {
+                "id": "{}-{}".format(SITE_ID, i),
+                "index_id": "{}-{}".format(SITE_ID, i),
+                "site_id": SITE_ID,
+                "name": "{}-{}".format(SITE_ID, i),
+                "title": "Spatial benchmark dataset {}".format(i),
+                "entity_type": "package",
+                "dataset_type": "dataset",
+                "state": "active",
+                "capacity": "public",
+            }
+            spatial = extent_geojson(random_extent(rnd))
+            for name, backend in backends.items():
+                doc = backend.index_dataset(dict(doc, spatial=spatial))
+            doc.pop("spatial", None)
+            if "spatial_tiles" in doc:
+                tokens.append(len(doc["spatial_tiles"]))
+            docs.append(doc)
+        response = requests.post(
+            solr_url + "/update", json=docs, params={"commit": "false"})
+        response.raise_for_status()
+    requests.get(
+        solr_url + "/update", params={"commit": "true"}).raise_for_status()
+    print("Indexed {} datasets in {:.1f}s".format(count, time.time() - start))
+    if tokens:
+        print("Tile tokens per dataset: mean {:.1f}, max {}".format(
+            statistics.mean(tokens), max(tokens)))
+
+
+def run_queries(solr_url, backends, queries):
+    results = {}
+    for name, backend in backends.items():
+        times = []
+        counts = []
+        for extent in queries:
+            bbox = dict(zip(("minx", "miny", "maxx", "maxy"), extent))
+            search_params = backend.search_params(bbox, {})
+            params = {
+                "q": "*:*",
+                "rows": 0,
+                "wt": "json",
+                "fq": ["site_id:{}".format(SITE_ID)] + search_params["fq_list"],
+            }
+            response = requests.get(solr_url + "/select", params=params)
+            response.raise_for_status()
+            data = response.json()
+            times.append(data["responseHeader"]["QTime"])
+            counts.append(data["response"]["numFound"])
+        results[name] = (times, counts)
+
+    print()
+    print("{:<22}{:>10}{:>10}{:>10}{:>14}".format(
+        "Backend", "median", "p95", "max", "results"))
+    for name, (times, counts) in results.items():
+        times = sorted(times)
+        print("{:<22}{:>8}ms{:>8}ms{:>8}ms{:>14}".format(
+            name,
+            int(statistics.median(times)),
+            times[int(len(times) * 0.95) - 1] if len(times) > 1 else times[0],
+            times[-1],
+            sum(counts),
+        ))
+    return results
+
+
+def delete_corpus(solr_url):
+    requests.post(
+        solr_url + "/update",
+        json={"delete": {"query": "site_id:{}".format(SITE_ID)}},
+        params={"commit": "true"},
+    ).raise_for_status()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("solr_url", help="URL of the Solr core")
+    parser.add_argument("--backends", default="solr-bbox,solr-tiles",
+                        help="Comma separated list of backends to compare")
+    parser.add_argument("--datasets", type=int, default=10000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--max-tokens", type=int, default=None,
+                        help="Maximum number of tile tokens per dataset")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-index", action="store_true",
+                        help="Use the datasets indexed in a previous run")
+    parser.add_argument("--keep", action="store_true",
+                        help="Don't remove the benchmark datasets at the end")
+    args = parser.parse_args()
+
+    solr_url = args.solr_url.rstrip("/")
+    rnd = random.Random(args.seed)
+    backends = get_backends(args.backends.split(","), args.max_tokens)
+
+    if not args.no_index:
+        delete_corpus(solr_url)
+        index_corpus(solr_url, backends, args.datasets, args.batch_size, rnd)
+
+    queries = [random_extent(rnd) for _ in range(args.queries)]
+    try:
+        run_queries(solr_url, backends, queries)
+    finally:
+        if not args.keep:
+            delete_corpus(solr_url)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,86 @@
 # encoding: utf-8
+import sys
+import time
+
 import click
 
 import ckanext.spatial.util as util
+from ckanext.spatial.search import search_backends
 
 
 def get_commands():
     return [
+        spatial,
         spatial_validation
     ]
 
 
+@click.group(u"spatial", short_help=u"Spatial commands")
+def spatial():
+    pass
+
+
+@spatial.command()
+def warmup():
+    """
+    Compiles the validators, XSLT stylesheets and XPath expressions used
+    by the extension, eg to check that they all load correctly.
+    """
+    util.warmup()
+    click.secho('Warmup finished', fg='green')
+
+
+@spatial.command('compact-original-documents')
+@click.option('--codec', type=click.Choice(['gzip', 'zstd']), default='gzip',
+              show_default=True)
+@click.option('--batch-size', type=int, default=500, show_default=True)
+@click.option('--dry-run', is_flag=True,
+              help='Only report the space that would be saved')
+def compact_original_documents(codec, batch_size, dry_run):
+    """
+    Compresses the original documents of existing harvest objects
+    """
+    count, before, after = util.compact_original_documents(
+        codec, batch_size=batch_size, dry_run=dry_run)
+    click.echo('{0} documents: {1} bytes -> {2} bytes'.format(
+        count, before, after))
+    if dry_run:
+        click.secho('Dry run, no changes were saved', fg='yellow')
+
+
+@spatial.command()
+@click.option('--backend', 'search_backend', default=None,
+              type=click.Choice(sorted(search_backends)), help='Search backend to index the fields of '
+              '(default: the configured one)')
+@click.option('--batch-size', type=int, default=500, show_default=True)
+@click.option('-j', '--workers', type=int, default=None,
+              help='Number of worker processes (default: number of CPUs)')
+@click.option('--rebuild', is_flag=True,
+              help='Rebuild the full documents instead of updating the '
+              'spatial fields, eg if the Solr schema has fields that are '
+              'not stored')
+def reindex(search_backend, batch_size, workers, rebuild):
+    """
+    Reindexes the spatial fields of all the datasets, updating only those
+    fields unless --rebuild is set.
+    """
+    start = time.time()
+    try:
+        updated, skipped = util.reindex(
+            search_backend, batch_size=batch_size, workers=workers,
+            rebuild=rebuild)
+    except ValueError as e:
+        click.secho(str(e), fg='red', err=True)
+        sys.exit(1)
+    elapsed = time.time() - start
+    click.echo('{0} datasets updated in {1:.1f}s ({2:.1f} datasets/s)'.format(
+        updated, elapsed, updated / elapsed if elapsed else 0))
+    if skipped:
+        click.secho('{0} datasets are not in the search index, run '
+                    '`ckan search-index rebuild` to index them'.format(skipped),
+                    fg='yellow')
+
+
 @click.group(u"spatial-validation", short_help=u"Spatial formats validation commands")
 def spatial_validation():
     pass
@@ -28,12 +99,14 @@ def report(pkg):
 
 @spatial_validation.command('report-csv')
 @click.argument('filepath')
-def report_csv(filepath):
+@click.option('--format', 'format_', type=click.Choice(['csv', 'jsonl']),
+              default='csv', help='Output format (CSV or JSON lines)')
+def report_csv(filepath, format_):
     """
     Performs validation on all the harvested metadata in the db and
     writes a report in CSV format to the given filepath.
     """
-    return util.report_csv(filepath)
+    return util.report_csv(filepath, format=format_)
 
 
 @spatial_validation.command('file')
@@ -41,3 +114,24 @@ def report_csv(filepath):
 def validate_file(filepath):
     """Performs validation on the given metadata file."""
     return util.validate_file(filepath)
+
+
+@spatial_validation.command('batch')
+@click.argument('directory')
+@click.option('-o', '--output', help='File to write the results to '
+              '(default: standard output)')
+@click.option('--format', 'format_', type=click.Choice(['jsonl', 'csv']),
+              default='jsonl', help='Output format (JSON lines or CSV)')
+@click.option('-j', '--workers', type=int, default=None,
+              help='Number of worker processes (default: number of CPUs)')
+@click.option('--pattern', default='*.xml',
+              help='Pattern of the file names to validate')
+def validate_batch(directory, output, format_, workers, pattern):
+    """
+    Performs validation on all the metadata files in the given directory
+    using a pool of processes.
+    """
+    failed = util.validate_batch(directory, output=output, format=format_,
+                                 workers=workers, pattern=pattern)
+    if failed:
+        sys.exit(1)
@@ -3,9 +3,9 @@ import logging
 from ckan.lib.base import abort
 from ckan.controllers.api import ApiController as BaseApiController
 from ckan.model import Session
-from ckantoolkit import response
+from ckantoolkit import request, response
 
-from ckanext.harvest.model import HarvestObject, HarvestObjectExtra
+from ckanext.harvest.model import HarvestObject
 from ckanext.spatial import util
 
 log = logging.getLogger(__name__)
@@ -23,56 +23,94 @@ class HarvestMetadataApiController(BaseApiController):
             return None
 
     def _get_original_content(self, id):
-        extra = Session.query(HarvestObjectExtra).join(HarvestObject) \
-            .filter(HarvestObject.id == id) \
-            .filter(
-                HarvestObjectExtra.key == 'original_document'
-        ).first()
-        if extra:
-            return extra.value
-        else:
-            return None
+        return util.get_harvest_object_original_content(id)
 
     def _get_xslt(self, original=False):
 
         return util.get_xslt(original)
 
+    def _check_not_modified(self, id, original=False, variant=''):
+        '''
+        Sets the caching headers for the harvest object, and returns True
+        if a 304 response must be sent, without loading the object content.
+        '''
+        cache_info = util.get_harvest_object_cache_info(id, original=original)
+        if not cache_info:
+            abort(404)
+        version, fetch_finished = cache_info
+        if self._accepts_gzip():
+            variant += ':gzip'
+        headers = util.get_harvest_object_cache_headers(
+            id, version, fetch_finished, variant)
+        headers['Vary'] = 'Accept-Encoding'
+        for key, value in headers.items():
+            response.headers[key] = value
+        if util.is_not_modified(headers,
+                                request.headers.get('If-None-Match'),
+                                request.headers.get('If-Modified-Since')):
+            response.status_int = 304
+            return True
+        return False
+
+    def _accepts_gzip(self):
+        return util.accepts_gzip(request.headers.get('Accept-Encoding'))
+
+    def _get_body(self, chunks):
+        '''
+        Returns the body from the chunks of encoded content, compressed if
+        the client accepts it
+        '''
+        if self._accepts_gzip():
+            response.headers['Content-Encoding'] = 'gzip'
+            chunks = util.iter_gzip(chunks)
+        body = b''.join(chunks)
+        response.headers['Content-Length'] = str(len(body))
+        return body
+
     def display_xml_original(self, id):
-        content = util.get_harvest_object_original_content(id)
+        if self._check_not_modified(id, original=True, variant='xml'):
+            return ''
 
-        if not content:
+        value, codec = util.get_harvest_object_original_stored_content(id)
+
+        if not value:
             abort(404)
 
         response.headers['Content-Type'] = 'application/xml; charset=utf-8'
-        response.headers['Content-Length'] = len(content)
 
-        if '<?xml' not in content.split('\n')[0]:
-            content = u'<?xml version="1.0" encoding="UTF-8"?>\n' + content
-        return content.encode('utf-8')
+        return self._get_body(util.iter_original_document(value, codec))
 
     def display_html(self, id):
+        xslt_package, xslt_path = self._get_xslt()
+        if self._check_not_modified(
+                id, variant='html:{0}:{1}'.format(xslt_package, xslt_path)):
+            return ''
+
         content = self._get_content(id)
 
         if not content:
             abort(404)
 
-        xslt_package, xslt_path = self._get_xslt()
-        out = util.transform_to_html(content, xslt_package, xslt_path)
+        out = util.transform_to_html(content, xslt_package, xslt_path,
+                                     object_id=id)
         response.headers['Content-Type'] = 'text/html; charset=utf-8'
-        response.headers['Content-Length'] = len(out)
 
-        return out
+        return self._get_body(util.iter_content_chunks(out))
 
     def display_html_original(self, id):
+        xslt_package, xslt_path = self._get_xslt(original=True)
+        if self._check_not_modified(
+                id, original=True,
+                variant='html:{0}:{1}'.format(xslt_package, xslt_path)):
+            return ''
+
         content = util.get_harvest_object_original_content(id)
 
         if content is None:
             abort(404)
 
-        xslt_package, xslt_path = self._get_xslt(original=True)
-
-        out = util.transform_to_html(content, xslt_package, xslt_path)
+        out = util.transform_to_html(content, xslt_package, xslt_path,
+                                     object_id=id)
         response.headers['Content-Type'] = 'text/html; charset=utf-8'
-        response.headers['Content-Length'] = len(out)
 
-        return out
+        return self._get_body(util.iter_content_chunks(out))
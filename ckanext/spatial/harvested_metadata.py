@@ -44,6 +44,12 @@ class MappedXmlDocument(MappedXmlObject):
     def infer_values(self, values):
         pass
 
+    @classmethod
+    def warmup(cls):
+        '''Compiles the XPath expressions of all the mapped elements'''
+        for element in cls.elements:
+            element.compile_xpaths()
+
 
 class MappedXmlElement(MappedXmlObject):
     namespaces = {}
@@ -71,7 +77,23 @@ class MappedXmlElement(MappedXmlObject):
         return search_paths
 
     def get_elements(self, tree, xpath):
-        return tree.xpath(xpath, namespaces=self.namespaces)
+        return self.get_xpath(xpath)(tree)
+
+    def get_xpath(self, xpath):
+        '''Returns the compiled XPath object for the expression'''
+        xpaths = self.__dict__.setdefault('_xpaths', {})
+        compiled = xpaths.get(xpath)
+        if compiled is None:
+            compiled = xpaths[xpath] = etree.XPath(
+                xpath, namespaces=self.namespaces)
+        return compiled
+
+    def compile_xpaths(self):
+        '''Compiles the search paths of this element and its children'''
+        for xpath in self.get_search_paths():
+            self.get_xpath(xpath)
+        for child in self.elements:
+            child.compile_xpaths()
 
     def get_values(self, elements):
         values = []
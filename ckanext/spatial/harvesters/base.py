@@ -15,7 +15,6 @@ import dateutil
 import mimetypes
 
 from owslib import wms
-import requests
 from lxml import etree
 
 from ckan import plugins as p
@@ -28,8 +27,11 @@ from ckanext.harvest.harvesters.base import munge_tag
 
 from ckanext.harvest.harvesters.base import HarvesterBase
 from ckanext.harvest.model import HarvestObject
+from ckanext.harvest.model import HarvestObjectExtra as HOExtra
 
 from ckanext.spatial.validation import Validators, all_validators
+from ckanext.spatial.validation.cache import ValidationCache
+from ckanext.spatial.lib import compression, http_cache, rate_governor
 from ckanext.spatial.harvested_metadata import ISODocument
 from ckanext.spatial.interfaces import ISpatialHarvester
 from ckantoolkit import config
@@ -218,11 +220,23 @@ class SpatialHarvester(HarvesterBase):
                 if not isinstance(source_config_obj['default_extras'],dict):
                     raise ValueError('default_extras must be a dictionary')
 
-            for key in ('override_extras', 'clean_tags', 'skip_caps'):
+            for key in ('override_extras', 'clean_tags', 'skip_caps',
+                        'resume_gather'):
                 if key in source_config_obj:
                     if not isinstance(source_config_obj[key],bool):
                         raise ValueError('%s must be boolean' % key)
 
+            if 'rate_limit' in source_config_obj:
+                rate_limit = source_config_obj['rate_limit']
+                if not isinstance(rate_limit, dict):
+                    raise ValueError('rate_limit must be a dictionary')
+                for key, value in rate_limit.items():
+                    if key not in rate_governor.RATE_LIMIT_OPTIONS:
+                        raise ValueError('Unknown rate_limit option: %s' % key)
+                    if not isinstance(value, (int, float)) or \
+                            isinstance(value, bool) or value <= 0:
+                        raise ValueError('rate_limit %s must be a positive number' % key)
+
         except ValueError as e:
             raise e
 
@@ -560,7 +574,7 @@ class SpatialHarvester(HarvesterBase):
             return True
 
         # Check if it is a non ISO document
-        original_document = self._get_object_extra(harvest_object, 'original_document')
+        original_document = self._get_original_document(harvest_object)
         original_format = self._get_object_extra(harvest_object, 'original_format')
         if original_document and original_format:
             #DEPRECATED use the ISpatialHarvester interface method
@@ -774,10 +788,47 @@ class SpatialHarvester(HarvesterBase):
                 return extra.value
         return None
 
-    def _set_source_config(self, config_str):
+    def _get_original_document(self, harvest_object):
+        '''
+        Returns the original document stored in the harvest object extras,
+        decompressing it if necessary
+        '''
+        value = self._get_object_extra(harvest_object, 'original_document')
+        if not value:
+            return value
+        return compression.decompress_document(
+            value, self._get_object_extra(harvest_object,
+                                          compression.ENCODING_EXTRA_KEY))
+
+    def _create_original_document_extras(self, harvest_object, content,
+                                         document_format):
+        '''
+        Returns the (unsaved) extras that store a non ISO document and its
+        format in the harvest object. The document is compressed if the
+        `ckanext.spatial.harvest.original_document_compression` option is
+        set.
+        '''
+        codec = compression.get_storage_codec()
+        extras = [
+            HOExtra(object=harvest_object, key='original_document',
+                    value=compression.compress_document(content, codec)
+                    if codec else content),
+            HOExtra(object=harvest_object, key='original_format',
+                    value=document_format),
+        ]
+        if codec:
+            extras.append(HOExtra(object=harvest_object,
+                                  key=compression.ENCODING_EXTRA_KEY,
+                                  value=codec))
+        return extras
+
+    def _set_source_config(self, config_str, source_url=None):
         '''
         Loads the source configuration JSON object into a dict for
         convenient access
+
+        If the source URL is provided, the `rate_limit` option of the
+        configuration is applied to the requests to its host.
         '''
         if config_str:
             self.source_config = json.loads(config_str)
@@ -785,6 +836,20 @@ class SpatialHarvester(HarvesterBase):
         else:
             self.source_config = {}
 
+        if source_url:
+            rate_governor.configure_host(
+                source_url, self.source_config.get('rate_limit'))
+
+    def _get_http_session(self):
+        '''
+        Returns the requests session used for the requests of the harvester,
+        which go through the HTTP cache and the rate governor (see
+        `ckanext.spatial.lib.http_cache`)
+        '''
+        if getattr(self, '_http_session', None) is None:
+            self._http_session = http_cache.get_session()
+        return self._http_session
+
     def _get_validator(self):
         '''
         Returns the validator object using the relevant profiles
@@ -794,6 +859,12 @@ class SpatialHarvester(HarvesterBase):
         1. 'validator_profiles' property of the harvest source config object
         2. 'ckan.spatial.validator.profiles' configuration option in the ini file
         3. Default value as defined in DEFAULT_VALIDATOR_PROFILES
+
+        If the 'ckan.spatial.validator.cache_path' configuration option is
+        set, validation outcomes are cached in that file. If
+        'ckan.spatial.validator.parallel' is True, the profiles are run
+        concurrently. Setting 'ckan.spatial.validator.precheck' to False
+        disables the structural prechecks run before the ISO19139 profiles.
         '''
         if not hasattr(self, '_validator'):
             if hasattr(self, 'source_config') and self.source_config.get('validator_profiles', None):
@@ -805,7 +876,16 @@ class SpatialHarvester(HarvesterBase):
                 ]
             else:
                 profiles = DEFAULT_VALIDATOR_PROFILES
-            self._validator = Validators(profiles=profiles)
+            cache = None
+            cache_path = config.get('ckan.spatial.validator.cache_path')
+            if cache_path:
+                cache = ValidationCache(cache_path)
+            parallel = p.toolkit.asbool(
+                config.get('ckan.spatial.validator.parallel', False))
+            precheck = p.toolkit.asbool(
+                config.get('ckan.spatial.validator.precheck', True))
+            self._validator = Validators(profiles=profiles, cache=cache,
+                                         parallel=parallel, precheck=precheck)
 
             # Add any custom validators from extensions
             for plugin_with_validators in p.PluginImplementations(ISpatialHarvester):
@@ -855,7 +935,7 @@ class SpatialHarvester(HarvesterBase):
         http_response = urlopen(url)
         return http_response.read()
 
-    def _get_content_as_unicode(self, url):
+    def _get_content_as_unicode(self, url, session=None):
         '''
         Get remote content as unicode.
 
@@ -867,11 +947,15 @@ class SpatialHarvester(HarvesterBase):
         replace the original XML encoding declaration with an UTF-8 one.
 
 
+        An existing `requests.Session` can be passed to reuse its pooled
+        connections when fetching several documents from the same server,
+        otherwise the harvester session is used.
+
         [1] http://github.com/kennethreitz/requests/blob/63243b1e3b435c7736acf1e51c0f6fa6666d861d/requests/models.py#L811
 
         '''
         url = url.replace(' ', '%20')
-        response = requests.get(url, timeout=10)
+        response = (session or self._get_http_session()).get(url, timeout=10)
 
         content = response.text
 
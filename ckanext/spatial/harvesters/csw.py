@@ -12,6 +12,7 @@ from ckanext.harvest.model import HarvestObject
 from ckanext.harvest.model import HarvestObjectExtra as HOExtra
 
 from ckanext.spatial.lib.csw_client import CswService
+from ckanext.spatial.lib.checkpoints import GatherCheckpoint
 from ckanext.spatial.harvesters.base import SpatialHarvester, text_traceback
 
 
@@ -66,7 +67,7 @@ class CSWHarvester(SpatialHarvester, SingletonPlugin):
         # Get source URL
         url = harvest_job.source.url
 
-        self._set_source_config(harvest_job.source.config)
+        self._set_source_config(harvest_job.source.config, url)
 
         try:
             self._setup_csw_client(url)
@@ -87,10 +88,26 @@ class CSWHarvester(SpatialHarvester, SingletonPlugin):
         # extract cql filter if any
         cql = self.source_config.get('cql')
 
+        # Resume from the last page gathered by a previous failed job, if any
+        checkpoint = GatherCheckpoint(
+            harvest_job.source.id, harvest_job.id,
+            {'url': url, 'outputschema': self.output_schema(), 'cql': cql})
+        resume = self.source_config.get('resume_gather', True)
+        if resume:
+            start_position, guids_in_harvest = checkpoint.load()
+        else:
+            start_position, guids_in_harvest = 0, set()
+        checkpoint.start(resume=resume)
+
+        def save_checkpoint(next_position, identifiers):
+            checkpoint.add_page(
+                next_position, [i for i in identifiers if i is not None])
+
         log.debug('Starting gathering for %s' % url)
-        guids_in_harvest = set()
         try:
-            for identifier in self.csw.getidentifiers(page=10, outputschema=self.output_schema(), cql=cql):
+            for identifier in self.csw.getidentifiers(page=10, outputschema=self.output_schema(), cql=cql,
+                                                      startposition=start_position,
+                                                      page_callback=save_checkpoint):
                 try:
                     log.info('Got identifier %s from the CSW', identifier)
                     if identifier is None:
@@ -107,6 +124,8 @@ class CSWHarvester(SpatialHarvester, SingletonPlugin):
             self._save_gather_error('Error gathering the identifiers from the CSW server [%s]' % str(e), harvest_job)
             return None
 
+        checkpoint.clear()
+
         new = guids_in_harvest - guids_in_db
         delete = guids_in_db - guids_in_harvest
         change = guids_in_db & guids_in_harvest
@@ -152,6 +171,7 @@ class CSWHarvester(SpatialHarvester, SingletonPlugin):
         log.debug('CswHarvester fetch_stage for object: %s', harvest_object.id)
 
         url = harvest_object.source.url
+        self._set_source_config(harvest_object.source.config, url)
         try:
             self._setup_csw_client(url)
         except Exception as e:
@@ -188,4 +208,4 @@ class CSWHarvester(SpatialHarvester, SingletonPlugin):
         return True
 
     def _setup_csw_client(self, url):
-        self.csw = CswService(url)
+        self.csw = CswService(url, session=self._get_http_session())
@@ -22,6 +22,7 @@ from ckanext.harvest.model import HarvestObject
 from ckanext.harvest.model import HarvestObjectExtra as HOExtra
 
 from ckanext.spatial.lib.csw_client import CswService
+from ckanext.spatial.lib.checkpoints import GatherCheckpoint
 from ckanext.spatial.harvesters.base import (SpatialHarvester,
                                              text_traceback,
                                              guess_resource_format)
@@ -84,7 +85,7 @@ class CSWFGDCHarvester(SpatialHarvester, SingletonPlugin):
         # Get source URL
         url = harvest_job.source.url
 
-        self._set_source_config(harvest_job.source.config)
+        self._set_source_config(harvest_job.source.config, url)
         skip_caps = self.source_config.get('skip_caps', False)
 
         try:
@@ -106,10 +107,26 @@ class CSWFGDCHarvester(SpatialHarvester, SingletonPlugin):
         # extract cql filter if any
         cql = self.source_config.get('cql')
 
+        # Resume from the last page gathered by a previous failed job, if any
+        checkpoint = GatherCheckpoint(
+            harvest_job.source.id, harvest_job.id,
+            {'url': url, 'outputschema': self.output_schema(), 'cql': cql})
+        resume = self.source_config.get('resume_gather', True)
+        if resume:
+            start_position, guids_in_harvest = checkpoint.load()
+        else:
+            start_position, guids_in_harvest = 0, set()
+        checkpoint.start(resume=resume)
+
+        def save_checkpoint(next_position, identifiers):
+            checkpoint.add_page(
+                next_position, [i for i in identifiers if i is not None])
+
         log.debug('Starting gathering for %s' % url)
-        guids_in_harvest = set()
         try:
-            for identifier in self.csw.getidentifiers(page=10, outputschema=self.output_schema(), cql=cql):
+            for identifier in self.csw.getidentifiers(page=10, outputschema=self.output_schema(), cql=cql,
+                                                      startposition=start_position,
+                                                      page_callback=save_checkpoint):
                 try:
                     log.info('Got identifier %s from the CSW', identifier)
                     if identifier is None:
@@ -127,6 +144,8 @@ class CSWFGDCHarvester(SpatialHarvester, SingletonPlugin):
             self._save_gather_error('Error gathering the identifiers from the CSW server [%s]' % str(e), harvest_job)
             return None
 
+        checkpoint.clear()
+
         new = guids_in_harvest - guids_in_db
         delete = guids_in_db - guids_in_harvest
         change = guids_in_db & guids_in_harvest
@@ -173,7 +192,7 @@ class CSWFGDCHarvester(SpatialHarvester, SingletonPlugin):
 
         url = harvest_object.source.url
 
-        self._set_source_config(harvest_object.source.config)
+        self._set_source_config(harvest_object.source.config, url)
         skip_caps = self.source_config.get('skip_caps', False)
 
         try:
@@ -208,7 +227,8 @@ class CSWFGDCHarvester(SpatialHarvester, SingletonPlugin):
         return True
 
     def _setup_csw_client(self, url, skip_caps=False):
-        self.csw = CswService(url, skip_caps=skip_caps)
+        self.csw = CswService(url, skip_caps=skip_caps,
+                              session=self._get_http_session())
 
     def import_stage(self, harvest_object):
         context = {
@@ -47,7 +47,7 @@ class DocHarvester(SpatialHarvester, SingletonPlugin):
         # Get source URL
         url = harvest_job.source.url
 
-        self._set_source_config(harvest_job.source.config)
+        self._set_source_config(harvest_job.source.config, url)
 
         # Get contents
         try:
@@ -88,17 +88,9 @@ class DocHarvester(SpatialHarvester, SingletonPlugin):
         if document_format == 'iso':
             harvest_object.content = content
         else:
-            extra = HOExtra(
-                    object=harvest_object,
-                    key='original_document',
-                    value=content)
-            extra.save()
-
-            extra = HOExtra(
-                    object=harvest_object,
-                    key='original_format',
-                    value=document_format)
-            extra.save()
+            for extra in self._create_original_document_extras(
+                    harvest_object, content, document_format):
+                extra.save()
 
         harvest_object.save()
 
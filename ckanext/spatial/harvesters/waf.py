@@ -1,6 +1,7 @@
 from __future__ import print_function
 
 from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import logging
 import hashlib
 
@@ -11,6 +12,7 @@ from sqlalchemy.orm import aliased
 from sqlalchemy.exc import DataError
 
 from ckan import model
+from ckan.lib.helpers import json
 
 from ckan.plugins.core import SingletonPlugin, implements
 
@@ -20,9 +22,12 @@ from ckanext.harvest.model import HarvestObjectExtra as HOExtra
 import ckanext.harvest.queue as queue
 
 from ckanext.spatial.harvesters.base import SpatialHarvester, guess_standard
+from ckanext.spatial.lib import http_cache
 
 log = logging.getLogger(__name__)
 
+DEFAULT_PREFETCH_WORKERS = 8
+
 
 class WAFHarvester(SpatialHarvester, SingletonPlugin):
     '''
@@ -40,6 +45,25 @@ class WAFHarvester(SpatialHarvester, SingletonPlugin):
             }
 
 
+    def validate_config(self, source_config):
+        source_config = super(WAFHarvester, self).validate_config(source_config)
+        if not source_config:
+            return source_config
+
+        source_config_obj = json.loads(source_config)
+
+        if 'prefetch' in source_config_obj:
+            if not isinstance(source_config_obj['prefetch'], bool):
+                raise ValueError('prefetch must be boolean')
+
+        if 'prefetch_workers' in source_config_obj:
+            workers = source_config_obj['prefetch_workers']
+            if not isinstance(workers, int) or isinstance(workers, bool) \
+                    or workers < 1:
+                raise ValueError('prefetch_workers must be a positive integer')
+
+        return source_config
+
     def get_original_url(self, harvest_object_id):
         url = model.Session.query(HOExtra.value).\
                                     filter(HOExtra.key=='waf_location').\
@@ -58,11 +82,11 @@ class WAFHarvester(SpatialHarvester, SingletonPlugin):
         # Get source URL
         source_url = harvest_job.source.url
 
-        self._set_source_config(harvest_job.source.config)
+        self._set_source_config(harvest_job.source.config, source_url)
 
         # Get contents
         try:
-            response = requests.get(source_url, timeout=60)
+            response = self._get_http_session().get(source_url, timeout=60)
             response.raise_for_status()
         except requests.exceptions.RequestException as e:
             self._save_gather_error('Unable to get content for URL: %s: %r' % \
@@ -97,7 +121,9 @@ class WAFHarvester(SpatialHarvester, SingletonPlugin):
 
         url_to_modified_harvest = {} ## mapping of url to last_modified in harvest
         try:
-            for url, modified_date in _extract_waf(str(content),source_url,scraper):
+            for url, modified_date in _extract_waf(
+                    str(content), source_url, scraper,
+                    session=self._get_http_session()):
                 url_to_modified_harvest[url] = modified_date
         except Exception as e:
             msg = 'Error extracting URLs from %s, error was %s' % (source_url, e)
@@ -132,6 +158,7 @@ class WAFHarvester(SpatialHarvester, SingletonPlugin):
 
 
         ids = []
+        to_fetch = []
         for location in new:
             guid=hashlib.md5(location.encode('utf8','ignore')).hexdigest()
             obj = HarvestObject(job=harvest_job,
@@ -142,6 +169,7 @@ class WAFHarvester(SpatialHarvester, SingletonPlugin):
                                )
             obj.save()
             ids.append(obj.id)
+            to_fetch.append((obj, location))
 
         for location in change:
             obj = HarvestObject(job=harvest_job,
@@ -153,6 +181,7 @@ class WAFHarvester(SpatialHarvester, SingletonPlugin):
                                )
             obj.save()
             ids.append(obj.id)
+            to_fetch.append((obj, location))
 
         for location in delete:
             obj = HarvestObject(job=harvest_job,
@@ -167,6 +196,9 @@ class WAFHarvester(SpatialHarvester, SingletonPlugin):
             obj.save()
             ids.append(obj.id)
 
+        if to_fetch and self.source_config.get('prefetch', False):
+            self._prefetch_documents(to_fetch)
+
         if len(ids) > 0:
             log.debug('{0} objects sent to the next stage: {1} new, {2} change, {3} delete'.format(
                 len(ids), len(new), len(change), len(delete)))
@@ -185,7 +217,14 @@ class WAFHarvester(SpatialHarvester, SingletonPlugin):
             # No need to fetch anything, just pass to the import stage
             return True
 
+        if harvest_object.content or \
+                self._get_object_extra(harvest_object, 'original_document'):
+            # Document already downloaded during the gather stage
+            return True
+
         # We need to fetch the remote document
+        self._set_source_config(harvest_object.source.config,
+                                harvest_object.source.url)
 
         # Get location
         url = self._get_object_extra(harvest_object, 'waf_location')
@@ -203,25 +242,71 @@ class WAFHarvester(SpatialHarvester, SingletonPlugin):
             self._save_object_error(msg, harvest_object)
             return False
 
+        self._set_document_content(harvest_object, content)
+        model.Session.commit()
+
+        return True
+
+    def _set_document_content(self, harvest_object, content):
+        '''
+        Stores the downloaded document on the harvest object, either as its
+        content (ISO documents) or as an `original_document` extra to be
+        transformed on the import stage. Changes are added to the session but
+        not committed.
+        '''
         # Check if it is an ISO document
         document_format = guess_standard(content)
         if document_format == 'iso':
             harvest_object.content = content
-            harvest_object.save()
+            harvest_object.add()
         else:
-            extra = HOExtra(
-                    object=harvest_object,
-                    key='original_document',
-                    value=content)
-            extra.save()
-
-            extra = HOExtra(
-                    object=harvest_object,
-                    key='original_format',
-                    value=document_format)
-            extra.save()
-
-        return True
+            for extra in self._create_original_document_extras(
+                    harvest_object, content, document_format):
+                extra.add()
+
+    def _prefetch_documents(self, objects_and_urls):
+        '''
+        Downloads the documents for the provided (harvest_object, url) pairs
+        using a bounded pool of threads that share a pooled HTTP session, and
+        stores them on the harvest objects with a single commit.
+
+        Only the HTTP requests happen in the worker threads, all database
+        access stays on the calling thread. Documents that could not be
+        downloaded are left empty so the fetch stage retries them as usual.
+        '''
+        workers = self.source_config.get('prefetch_workers',
+                                         DEFAULT_PREFETCH_WORKERS)
+        log.debug('Prefetching %i WAF documents using %i workers',
+                  len(objects_and_urls), workers)
+
+        # One pooled connection per worker, the adapters default of 10
+        # would make the rest open and discard connections
+        session = http_cache.get_session(pool_maxsize=workers)
+
+        fetched = 0
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    executor.submit(self._get_content_as_unicode, url,
+                                    session=session): obj
+                    for obj, url in objects_and_urls
+                }
+                for future in as_completed(futures):
+                    obj = futures[future]
+                    try:
+                        content = future.result()
+                    except Exception as e:
+                        log.info('Could not prefetch WAF document for object '
+                                 '%s, it will be fetched later: %s', obj.id, e)
+                        continue
+                    self._set_document_content(obj, content)
+                    fetched += 1
+        finally:
+            session.close()
+
+        model.Session.commit()
+        log.debug('Prefetched %i of %i WAF documents', fetched,
+                  len(objects_and_urls))
 
 
 apache  = parse.SkipTo(parse.CaselessLiteral("<a href="), include=True).suppress() \
@@ -284,7 +369,8 @@ def _get_scraper(server):
     else:
         return 'other'
 
-def _extract_waf(content, base_url, scraper, results = None, depth=0):
+def _extract_waf(content, base_url, scraper, results = None, depth=0,
+                 session=None):
     if results is None:
         results = []
 
@@ -321,12 +407,13 @@ def _extract_waf(content, base_url, scraper, results = None, depth=0):
                 continue
             log.debug('WAF new_url: %s', new_url)
             try:
-                response = requests.get(new_url)
+                response = (session or requests).get(new_url)
                 content = response.content
             except Exception as e:
                 print(str(e))
                 continue
-            _extract_waf(str(content), new_url, scraper, results, new_depth)
+            _extract_waf(str(content), new_url, scraper, results, new_depth,
+                         session=session)
             continue
         if not url.endswith('.xml'):
             continue
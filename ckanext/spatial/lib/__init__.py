@@ -1,4 +1,11 @@
 import logging
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 import ckantoolkit as tk
 
 config = tk.config
@@ -106,6 +113,76 @@ def fit_bbox(bbox_dict):
     }
 
 
+def fit_bbox_array(bounds):
+    """
+    Vectorized version of `fit_bbox`, for a numpy array with a
+    (minx, miny, maxx, maxy) row for each bounding box. Returns a new array.
+    """
+
+    def _adjust(values, limit):
+        values = np.where(
+            (values < -limit) | (values > limit), np.mod(values, 2 * limit), values
+        )
+        return np.where(values > limit, values - 2 * limit, values)
+
+    bounds = np.array(bounds, dtype=float).reshape(-1, 4)
+    return np.column_stack(
+        [
+            _adjust(bounds[:, 0], 180),
+            _adjust(bounds[:, 1], 90),
+            _adjust(bounds[:, 2], 180),
+            _adjust(bounds[:, 3], 90),
+        ]
+    )
+
+
+def quantize_bbox(bbox_dict, grid=None, max_zoom=20):
+    """
+    Snaps a bounding box outwards to a grid, so nearby bounding boxes end
+    up being the same one.
+
+    `grid` is the size of the grid cells in degrees. If not provided, a
+    grid based on map tiles is used, with cells of 360 / 2^zoom degrees,
+    choosing the zoom so that the bounding box spans at least four cells
+    on its widest side.
+
+    Accepts and returns a dict with the minx, miny, maxx and maxy keys.
+    Latitudes are kept within -90 and 90, and longitudes within -180 and
+    180 unless they were already outside them (eg for queries crossing the
+    antimeridian), so snapping a whole world query to a grid that doesn't
+    divide 360 doesn't make it wrap around.
+    """
+
+    if not grid:
+        size = max(bbox_dict["maxx"] - bbox_dict["minx"],
+                   bbox_dict["maxy"] - bbox_dict["miny"])
+        zoom = max_zoom
+        if size > 0:
+            zoom = min(max(int(math.floor(math.log(360.0 / size, 2))), 0) + 2,
+                       max_zoom)
+        grid = 360.0 / 2 ** zoom
+
+    def _floor(value):
+        return round(math.floor(value / grid) * grid, 10)
+
+    def _ceil(value):
+        return round(math.ceil(value / grid) * grid, 10)
+
+    minx = _floor(bbox_dict["minx"])
+    if bbox_dict["minx"] >= -180:
+        minx = max(minx, -180.0)
+    maxx = _ceil(bbox_dict["maxx"])
+    if bbox_dict["maxx"] <= 180:
+        maxx = min(maxx, 180.0)
+
+    return {
+        "minx": minx,
+        "miny": max(_floor(bbox_dict["miny"]), -90.0),
+        "maxx": maxx,
+        "maxy": min(_ceil(bbox_dict["maxy"]), 90.0),
+    }
+
+
 def fit_linear_ring(lr):
 
     bbox = {
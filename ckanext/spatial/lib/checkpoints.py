@@ -0,0 +1,159 @@
+'''
+Checkpoints for long running gather stages, so a failed gather can be
+resumed from the last completed page instead of starting from scratch.
+
+Checkpoints are stored as append-only JSON lines files, one per harvest
+source. The first line describes the query being paged (so a checkpoint is
+never used for a different query) and every following line records a
+completed page with its identifiers and the position of the next page.
+
+The directory must be set with the `ckanext.spatial.harvest.checkpoint_dir`
+config option, and should be shared by all the hosts or containers running
+the gather stage so a retried job can find the checkpoint left by the
+previous one. If it is not set, checkpoints are disabled.
+'''
+import os
+import json
+import time
+import logging
+
+import ckantoolkit as tk
+
+config = tk.config
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CHECKPOINT_MAX_AGE = 24 * 60 * 60
+
+
+def get_checkpoint_dir():
+    return config.get('ckanext.spatial.harvest.checkpoint_dir') or None
+
+
+class GatherCheckpoint(object):
+    '''
+    Records the progress of a paged gather for a harvest source.
+
+    `query` is a dict describing the request being paged (eg endpoint URL,
+    output schema and filters). A checkpoint left by a previous job is only
+    resumed if it was created for the same query and is not older than
+    `max_age` seconds.
+    '''
+
+    def __init__(self, source_id, job_id, query, directory=None,
+                 max_age=None):
+        self.source_id = source_id
+        self.job_id = job_id
+        self.query = query
+        self.directory = directory or get_checkpoint_dir()
+        if max_age is None:
+            max_age = int(config.get(
+                'ckanext.spatial.harvest.checkpoint_max_age',
+                DEFAULT_CHECKPOINT_MAX_AGE))
+        self.max_age = max_age
+
+        if self.directory:
+            self.path = os.path.join(self.directory,
+                                     'gather-{0}.jsonl'.format(source_id))
+            self.enabled = True
+        else:
+            log.warning('ckanext.spatial.harvest.checkpoint_dir is not set, '
+                        'the gather of source %s will not be resumable if it '
+                        'fails', source_id)
+            self.path = None
+            self.enabled = False
+
+    def load(self):
+        '''
+        Returns a tuple with the position of the next page to request and
+        the set of identifiers gathered so far by a previous job. If there
+        is no usable checkpoint it returns (0, set()).
+        '''
+        if not self.enabled:
+            return 0, set()
+
+        if not os.path.exists(self.path):
+            log.info('No gather checkpoint found at %s, gathering source %s '
+                     'from the first page', self.path, self.source_id)
+            return 0, set()
+
+        if time.time() - os.path.getmtime(self.path) > self.max_age:
+            log.info('Discarding expired gather checkpoint %s', self.path)
+            self.clear()
+            return 0, set()
+
+        start_position = 0
+        identifiers = set()
+        with open(self.path, 'r') as f:
+            try:
+                header = json.loads(f.readline())
+            except ValueError:
+                header = {}
+            if header.get('query') != self.query:
+                log.info('Discarding gather checkpoint %s created for a '
+                         'different query', self.path)
+                f.close()
+                self.clear()
+                return 0, set()
+
+            valid_size = f.tell()
+            line = f.readline()
+            while line:
+                try:
+                    page = json.loads(line)
+                except ValueError:
+                    # Last line might be incomplete if the process died
+                    # while writing it, drop it so new pages can be appended
+                    f.close()
+                    with open(self.path, 'r+') as truncated:
+                        truncated.truncate(valid_size)
+                    break
+                start_position = page['next']
+                identifiers.update(page['identifiers'])
+                valid_size = f.tell()
+                line = f.readline()
+
+        log.info('Resuming gather from job %s at position %i (%i identifiers '
+                 'already gathered)', header.get('job_id'), start_position,
+                 len(identifiers))
+        return start_position, identifiers
+
+    def start(self, resume=True):
+        '''
+        Prepares the checkpoint file for the current job. If `resume` is
+        True the pages recorded by a previous job are kept.
+
+        Failing to write the checkpoint is not fatal, the gather will just
+        not be resumable.
+        '''
+        if not self.enabled:
+            return
+        if resume and os.path.exists(self.path):
+            return
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            with open(self.path, 'w') as f:
+                f.write(json.dumps({'job_id': self.job_id,
+                                    'query': self.query}) + '\n')
+        except (IOError, OSError) as e:
+            log.warning('Could not write gather checkpoint %s: %s',
+                        self.path, e)
+            self.enabled = False
+
+    def add_page(self, next_position, identifiers):
+        '''Records a completed page'''
+        if not self.enabled:
+            return
+        with open(self.path, 'a') as f:
+            f.write(json.dumps({'next': next_position,
+                                'identifiers': list(identifiers)}) + '\n')
+
+    def clear(self):
+        '''Removes the checkpoint, eg once the gather stage has finished'''
+        if not self.path:
+            return
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
@@ -0,0 +1,56 @@
+'''
+Process wide store of compiled lxml objects (XSD schemas, Schematron and
+XSLT transforms) that are expensive to build.
+
+lxml validators and transforms keep the state of the current call on the
+object itself (eg the error log of a schema), so one object must not be used
+by two threads at the same time. Instead of keeping a copy per thread,
+threads borrow a compiled object from the pool and give it back when done:
+objects compiled at startup (see `ckanext.spatial.util.warmup`) are reused
+by any thread, and further copies are only compiled when several threads
+need the same object at once.
+'''
+import threading
+from contextlib import contextmanager
+
+
+class CompiledPool(object):
+    '''
+    Keeps the compiled objects that are not in use, keyed by the resource
+    they were built from (eg the path of the XSD file).
+    '''
+
+    def __init__(self):
+        self._free = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def get(self, key, build):
+        '''
+        Context manager that borrows a compiled object for `key`, calling
+        `build()` to compile a new one if none is available
+        '''
+        with self._lock:
+            free = self._free.get(key)
+            value = free.pop() if free else None
+        if value is None:
+            value = build()
+        try:
+            yield value
+        finally:
+            with self._lock:
+                self._free.setdefault(key, []).append(value)
+
+    def warmup(self, key, build):
+        '''Compiles an object for `key` if none is available'''
+        with self.get(key, build):
+            pass
+
+    def size(self, key):
+        '''Returns the number of compiled objects available for `key`'''
+        with self._lock:
+            return len(self._free.get(key, []))
+
+    def clear(self):
+        with self._lock:
+            self._free.clear()
@@ -0,0 +1,123 @@
+'''
+Compressed storage for the original documents kept in harvest object extras.
+
+Harvest object extras are stored as text, so compressed documents are
+base64 encoded. The codec used is recorded in a companion extra
+(`original_document_encoding`), documents without it are plain text.
+
+Compression is enabled with the
+`ckanext.spatial.harvest.original_document_compression` configuration
+option, which can be `gzip` or `zstd` (requires the zstandard package).
+'''
+import base64
+import gzip
+import logging
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+import ckantoolkit as tk
+
+config = tk.config
+
+log = logging.getLogger(__name__)
+
+ENCODING_EXTRA_KEY = 'original_document_encoding'
+CODECS = ('gzip', 'zstd')
+
+
+def get_storage_codec():
+    '''
+    Returns the codec to use for new original documents, or None if they
+    should be stored as plain text.
+    '''
+    codec = config.get(
+        'ckanext.spatial.harvest.original_document_compression', None)
+    if not codec or codec == 'none':
+        return None
+    if codec not in CODECS:
+        log.warning('Unknown original document compression: %s', codec)
+        return None
+    if codec == 'zstd' and zstandard is None:
+        log.warning('zstandard is not installed, using gzip to compress '
+                    'original documents')
+        return 'gzip'
+    return codec
+
+
+def compress_document(content, codec):
+    '''Returns the compressed, base64 encoded document'''
+    data = content.encode('utf-8')
+    if codec == 'gzip':
+        data = gzip.compress(data, mtime=0)
+    elif codec == 'zstd':
+        if zstandard is None:
+            raise ValueError('zstandard is needed to use the zstd codec')
+        data = zstandard.ZstdCompressor(level=10).compress(data)
+    else:
+        raise ValueError('Unknown codec: {0}'.format(codec))
+    return base64.b64encode(data).decode('ascii')
+
+
+def decompress_document(value, codec):
+    '''Returns the document stored with `compress_document`'''
+    if not codec:
+        return value
+    data = base64.b64decode(value)
+    if codec == 'gzip':
+        data = gzip.decompress(data)
+    elif codec == 'zstd':
+        if zstandard is None:
+            raise ValueError('zstandard is needed to read this document')
+        data = zstandard.ZstdDecompressor().decompress(data)
+    else:
+        raise ValueError('Unknown codec: {0}'.format(codec))
+    return data.decode('utf-8')
+
+
+def iter_decompressed(value, codec, chunk_size=64 * 1024):
+    '''
+    Yields the document stored with `compress_document` as UTF-8 encoded
+    chunks of up to `chunk_size` bytes. Compressed documents are decompressed
+    incrementally, so the whole decompressed document is never in memory.
+    '''
+    if not codec:
+        for start in range(0, len(value), chunk_size):
+            yield value[start:start + chunk_size].encode('utf-8')
+        return
+
+    data = base64.b64decode(value)
+    if codec == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        while data:
+            chunk = decompressor.decompress(data, chunk_size)
+            if chunk:
+                yield chunk
+            data = decompressor.unconsumed_tail
+        chunk = decompressor.flush()
+        if chunk:
+            yield chunk
+    elif codec == 'zstd':
+        if zstandard is None:
+            raise ValueError('zstandard is needed to read this document')
+        with zstandard.ZstdDecompressor().stream_reader(data) as reader:
+            while True:
+                chunk = reader.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    else:
+        raise ValueError('Unknown codec: {0}'.format(codec))
+
+
+def get_compressed_bytes(value, codec):
+    '''
+    Returns the raw compressed bytes of a document stored in gzip, so they
+    can be sent as is to clients that accept gzip
+    '''
+    if codec != 'gzip':
+        return None
+    return base64.b64decode(value)
@@ -7,13 +7,17 @@ import logging
 from owslib.etree import etree
 from owslib.fes import PropertyIsEqualTo, SortBy, SortProperty
 
+from ckanext.spatial.lib import http_cache
+
 log = logging.getLogger(__name__)
 
 class CswError(Exception):
     pass
 
 class OwsService(object):
-    def __init__(self, endpoint=None, skip_caps=False):
+    def __init__(self, endpoint=None, skip_caps=False, session=None):
+        # OWSLib requests are sent through this requests session if set
+        self.session = session
         if endpoint is not None:
             self._ows(endpoint, skip_caps)
 
@@ -48,7 +52,9 @@ class OwsService(object):
         if not hasattr(self, "__ows_obj__"):
             if endpoint is None:
                 raise ValueError("Must specify a service endpoint")
-            self.__ows_obj__ = self._Implementation(endpoint, skip_caps=skip_caps)
+            with http_cache.use_session(self.session):
+                self.__ows_obj__ = self._Implementation(
+                    endpoint, skip_caps=skip_caps)
         return self.__ows_obj__
 
     def getcapabilities(self, debug=False, **kw):
@@ -66,8 +72,9 @@ class CswService(OwsService):
     """
     from owslib.catalogue.csw2 import CatalogueServiceWeb as _Implementation
 
-    def __init__(self, endpoint=None, skip_caps=False):
-        super(CswService, self).__init__(endpoint, skip_caps=skip_caps)
+    def __init__(self, endpoint=None, skip_caps=False, session=None):
+        super(CswService, self).__init__(endpoint, skip_caps=skip_caps,
+                                         session=session)
         self.sortby = SortBy([SortProperty('dc:identifier')])
 
     def getrecords(self, qtype=None, keywords=[],
@@ -90,7 +97,8 @@ class CswService(OwsService):
             "sortby": self.sortby
             }
         log.info('Making CSW request: getrecords2 %r', kwa)
-        csw.getrecords2(**kwa)
+        with http_cache.use_session(self.session):
+            csw.getrecords2(**kwa)
         if csw.exceptionreport:
             err = 'Error getting records: %r' % \
                   csw.exceptionreport.exceptions
@@ -100,7 +108,17 @@ class CswService(OwsService):
 
     def getidentifiers(self, qtype=None, typenames="csw:Record", esn="brief",
                        keywords=[], limit=None, page=10, outputschema="gmd",
-                       startposition=0, cql=None, **kw):
+                       startposition=0, cql=None, page_callback=None, **kw):
+        '''
+        Generator that pages through the records of the service, yielding
+        their identifiers.
+
+        If `page_callback` is provided, it will be called after all the
+        identifiers of a page have been consumed, with the start position of
+        the next page and the list of identifiers of the completed one. This
+        allows callers to checkpoint the paging and resume it later passing
+        `startposition`.
+        '''
         from owslib.catalogue.csw2 import namespaces
         constraints = []
         csw = self._ows(**kw)
@@ -123,7 +141,8 @@ class CswService(OwsService):
         while True:
             log.info('Making CSW request: getrecords2 %r', kwa)
 
-            csw.getrecords2(**kwa)
+            with http_cache.use_session(self.session):
+                csw.getrecords2(**kwa)
             if csw.exceptionreport:
                 err = 'Error getting identifiers: %r' % \
                       csw.exceptionreport.exceptions
@@ -147,6 +166,8 @@ class CswService(OwsService):
                 break
 
             startposition += page
+            if page_callback:
+                page_callback(startposition, identifiers)
             if startposition >= (matches + 1):
                 break
 
@@ -161,7 +182,8 @@ class CswService(OwsService):
             }
         # Ordinary Python version's don't support the metadata argument
         log.info('Making CSW request: getrecordbyid %r %r', ids, kwa)
-        csw.getrecordbyid(ids, **kwa)
+        with http_cache.use_session(self.session):
+            csw.getrecordbyid(ids, **kwa)
         if csw.exceptionreport:
             err = 'Error getting record by id: %r' % \
                   csw.exceptionreport.exceptions
@@ -0,0 +1,128 @@
+'''
+Helpers to handle the simplest (and most common) GeoJSON extents, points
+and axis-aligned rectangles, straight from the parsed coordinates, without
+building shapely geometries.
+
+All functions return None for anything else, so callers can fall back to
+shapely.
+'''
+import math
+
+
+def _is_number(value):
+    return (
+        isinstance(value, (int, float))
+        and not isinstance(value, bool)
+        and math.isfinite(value)
+    )
+
+
+def _position(value):
+    if (
+        isinstance(value, (list, tuple))
+        and len(value) == 2
+        and _is_number(value[0])
+        and _is_number(value[1])
+    ):
+        return (float(value[0]), float(value[1]))
+    return None
+
+
+def point_coordinates(geometry):
+    '''Returns the (x, y) coordinates of a 2D GeoJSON Point'''
+    if not isinstance(geometry, dict) or geometry.get('type') != 'Point':
+        return None
+    return _position(geometry.get('coordinates'))
+
+
+def rectangle_ring(geometry):
+    '''
+    Returns the list of (x, y) coordinates of a GeoJSON Polygon that is an
+    axis-aligned rectangle (one closed ring of five 2D positions), with a
+    non zero area
+    '''
+    if not isinstance(geometry, dict) or geometry.get('type') != 'Polygon':
+        return None
+    rings = geometry.get('coordinates')
+    if not isinstance(rings, list) or len(rings) != 1:
+        return None
+    if not isinstance(rings[0], list) or len(rings[0]) != 5:
+        return None
+
+    ring = [_position(position) for position in rings[0]]
+    if None in ring or ring[0] != ring[4]:
+        return None
+
+    for (x1, y1), (x2, y2) in zip(ring[:-1], ring[1:]):
+        # Each side must be either horizontal or vertical
+        if (x1 != x2) == (y1 != y2):
+            return None
+    if len(set(ring[:4])) != 4:
+        return None
+
+    return ring
+
+
+def simple_bounds(geometry):
+    '''
+    Returns the (minx, miny, maxx, maxy) bounds of a GeoJSON Point or
+    axis-aligned rectangle
+    '''
+    point = point_coordinates(geometry)
+    if point:
+        return (point[0], point[1], point[0], point[1])
+    ring = rectangle_ring(geometry)
+    if ring:
+        xs = [x for x, _ in ring]
+        ys = [y for _, y in ring]
+        return (min(xs), min(ys), max(xs), max(ys))
+    return None
+
+
+def is_ccw(ring):
+    '''Returns whether a closed ring is defined counter-clockwise'''
+    area = 0
+    for (x1, y1), (x2, y2) in zip(ring[:-1], ring[1:]):
+        area += x1 * y2 - x2 * y1
+    return area > 0
+
+
+def format_wkt_number(value):
+    '''
+    Formats a coordinate as shapely does when writing WKT. Returns None for
+    the values that need more than 15 decimals or an exponent, where the
+    output of the GEOS versions differs.
+    '''
+    value = float(value)
+    if value == 0:
+        return '0'
+    text = repr(value)
+    if 'e' in text or len(text.split('.')[1]) > 15:
+        return None
+    if text.endswith('.0'):
+        text = text[:-2]
+    return text
+
+
+def _format_position(position):
+    x = format_wkt_number(position[0])
+    y = format_wkt_number(position[1])
+    if x is None or y is None:
+        return None
+    return '{} {}'.format(x, y)
+
+
+def point_wkt(x, y):
+    '''Returns the WKT of a point, as shapely would write it'''
+    position = _format_position((x, y))
+    if position is None:
+        return None
+    return 'POINT ({})'.format(position)
+
+
+def polygon_wkt(ring):
+    '''Returns the WKT of a polygon without holes, as shapely would write it'''
+    positions = [_format_position(position) for position in ring]
+    if None in positions:
+        return None
+    return 'POLYGON (({}))'.format(', '.join(positions))
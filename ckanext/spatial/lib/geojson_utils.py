@@ -0,0 +1,186 @@
+'''
+Fast decoding and validation of GeoJSON extents.
+
+JSON is decoded with orjson when it is installed, and the geometry objects
+are validated as plain dicts and lists, following the same rules (and
+returning the same errors) as the python-geojson `is_valid` and `errors()`
+methods, without building python-geojson objects for every coordinate.
+
+Anything unusual (eg Features, foreign members or JSON that can not be
+decoded) is handed over to python-geojson, so the reported errors are
+always the same as the ones it reports.
+'''
+import json
+import logging
+from numbers import Number
+
+import geojson
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+log = logging.getLogger(__name__)
+
+# Number of decimals python-geojson rounds the coordinates to
+PRECISION = 6
+
+GEOMETRY_TYPES = (
+    'Point', 'MultiPoint', 'LineString', 'MultiLineString',
+    'Polygon', 'MultiPolygon',
+)
+
+
+class UnsupportedGeoJSON(Exception):
+    '''Raised for the objects that need to be validated by python-geojson'''
+
+
+def _reject_constant(value):
+    raise ValueError('Number {0!r} is not JSON compliant'.format(value))
+
+
+def loads(value):
+    '''
+    Decodes a JSON string, with orjson if it is available. Raises
+    ValueError if it is not valid JSON.
+    '''
+    if orjson is not None:
+        return orjson.loads(value)
+    return json.loads(value, parse_constant=_reject_constant)
+
+
+def _check_numbers(coordinates):
+    '''
+    Checks that the coordinates are nested lists of numbers, the only
+    structure supported by the fast validation
+    '''
+    for value in coordinates:
+        if isinstance(value, list):
+            _check_numbers(value)
+        elif not isinstance(value, (int, float)):
+            raise UnsupportedGeoJSON()
+
+
+def _rounded(value):
+    if isinstance(value, list):
+        return [_rounded(item) for item in value]
+    return round(value, PRECISION)
+
+
+def _check_list_errors(check, items):
+    results = (check(item) for item in items)
+    return [error for error in results if error]
+
+
+def _check_point(coord):
+    if not isinstance(coord, list):
+        return 'each position must be a list'
+    if len(coord) not in (2, 3):
+        return 'a position must have exactly 2 or 3 values'
+    for number in coord:
+        if not isinstance(number, Number):
+            return 'a position cannot have inner positions'
+
+
+def _check_line_string(coord):
+    if not isinstance(coord, list):
+        return 'each line must be a list of positions'
+    if len(coord) < 2:
+        return ('the "coordinates" member must be an array of '
+                'two or more positions')
+    for pos in coord:
+        error = _check_point(pos)
+        if error:
+            return error
+
+
+def _check_polygon(coord):
+    if not isinstance(coord, list):
+        return 'Each polygon must be a list of linear rings'
+    if not all(isinstance(elem, list) for elem in coord):
+        return "Each element of a polygon's coordinates must be a list"
+    if not all(len(elem) >= 4 for elem in coord):
+        return 'Each linear ring must contain at least 4 positions'
+    # Coordinates are compared after rounding them, as python-geojson does
+    if not all(_rounded(elem[0]) == _rounded(elem[-1]) for elem in coord):
+        return 'Each linear ring must end where it started'
+
+
+_geometry_checks = {
+    'Point': _check_point,
+    'MultiPoint': lambda coord: _check_list_errors(_check_point, coord),
+    'LineString': _check_line_string,
+    'MultiLineString': lambda coord: _check_list_errors(
+        _check_line_string, coord),
+    'Polygon': _check_polygon,
+    'MultiPolygon': lambda coord: _check_list_errors(_check_polygon, coord),
+}
+
+
+def geometry_errors(geometry):
+    '''
+    Returns the validation errors of a decoded GeoJSON geometry, as the
+    `errors()` method of the python-geojson object would.
+
+    Raises UnsupportedGeoJSON for objects that are not plain geometries or
+    geometry collections.
+    '''
+    if not isinstance(geometry, dict):
+        raise UnsupportedGeoJSON()
+
+    geometry_type = geometry.get('type')
+    if geometry_type == 'GeometryCollection':
+        if set(geometry) - {'type', 'geometries'}:
+            raise UnsupportedGeoJSON()
+        geometries = geometry.get('geometries') or []
+        if not isinstance(geometries, list):
+            raise UnsupportedGeoJSON()
+        errors = [geometry_errors(item) for item in geometries]
+        return [error for error in errors if error]
+
+    if geometry_type not in GEOMETRY_TYPES:
+        raise UnsupportedGeoJSON()
+    if set(geometry) - {'type', 'coordinates'}:
+        raise UnsupportedGeoJSON()
+
+    coordinates = geometry.get('coordinates') or []
+    if not isinstance(coordinates, list):
+        raise UnsupportedGeoJSON()
+    _check_numbers(coordinates)
+
+    return _geometry_checks[geometry_type](coordinates)
+
+
+def _geojson_error(value):
+    '''Validates the extent with python-geojson'''
+    try:
+        geometry = geojson.loads(value)
+    except ValueError as e:
+        return {
+            'spatial': ['Error decoding JSON object: {}'.format(str(e))]}
+
+    if not hasattr(geometry, 'is_valid') or not geometry.is_valid:
+        msg = 'Error: Wrong GeoJSON object'
+        if hasattr(geometry, 'errors'):
+            msg = msg + ': {}'.format(geometry.errors())
+        return {'spatial': [msg]}
+
+    return None
+
+
+def get_geojson_error(value):
+    '''
+    Returns the validation error dict for a spatial extra, or None if it is
+    a valid GeoJSON object
+    '''
+    value = str(value)
+    try:
+        errors = geometry_errors(loads(value))
+    except (ValueError, UnsupportedGeoJSON):
+        return _geojson_error(value)
+
+    if errors:
+        return {'spatial': [
+            'Error: Wrong GeoJSON object: {}'.format(errors)]}
+    return None
@@ -0,0 +1,69 @@
+'''
+Cache of the results of parsing spatial extras.
+
+The same extent string is usually shared by many datasets (eg all the
+ones harvested from the same source), and each of them is parsed when the
+dataset is created or updated (to validate it) and again when it is
+indexed. Results are kept in an LRU cache keyed by a digest of the string,
+so each distinct extent is only parsed once per process.
+
+The size of the cache is set with `ckanext.spatial.geometry_cache_size`
+(0 to disable it).
+'''
+import hashlib
+
+import ckantoolkit as tk
+
+from ckanext.spatial.lib.lru import LRUCache
+
+config = tk.config
+
+DEFAULT_GEOMETRY_CACHE_SIZE = 1024
+
+# Marks the values not computed yet
+MISSING = object()
+
+_geometry_cache = None
+
+
+class CachedExtent(object):
+    '''
+    Values derived from a spatial extra, computed by the first one that
+    needs each of them:
+
+    * error: None if the extent is a valid GeoJSON object, or the
+      validation error dict otherwise
+    * bounds: (minx, miny, maxx, maxy) tuple, or None if it can not be
+      parsed
+    * wkt: the WKT (or list of WKTs) indexed by the spatial field backend,
+      or None if it can not be indexed
+    '''
+    __slots__ = ('error', 'bounds', 'wkt')
+
+    def __init__(self):
+        self.error = MISSING
+        self.bounds = MISSING
+        self.wkt = MISSING
+
+
+def get_geometry_cache():
+    global _geometry_cache
+    if _geometry_cache is None:
+        _geometry_cache = LRUCache(int(config.get(
+            'ckanext.spatial.geometry_cache_size',
+            DEFAULT_GEOMETRY_CACHE_SIZE)))
+    return _geometry_cache
+
+
+def get_cached_extent(value):
+    '''Returns the CachedExtent of a spatial extra string'''
+    if not isinstance(value, bytes):
+        value = str(value).encode('utf-8')
+    key = hashlib.sha1(value).digest()
+
+    cache = get_geometry_cache()
+    extent = cache.get(key)
+    if extent is None:
+        extent = CachedExtent()
+        cache.set(key, extent)
+    return extent
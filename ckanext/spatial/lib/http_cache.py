@@ -0,0 +1,261 @@
+'''
+Persistent cache for the HTTP requests performed by the spatial harvesters.
+
+This module also provides the requests sessions used by the harvesters,
+whose transport adapter applies the per-host rate governor (see
+`ckanext.spatial.lib.rate_governor`) to the requests that reach the network.
+Only the requests sent through these sessions are cached and governed, the
+rest of the requests of the process are not affected.
+
+Responses are stored in a SQLite database keyed by the request method, URL
+and body (so CSW POST requests with different queries are kept apart). The
+cache is mounted as a requests transport adapter on the harvesters sessions.
+OWSLib does not accept a session, so its requests are routed through the
+harvester session with `use_session` while the CSW client runs.
+
+It supports the following modes, set with the
+`ckanext.spatial.harvest.http_cache` configuration option:
+
+* off: No caching (default)
+* cache: Serve responses from the cache if present and not older than
+  `ckanext.spatial.harvest.http_cache_max_age` seconds (one day by
+  default), otherwise perform the request and store the response
+* record: Always perform the request and store (or refresh) the response
+* replay: Only serve responses from the cache, requests not present fail
+  with a ConnectionError. Useful to re-run harvests offline.
+'''
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+import ckantoolkit as tk
+
+from ckanext.spatial.lib.rate_governor import GovernedAdapter
+
+config = tk.config
+
+log = logging.getLogger(__name__)
+
+CACHE_MODES = ('off', 'cache', 'record', 'replay')
+
+DEFAULT_MAX_AGE = 24 * 60 * 60
+
+# Caches shared by all the sessions, by path
+_caches = {}
+_caches_lock = threading.Lock()
+
+# Session used by the requests of the current thread in `use_session`
+_local = threading.local()
+_original_get_adapter = requests.Session.get_adapter
+
+
+class HTTPCache(object):
+    '''Compressed store of HTTP responses backed by SQLite.'''
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30,
+                                     check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                method TEXT,
+                url TEXT,
+                status INTEGER,
+                reason TEXT,
+                headers TEXT,
+                content BLOB,
+                created REAL
+            )''')
+        self._conn.commit()
+
+    @staticmethod
+    def key(method, url, body=None):
+        key = hashlib.sha1()
+        key.update(method.upper().encode('utf8'))
+        key.update(b'\0')
+        key.update(url.encode('utf8'))
+        if body:
+            key.update(b'\0')
+            key.update(body if isinstance(body, bytes)
+                       else body.encode('utf8'))
+        return key.hexdigest()
+
+    def get(self, key, max_age=None):
+        '''
+        Returns a (status, reason, headers, content) tuple for the stored
+        response, or None if not present (or older than `max_age` seconds).
+        '''
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT status, reason, headers, content FROM responses '
+                'WHERE key = ? AND created >= ?',
+                (key, time.time() - max_age if max_age else 0)).fetchone()
+        if not row:
+            return None
+        status, reason, headers, content = row
+        return status, reason, json.loads(headers), zlib.decompress(content)
+
+    def set(self, key, method, url, status, reason, headers, content):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, method, url, status, reason, json.dumps(headers),
+                 sqlite3.Binary(zlib.compress(content)), time.time()))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachingAdapter(GovernedAdapter):
+    '''
+    requests transport adapter that reads and writes an HTTPCache. Requests
+    not served from the cache go through the rate governor.
+    '''
+
+    def __init__(self, cache, mode='cache', max_age=None, **kwargs):
+        if mode not in CACHE_MODES or mode == 'off':
+            raise ValueError('Unknown HTTP cache mode: {0}'.format(mode))
+        super(CachingAdapter, self).__init__(**kwargs)
+        self.cache = cache
+        self.mode = mode
+        self.max_age = max_age
+
+    def send(self, request, **kwargs):
+        key = HTTPCache.key(request.method, request.url, request.body)
+
+        if self.mode in ('cache', 'replay'):
+            # Replays serve the recorded responses regardless of their age
+            cached = self.cache.get(
+                key, max_age=self.max_age if self.mode == 'cache' else None)
+            if cached:
+                log.debug('HTTP cache hit for %s %s', request.method,
+                          request.url)
+                return self._build_cached_response(request, *cached)
+            if self.mode == 'replay':
+                raise requests.exceptions.ConnectionError(
+                    'Request not found in the HTTP cache (replay mode): '
+                    '{0} {1}'.format(request.method, request.url),
+                    request=request)
+
+        response = super(CachingAdapter, self).send(request, **kwargs)
+        if response.status_code >= 500:
+            # Don't keep transient server errors
+            return response
+
+        # Make sure the whole body is read before storing it
+        content = response.content
+        headers = dict(response.headers)
+        # The stored content is already decoded
+        headers.pop('Content-Encoding', None)
+        headers.pop('Transfer-Encoding', None)
+        self.cache.set(key, request.method, request.url,
+                       response.status_code, response.reason, headers,
+                       content)
+        return response
+
+    def _build_cached_response(self, request, status, reason, headers,
+                               content):
+        response = requests.Response()
+        response.status_code = status
+        response.reason = reason
+        response.headers = CaseInsensitiveDict(headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = content
+        response._content_consumed = True
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+
+def get_cache(path):
+    '''Returns the HTTPCache stored in `path`, shared by all sessions'''
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = HTTPCache(path)
+        return _caches[path]
+
+
+def get_session(mode=None, path=None, max_age=None, **adapter_kwargs):
+    '''
+    Returns a new requests session for the harvesters requests, which go
+    through the HTTP cache (if enabled) and the rate governor.
+
+    If not provided, the mode, cache location and maximum age of the cached
+    responses are read from the `ckanext.spatial.harvest.http_cache`,
+    `ckanext.spatial.harvest.http_cache_path` and
+    `ckanext.spatial.harvest.http_cache_max_age` configuration options.
+    Other keyword arguments (eg `pool_maxsize`) are passed to the transport
+    adapter.
+    '''
+    mode = mode or config.get('ckanext.spatial.harvest.http_cache', 'off')
+    if mode == 'off':
+        adapter = GovernedAdapter(**adapter_kwargs)
+    else:
+        path = path or config.get(
+            'ckanext.spatial.harvest.http_cache_path',
+            os.path.join(tempfile.gettempdir(),
+                         'ckanext-spatial-http-cache.sqlite'))
+        if max_age is None:
+            max_age = int(config.get(
+                'ckanext.spatial.harvest.http_cache_max_age',
+                DEFAULT_MAX_AGE))
+        adapter = CachingAdapter(get_cache(path), mode=mode,
+                                 max_age=max_age, **adapter_kwargs)
+        log.debug('Using HTTP cache in %s mode (%s)', mode, path)
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _get_adapter(session, url):
+    current = getattr(_local, 'session', None)
+    if current is not None and current is not session:
+        return current.get_adapter(url)
+    return _original_get_adapter(session, url)
+
+
+@contextmanager
+def use_session(session):
+    '''
+    Routes the requests performed in the current thread while the block
+    runs by libraries that don't accept a session (like OWSLib) through the
+    adapters of `session`. Requests in other threads are not affected.
+    '''
+    if requests.Session.get_adapter is not _get_adapter:
+        requests.Session.get_adapter = _get_adapter
+    previous = getattr(_local, 'session', None)
+    _local.session = session
+    try:
+        yield session
+    finally:
+        _local.session = previous
+
+
+def close_caches():
+    with _caches_lock:
+        for cache in _caches.values():
+            cache.close()
+        _caches.clear()
@@ -0,0 +1,71 @@
+'''
+Small thread-safe LRU cache for values that are expensive to build, like
+rendered HTML pages or parsed geometries.
+'''
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    '''
+    Keeps up to `maxsize` values, discarding the least recently used ones
+    when full. A `maxsize` of 0 disables the cache.
+
+    If `maxbytes` is set, the total size of the values (as returned by
+    `sizeof`) is also kept under it, and values larger than it are not
+    cached.
+    '''
+
+    def __init__(self, maxsize=128, maxbytes=0, sizeof=len):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        size = self.sizeof(value) if self.maxbytes else 0
+        with self._lock:
+            self._discard(key)
+            if self.maxbytes and size > self.maxbytes:
+                return
+            self._data[key] = value
+            self._sizes[key] = size
+            self.bytes += size
+            while len(self._data) > self.maxsize or (
+                    self.maxbytes and self.bytes > self.maxbytes):
+                self._discard(next(iter(self._data)))
+
+    def _discard(self, key):
+        if key in self._data:
+            del self._data[key]
+            self.bytes -= self._sizes.pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.hits = self.misses = self.bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
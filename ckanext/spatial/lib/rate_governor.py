@@ -0,0 +1,222 @@
+'''
+Adaptive per-host concurrency and rate limiting for the requests performed
+by the spatial harvesters against remote servers.
+
+Each remote host gets a governor that limits the number of requests in
+flight and the pace at which new ones are started. Limits are adapted with
+an AIMD (additive increase, multiplicative decrease) strategy: every request
+that succeeds in less than the target latency slowly increases the allowed
+concurrency and rate, while slow responses halve the concurrency and errors
+(connection problems, timeouts, 429 and 5xx responses) also double the delay
+between requests.
+
+Governors are shared by all the harvesters running in the same process, but
+not across processes: when several gather or fetch consumers run in parallel,
+the `ckanext.spatial.harvest.rate_governor.processes` option divides the
+limits among them. Global defaults are set with the
+`ckanext.spatial.harvest.rate_governor.*` configuration options, and can be
+overridden for the host of a particular harvest source with the `rate_limit`
+source configuration option.
+'''
+import time
+import logging
+import threading
+from urllib.parse import urlparse
+
+from requests.adapters import HTTPAdapter
+
+import ckantoolkit as tk
+
+config = tk.config
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_MIN_CONCURRENCY = 1
+DEFAULT_TARGET_LATENCY = 5.0
+MAX_INTERVAL = 30.0
+BACKOFF_INTERVAL = 0.1
+
+RATE_LIMIT_OPTIONS = ('max_concurrency', 'min_concurrency', 'max_rate',
+                      'target_latency')
+
+_governors = {}
+_host_limits = {}
+_lock = threading.Lock()
+
+
+class HostGovernor(object):
+    '''
+    Limits concurrency and rate of the requests to a single host.
+
+    max_concurrency - Maximum number of simultaneous requests
+    min_concurrency - The concurrency will never be reduced below this
+    max_rate - Maximum number of requests per second (None for no limit)
+    target_latency - Responses slower than this (in seconds) are treated as
+        a sign of an overloaded server
+    '''
+
+    def __init__(self, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 min_concurrency=DEFAULT_MIN_CONCURRENCY, max_rate=None,
+                 target_latency=DEFAULT_TARGET_LATENCY):
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency,
+                                          self.max_concurrency))
+        self.min_interval = 1.0 / max_rate if max_rate else 0.0
+        self.target_latency = target_latency
+
+        self.concurrency = float(self.max_concurrency)
+        self.interval = self.min_interval
+
+        self.in_flight = 0
+        self._next_start = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        '''Blocks until a new request can be started'''
+        with self._condition:
+            while True:
+                now = time.time()
+                if self.in_flight < int(self.concurrency):
+                    if now >= self._next_start:
+                        break
+                    self._condition.wait(self._next_start - now)
+                else:
+                    self._condition.wait()
+            self.in_flight += 1
+            self._next_start = now + self.interval
+
+    def release(self, latency, error=False):
+        '''
+        Registers the outcome of a request started with `acquire` and adapts
+        the limits accordingly.
+        '''
+        with self._condition:
+            self.in_flight -= 1
+            if error or latency > self.target_latency:
+                self.concurrency = max(float(self.min_concurrency),
+                                       self.concurrency / 2)
+                if error:
+                    self.interval = min(
+                        MAX_INTERVAL,
+                        max(self.interval * 2, self.min_interval,
+                            BACKOFF_INTERVAL))
+                log.debug('Backing off (error: %s, latency: %.2fs), '
+                          'concurrency: %.2f, interval: %.2fs', error,
+                          latency, self.concurrency, self.interval)
+            else:
+                self.concurrency = min(float(self.max_concurrency),
+                                       self.concurrency + 1 / self.concurrency)
+                self.interval = max(self.min_interval,
+                                    self.interval - BACKOFF_INTERVAL)
+            self._condition.notify_all()
+
+
+def _get_default_limits():
+    max_rate = config.get('ckanext.spatial.harvest.rate_governor.max_rate')
+    return {
+        'max_concurrency': int(config.get(
+            'ckanext.spatial.harvest.rate_governor.max_concurrency',
+            DEFAULT_MAX_CONCURRENCY)),
+        'min_concurrency': int(config.get(
+            'ckanext.spatial.harvest.rate_governor.min_concurrency',
+            DEFAULT_MIN_CONCURRENCY)),
+        'max_rate': float(max_rate) if max_rate else None,
+        'target_latency': float(config.get(
+            'ckanext.spatial.harvest.rate_governor.target_latency',
+            DEFAULT_TARGET_LATENCY)),
+    }
+
+
+def _get_process_limits(limits):
+    '''
+    Divides the limits of a host among the number of harvester processes
+    set in `ckanext.spatial.harvest.rate_governor.processes`, so the requests
+    of all of them stay within the limits (each process is still allowed at
+    least one request at a time)
+    '''
+    processes = int(config.get(
+        'ckanext.spatial.harvest.rate_governor.processes', 1))
+    if processes <= 1:
+        return limits
+    limits = dict(limits)
+    limits['max_concurrency'] = max(1, limits['max_concurrency'] // processes)
+    if limits.get('max_rate'):
+        limits['max_rate'] = float(limits['max_rate']) / processes
+    return limits
+
+
+def is_enabled():
+    '''
+    Returns whether requests to any host might need to be governed, either
+    because it is enabled globally or because some host has custom limits.
+    '''
+    return tk.asbool(config.get('ckanext.spatial.harvest.rate_governor',
+                                False)) or bool(_host_limits)
+
+
+def configure_host(url, limits):
+    '''
+    Overrides the default limits for the host of the provided URL, eg with
+    the `rate_limit` object of a harvest source configuration. `limits` is a
+    dict with any of the HostGovernor parameters.
+    '''
+    host = urlparse(url).netloc.lower()
+    if not host or not limits:
+        return
+    with _lock:
+        if _host_limits.get(host) == limits:
+            return
+        _host_limits[host] = dict(limits)
+        # Limits have changed, start again with the new ones
+        _governors.pop(host, None)
+
+
+def get_governor(url):
+    '''
+    Returns the governor for the host of the provided URL, or None if
+    the rate governor is not enabled for it.
+    '''
+    host = urlparse(url).netloc.lower()
+    with _lock:
+        governor = _governors.get(host)
+        if governor:
+            return governor
+        if host not in _host_limits and not tk.asbool(
+                config.get('ckanext.spatial.harvest.rate_governor', False)):
+            return None
+        limits = _get_default_limits()
+        limits.update(_host_limits.get(host, {}))
+        governor = _governors[host] = HostGovernor(
+            **_get_process_limits(limits))
+    return governor
+
+
+def reset():
+    '''Removes all governors and host limits'''
+    with _lock:
+        _governors.clear()
+        _host_limits.clear()
+
+
+class GovernedAdapter(HTTPAdapter):
+    '''
+    requests transport adapter that goes through the governor of the
+    target host before performing the request
+    '''
+
+    def send(self, request, **kwargs):
+        governor = get_governor(request.url)
+        if not governor:
+            return super(GovernedAdapter, self).send(request, **kwargs)
+
+        governor.acquire()
+        start = time.time()
+        error = True
+        try:
+            response = super(GovernedAdapter, self).send(request, **kwargs)
+            error = response.status_code == 429 or \
+                response.status_code >= 500
+            return response
+        finally:
+            governor.release(time.time() - start, error=error)
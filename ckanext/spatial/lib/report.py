@@ -1,13 +1,60 @@
 '''
 Library for creating reports that can be displayed easily in an HTML table
 and then saved as a CSV.
+
+ReportTable keeps all rows in memory. For large reports use one of the
+ReportWriter classes, which write each row to a file as soon as it is added.
 '''
 
 from io import StringIO
 import datetime
+import json
 import csv
 
 
+def format_row_html(row, date_format='%d/%m/%y %H:%M', blank_cell_html=''):
+    row_formatted = row[:]
+    for i, cell in enumerate(row):
+        if isinstance(cell, datetime.datetime):
+            row_formatted[i] = cell.strftime(date_format)
+        elif cell is None:
+            row_formatted[i] = blank_cell_html
+    return row_formatted
+
+
+def format_csv_cell(cell):
+    if isinstance(cell, datetime.datetime):
+        cell = cell.strftime('%Y-%m-%d %H:%M')
+    elif isinstance(cell, int):
+        cell = str(cell)
+    elif isinstance(cell, (list, tuple)):
+        cell = str(cell)
+    elif cell is None:
+        cell = ''
+    elif isinstance(cell, bytes):
+        cell = cell.decode('utf8')
+    return cell
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+
+def _row_from_dict(column_names, row_dict):
+    row = []
+    for col_name in column_names:
+        if col_name in row_dict:
+            value = row_dict.pop(col_name)
+        else:
+            value = None
+        row.append(value)
+    if row_dict:
+        raise Exception('Have left-over keys not under a column: %s' % row_dict)
+    return row
+
+
 class ReportTable(object):
     def __init__(self, column_names):
         assert isinstance(column_names, (list, tuple))
@@ -16,53 +63,78 @@ class ReportTable(object):
 
     def add_row_dict(self, row_dict):
         '''Adds a row to the report table'''
-        row = []
-        for col_name in self.column_names:
-            if col_name in row_dict:
-                value = row_dict.pop(col_name)
-            else:
-                value = None
-            row.append(value)
-        if row_dict:
-            raise Exception('Have left-over keys not under a column: %s' % row_dict)
-        self.rows.append(row)
+        self.rows.append(_row_from_dict(self.column_names, row_dict))
 
     def get_rows_html_formatted(self, date_format='%d/%m/%y %H:%M',
                                 blank_cell_html=''):
         for row in self.rows:
-            row_formatted = row[:]
-            for i, cell in enumerate(row):
-                if isinstance(cell, datetime.datetime):
-                    row_formatted[i] = cell.strftime(date_format)
-                elif cell is None:
-                    row_formatted[i] = blank_cell_html
-            yield row_formatted
+            yield format_row_html(row, date_format, blank_cell_html)
 
     def get_csv(self):
         csvout = StringIO()
-        csvwriter = csv.writer(
-            csvout,
-            dialect='excel',
-            quoting=csv.QUOTE_NONNUMERIC
-        )
-        csvwriter.writerow(self.column_names)
+        writer = CSVReportWriter(csvout, self.column_names)
         for row in self.rows:
-            row_formatted = []
-            for cell in row:
-                if isinstance(cell, datetime.datetime):
-                    cell = cell.strftime('%Y-%m-%d %H:%M')
-                elif isinstance(cell, int):
-                    cell = str(cell)
-                elif isinstance(cell, (list, tuple)):
-                    cell = str(cell)
-                elif cell is None:
-                    cell = ''
-                else:
-                    cell = cell.encode('utf8')
-                row_formatted.append(cell)
-            try:
-                csvwriter.writerow(row_formatted)
-            except Exception as e:
-                raise Exception("%s: %s, %s"%(e, row, row_formatted))
+            writer.add_row(row)
         csvout.seek(0)
         return csvout.read()
+
+
+class ReportWriter(object):
+    '''
+    Base class for writers that output the report rows to a text file
+    object as they are added, so reports of any size can be written with
+    constant memory.
+    '''
+    def __init__(self, fileobj, column_names):
+        assert isinstance(column_names, (list, tuple))
+        self.fileobj = fileobj
+        self.column_names = column_names
+        self.row_count = 0
+        self.write_header()
+
+    def write_header(self):
+        pass
+
+    def add_row_dict(self, row_dict):
+        '''Writes a row to the report file'''
+        self.add_row(_row_from_dict(self.column_names, dict(row_dict)))
+
+    def add_row(self, row):
+        self.write_row(row)
+        self.row_count += 1
+
+    def write_row(self, row):
+        raise NotImplementedError
+
+
+class CSVReportWriter(ReportWriter):
+    '''Writes the report in CSV format, with a header row'''
+
+    def write_header(self):
+        self.csvwriter = csv.writer(
+            self.fileobj,
+            dialect='excel',
+            quoting=csv.QUOTE_NONNUMERIC
+        )
+        self.csvwriter.writerow(self.column_names)
+
+    def write_row(self, row):
+        row_formatted = [format_csv_cell(cell) for cell in row]
+        try:
+            self.csvwriter.writerow(row_formatted)
+        except Exception as e:
+            raise Exception("%s: %s, %s"%(e, row, row_formatted))
+
+
+class JSONLReportWriter(ReportWriter):
+    '''Writes the report as JSON lines, one object per row'''
+
+    def write_row(self, row):
+        self.fileobj.write(json.dumps(
+            dict(zip(self.column_names, row)), default=_json_default) + '\n')
+
+
+report_writers = {
+    'csv': CSVReportWriter,
+    'jsonl': JSONLReportWriter,
+}
@@ -3,72 +3,176 @@ import logging
 from lxml import etree
 
 from ckanext.spatial.harvesters import SpatialHarvester
-from ckanext.spatial.lib.report import ReportTable
+from ckanext.spatial.lib.report import ReportTable, report_writers
 from ckan import model
-from ckanext.harvest.model import HarvestObject
+from ckanext.harvest.model import HarvestObject, HarvestObjectError, \
+    HarvestSource
 
-def validation_report(package_id=None):
+VALIDATION_REPORT_COLUMNS = [
+    'Harvest Object id',
+    'GEMINI2 id',
+    'Date fetched',
+    'Dataset name',
+    'Publisher',
+    'Source URL',
+    'Old validation errors',
+    'New validation errors']
+
+DEFAULT_REPORT_CHUNK_SIZE = 500
+
+
+def _iter_chunks(rows, chunk_size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _get_chunk_contents(object_ids):
+    return dict(
+        model.Session.query(HarvestObject.id, HarvestObject.content).
+        filter(HarvestObject.id.in_(object_ids)))
+
+
+def _get_chunk_validation_errors(object_ids):
+    errors = {}
+    query = model.Session.query(
+        HarvestObjectError.harvest_object_id, HarvestObjectError.message).\
+        filter(HarvestObjectError.harvest_object_id.in_(object_ids))
+    for object_id, message in query:
+        if 'not a valid Gemini' in message or \
+                'Validating against' in message:
+            errors.setdefault(object_id, []).append(message)
+    return errors
+
+
+def _get_chunk_publishers(package_ids):
+    '''
+    Returns the title of the first active group of each package, preferring
+    the organization that publishes it
+    '''
+    publishers = {}
+    if not package_ids:
+        return publishers
+    query = model.Session.query(model.Member.table_id, model.Group.title).\
+        join(model.Group, model.Group.id == model.Member.group_id).\
+        filter(model.Member.table_name == 'package').\
+        filter(model.Member.state == 'active').\
+        filter(model.Group.state == 'active').\
+        filter(model.Member.table_id.in_(package_ids)).\
+        order_by(model.Group.is_organization.desc(), model.Group.title)
+    for package_id, title in query:
+        publishers.setdefault(package_id, title)
+    return publishers
+
+
+def iter_validation_report(package_id=None,
+                           chunk_size=DEFAULT_REPORT_CHUNK_SIZE):
     '''
     Looks at every harvested metadata record and compares the
     validation errors that it had on last import and what it would be with
     the current validators. Useful when going to update the validators.
 
-    Returns a ReportTable.
+    Records are read from the database in chunks of `chunk_size`, loading
+    the content, errors and publishers of each chunk with a single query
+    each, so memory use does not depend on the number of records.
+
+    Yields a dict for each record, with the VALIDATION_REPORT_COLUMNS keys.
     '''
     log = logging.getLogger(__name__ + '.validation_report')
 
     validators = SpatialHarvester()._get_validator()
     log.debug('Validators: %r', validators.profiles)
 
-    query = model.Session.query(HarvestObject).\
-            filter_by(current=True).\
-            order_by(HarvestObject.fetch_finished.desc())
+    query = model.Session.query(
+        HarvestObject.id,
+        HarvestObject.guid,
+        HarvestObject.fetch_finished,
+        HarvestObject.package_id,
+        model.Package.name,
+        HarvestSource.url).\
+        outerjoin(model.Package,
+                  model.Package.id == HarvestObject.package_id).\
+        join(HarvestSource,
+             HarvestSource.id == HarvestObject.harvest_source_id).\
+        filter(HarvestObject.current == True).\
+        order_by(HarvestObject.fetch_finished.desc())
 
     if package_id:
-        query = query.filter(HarvestObject.package_id==package_id)
-
-    report = ReportTable([
-        'Harvest Object id',
-        'GEMINI2 id',
-        'Date fetched',
-        'Dataset name',
-        'Publisher',
-        'Source URL',
-        'Old validation errors',
-        'New validation errors'])
+        query = query.filter(HarvestObject.package_id == package_id)
 
+    count = 0
     old_validation_failure_count = 0
     new_validation_failure_count = 0
 
-    for harvest_object in query:
-        validation_errors = []
-        for err in harvest_object.errors:
-            if 'not a valid Gemini' in err.message or \
-                   'Validating against' in err.message:
-                validation_errors.append(err.message)
-        if validation_errors:
-            old_validation_failure_count += 1
-
-        groups = harvest_object.package.get_groups()
-        publisher = groups[0].title if groups else '(none)'
-
-        xml = etree.fromstring(harvest_object.content.encode("utf-8"))
-        valid, errors = validators.is_valid(xml)
-        if not valid:
-            new_validation_failure_count += 1
-                         
-        report.add_row_dict({
-                             'Harvest Object id': harvest_object.id,
-                             'GEMINI2 id': harvest_object.guid,
-                             'Date fetched': harvest_object.fetch_finished,
-                             'Dataset name': harvest_object.package.name,
-                             'Publisher': publisher,
-                             'Source URL': harvest_object.source.url,
-                             'Old validation errors': '; '.join(validation_errors),
-                             'New validation errors': '; '.join(errors),
-                             })
-
-    log.debug('%i results', query.count())
+    for chunk in _iter_chunks(query.yield_per(chunk_size), chunk_size):
+        object_ids = [row[0] for row in chunk]
+        contents = _get_chunk_contents(object_ids)
+        old_errors = _get_chunk_validation_errors(object_ids)
+        publishers = _get_chunk_publishers(
+            list(set(row[3] for row in chunk if row[3])))
+
+        for object_id, guid, fetch_finished, object_package_id, \
+                package_name, source_url in chunk:
+            validation_errors = old_errors.get(object_id, [])
+            if validation_errors:
+                old_validation_failure_count += 1
+
+            content = contents.pop(object_id, None)
+            if content:
+                xml = etree.fromstring(content.encode("utf-8"))
+                valid, profile, errors = validators.is_valid(xml)
+                errors = [error[0] for error in errors]
+            else:
+                valid, errors = False, ['No content']
+            if not valid:
+                new_validation_failure_count += 1
+            count += 1
+
+            yield {
+                'Harvest Object id': object_id,
+                'GEMINI2 id': guid,
+                'Date fetched': fetch_finished,
+                'Dataset name': package_name,
+                'Publisher': publishers.get(object_package_id, '(none)'),
+                'Source URL': source_url,
+                'Old validation errors': '; '.join(validation_errors),
+                'New validation errors': '; '.join(errors),
+            }
+
+    log.debug('%i results', count)
     log.debug('%i failed old validation', old_validation_failure_count)
     log.debug('%i failed new validation', new_validation_failure_count)
+
+
+def validation_report(package_id=None):
+    '''
+    Returns a ReportTable with the rows of `iter_validation_report`.
+
+    All rows are kept in memory, use `write_validation_report` for large
+    numbers of records.
+    '''
+    report = ReportTable(VALIDATION_REPORT_COLUMNS)
+    for row in iter_validation_report(package_id=package_id):
+        report.add_row_dict(row)
     return report
+
+
+def write_validation_report(fileobj, format='csv', package_id=None,
+                            chunk_size=DEFAULT_REPORT_CHUNK_SIZE):
+    '''
+    Writes the validation report to a text file object as rows are
+    generated, in CSV or JSON lines ('jsonl') format.
+
+    Returns the number of rows written.
+    '''
+    writer = report_writers[format](fileobj, VALIDATION_REPORT_COLUMNS)
+    for row in iter_validation_report(package_id=package_id,
+                                      chunk_size=chunk_size):
+        writer.add_row_dict(row)
+    return writer.row_count
+
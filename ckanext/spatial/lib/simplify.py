@@ -0,0 +1,110 @@
+'''
+Reduces the number of vertices of the geometries indexed by the
+solr-spatial-field backend.
+
+Detailed geometries (eg coastlines or administrative boundaries) can have
+hundreds of thousands of vertices, which make indexing them in Solr slow and
+the index larger, while the spatial search only needs an approximation of
+them. Geometries are simplified with a topology preserving Douglas-Peucker
+algorithm, and the ones still above the maximum number of vertices are
+simplified with increasing tolerances, falling back to their convex hull or
+envelope.
+'''
+import logging
+
+import shapely
+import shapely.wkt
+
+log = logging.getLogger(__name__)
+
+# Number of times the tolerance is doubled before falling back to the
+# convex hull
+MAX_SIMPLIFY_STEPS = 10
+
+
+def num_coordinates(shape):
+    '''Returns the number of vertices of a shapely geometry'''
+    if hasattr(shapely, 'get_num_coordinates'):
+        return int(shapely.get_num_coordinates(shape))
+    # Previous versions of shapely
+    if hasattr(shape, 'geoms'):
+        return sum(num_coordinates(geom) for geom in shape.geoms)
+    if hasattr(shape, 'exterior'):
+        return len(shape.exterior.coords) + sum(
+            len(ring.coords) for ring in shape.interiors)
+    return len(shape.coords)
+
+
+def reduce_vertices(shape, max_vertices, tolerance=0):
+    '''
+    Returns a version of the geometry with at most `max_vertices` vertices:
+    the geometry simplified with the lowest tolerance (doubling it from
+    `tolerance` or the one that fits the extent) that meets it, or its
+    convex hull or envelope if none does.
+    '''
+    vertices = num_coordinates(shape)
+    if vertices <= max_vertices:
+        return shape
+
+    minx, miny, maxx, maxy = shape.bounds
+    step = max(tolerance, max(maxx - minx, maxy - miny) / max_vertices)
+    if step > 0:
+        for _ in range(MAX_SIMPLIFY_STEPS):
+            simplified = shape.simplify(step, preserve_topology=True)
+            if num_coordinates(simplified) <= max_vertices:
+                log.debug(
+                    'Simplified geometry from %d vertices with tolerance %s',
+                    vertices, step)
+                return simplified
+            step *= 2
+
+    hull = shape.convex_hull
+    if num_coordinates(hull) <= max_vertices:
+        log.warning(
+            'Geometry with %d vertices can not be simplified to %d vertices, '
+            'indexing its convex hull', vertices, max_vertices)
+        return hull
+
+    log.warning(
+        'Geometry with %d vertices can not be simplified to %d vertices, '
+        'indexing its envelope', vertices, max_vertices)
+    return shape.envelope
+
+
+def simplify(shape, tolerance=0, max_vertices=0):
+    '''
+    Simplifies a shapely geometry with the given tolerance (in degrees), and
+    reduces it to at most `max_vertices` vertices. Zero disables each of
+    them.
+    '''
+    if tolerance > 0:
+        shape = shape.simplify(tolerance, preserve_topology=True)
+    if max_vertices:
+        shape = reduce_vertices(shape, max_vertices, tolerance)
+    return shape
+
+
+def simplify_array(shapes, tolerance=0, max_vertices=0):
+    '''
+    Like `simplify`, for an array of shapely geometries (or None), with
+    the shapely 2 vectorized functions
+    '''
+    if tolerance > 0:
+        shapes = shapely.simplify(shapes, tolerance, preserve_topology=True)
+    else:
+        shapes = shapes.copy()
+    if max_vertices:
+        counts = shapely.get_num_coordinates(shapes)
+        for i in (counts > max_vertices).nonzero()[0]:
+            shapes[i] = reduce_vertices(shapes[i], max_vertices, tolerance)
+    return shapes
+
+
+def to_wkt(shape, precision=None):
+    '''
+    Returns the WKT of a shapely geometry, with the coordinates rounded to
+    `precision` decimals if set
+    '''
+    if precision is None:
+        return shape.wkt
+    return shapely.wkt.dumps(shape, trim=True, rounding_precision=precision)
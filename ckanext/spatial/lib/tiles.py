@@ -0,0 +1,157 @@
+'''
+Multi-resolution tile keys used to index extents as plain string tokens.
+
+The world (-180, -90, 180, 90) is split in a quadtree: at level z there are
+2^z x 2^z tiles of 360 / 2^z by 180 / 2^z degrees. Each tile is identified
+by its quadkey, a string of z digits (0-3), one per level, so the quadkey of
+a tile starts with the quadkeys of all its ancestors.
+
+An extent is covered with the tiles of the deepest level that keeps the
+number of tokens under a limit, and indexed with two kinds of tokens:
+
+* The quadkeys of the covering tiles and of all their ancestors, which
+  match queries for any tile containing part of the extent.
+* The quadkeys of the covering tiles followed by LEAF_SUFFIX, which match
+  queries for tiles contained in one of them.
+
+A query envelope is covered in the same way, and an extent intersects it
+(at the resolution of the tiles) if it has any of the quadkeys of the
+query tiles, or a leaf token for any of their ancestors.
+'''
+import math
+
+LEAF_SUFFIX = '.'
+MIN_LEVEL = 1
+MAX_LEVEL = 20
+
+
+def _split_antimeridian(bbox):
+    '''
+    Returns a list of (minx, miny, maxx, maxy) tuples within the world
+    bounds, splitting the bbox in two if it crosses the antimeridian.
+    '''
+    minx, maxx = bbox['minx'], bbox['maxx']
+    miny = max(min(bbox['miny'], bbox['maxy']), -90.0)
+    maxy = min(max(bbox['miny'], bbox['maxy']), 90.0)
+
+    if maxx - minx >= 360:
+        return [(-180.0, miny, 180.0, maxy)]
+
+    while minx < -180:
+        minx += 360
+        maxx += 360
+    while minx >= 180:
+        minx -= 360
+        maxx -= 360
+
+    if maxx > 180:
+        return [(minx, miny, 180.0, maxy), (-180.0, miny, maxx - 360, maxy)]
+    return [(minx, miny, maxx, maxy)]
+
+
+def _tile_range(value, origin, size, count):
+    index = int(math.floor((value - origin) / size))
+    return min(max(index, 0), count - 1)
+
+
+def quadkey(x, y, level):
+    '''Returns the quadkey of the tile in column `x` and row `y`'''
+    digits = []
+    for i in range(level, 0, -1):
+        mask = 1 << (i - 1)
+        digit = 0
+        if x & mask:
+            digit += 1
+        if y & mask:
+            digit += 2
+        digits.append(str(digit))
+    return ''.join(digits)
+
+
+def covering_tiles(bbox, level):
+    '''
+    Returns the set of quadkeys of the tiles at `level` that intersect the
+    bbox (a dict with the minx, miny, maxx and maxy keys)
+    '''
+    count = 2 ** level
+    width = 360.0 / count
+    height = 180.0 / count
+
+    tiles = set()
+    for minx, miny, maxx, maxy in _split_antimeridian(bbox):
+        x0 = _tile_range(minx, -180.0, width, count)
+        x1 = _tile_range(maxx, -180.0, width, count)
+        y0 = _tile_range(miny, -90.0, height, count)
+        y1 = _tile_range(maxy, -90.0, height, count)
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                tiles.add(quadkey(x, y, level))
+    return tiles
+
+
+def _count_tiles(bbox, level):
+    count = 2 ** level
+    width = 360.0 / count
+    height = 180.0 / count
+    total = 0
+    for minx, miny, maxx, maxy in _split_antimeridian(bbox):
+        columns = (_tile_range(maxx, -180.0, width, count) -
+                   _tile_range(minx, -180.0, width, count) + 1)
+        rows = (_tile_range(maxy, -90.0, height, count) -
+                _tile_range(miny, -90.0, height, count) + 1)
+        total += columns * rows
+    return total
+
+
+def _ancestors(tiles):
+    ancestors = set()
+    for tile in tiles:
+        for i in range(MIN_LEVEL, len(tile)):
+            ancestors.add(tile[:i])
+    return ancestors
+
+
+def _covering(bbox, max_tokens, max_level, count_tokens):
+    '''
+    Returns the covering tiles of the deepest level for which
+    `count_tokens(tiles)` does not exceed `max_tokens` (at least MIN_LEVEL)
+    '''
+    tiles = covering_tiles(bbox, MIN_LEVEL)
+    for level in range(MIN_LEVEL + 1, max_level + 1):
+        # Avoid building huge sets for levels that can't fit
+        if _count_tiles(bbox, level) > max_tokens:
+            break
+        level_tiles = covering_tiles(bbox, level)
+        if count_tokens(level_tiles) > max_tokens:
+            break
+        tiles = level_tiles
+    return tiles
+
+
+def index_tokens(bbox, max_tokens=64, max_level=MAX_LEVEL):
+    '''
+    Returns the sorted list of tokens to index for the extent bbox, using
+    at most `max_tokens` (except for the coarsest level, which has at most
+    eight).
+    '''
+    def count_tokens(tiles):
+        return 2 * len(tiles) + len(_ancestors(tiles) - tiles)
+
+    tiles = _covering(bbox, max_tokens, max_level, count_tokens)
+    tokens = tiles | _ancestors(tiles)
+    tokens.update(tile + LEAF_SUFFIX for tile in tiles)
+    return sorted(tokens)
+
+
+def query_tokens(bbox, max_tokens=64, max_level=MAX_LEVEL):
+    '''
+    Returns the sorted list of tokens that match the extents intersecting
+    the query bbox
+    '''
+    def count_tokens(tiles):
+        return len(tiles) + len(_ancestors(tiles))
+
+    tiles = _covering(bbox, max_tokens, max_level, count_tokens)
+    tokens = set(tiles)
+    tokens.update(tile + LEAF_SUFFIX for tile in _ancestors(tiles))
+    return sorted(tokens)
@@ -1,8 +1,6 @@
 import mimetypes
 from logging import getLogger
 
-import geojson
-
 import ckantoolkit as tk
 
 from ckan import plugins as p
@@ -18,7 +16,9 @@ else:
         SpatialQueryMixin, HarvestMetadataApiMixin
     )
 
-from ckanext.spatial.lib import normalize_bbox
+from ckanext.spatial.lib import normalize_bbox, quantize_bbox
+from ckanext.spatial.lib.geojson_utils import get_geojson_error
+from ckanext.spatial.lib.geometry_cache import get_cached_extent, MISSING
 from ckanext.spatial.search import search_backends
 
 config = tk.config
@@ -30,6 +30,8 @@ ALLOWED_SEARCH_BACKENDS = [
     "solr",         # Deprecated, please update to "solr-bbox"
     "solr-bbox",
     "solr-spatial-field",
+    "solr-bboxfield",
+    "solr-tiles",
 ]
 
 
@@ -37,6 +39,7 @@ class SpatialMetadata(p.SingletonPlugin):
 
     p.implements(p.IPackageController, inherit=True)
     p.implements(p.IConfigurer, inherit=True)
+    p.implements(p.IConfigurable, inherit=True)
     p.implements(p.ITemplateHelpers, inherit=True)
 
 
@@ -55,6 +58,15 @@ class SpatialMetadata(p.SingletonPlugin):
         mimetypes.add_type('application/json', '.geojson')
         mimetypes.add_type('application/gml+xml', '.gml')
 
+    # IConfigurable
+
+    def configure(self, config):
+        if tk.asbool(config.get('ckanext.spatial.warmup', False)):
+            # Compile validators, XSLT and XPath expressions once in this
+            # process so forked workers don't pay for it
+            from ckanext.spatial.util import warmup
+            warmup()
+
     # IPackageController
 
     def after_create(self, context, data_dict):
@@ -87,22 +99,23 @@ class SpatialMetadata(p.SingletonPlugin):
         if not geometry:
             return
 
-        # Check valid JSON
-        try:
-            log.debug("Received geometry: {}".format(geometry))
+        # Extents shared by many datasets are only validated once
+        extent = get_cached_extent(geometry)
+        if extent.error is MISSING:
+            extent.error = self._get_spatial_extra_error(geometry)
 
-            geometry = geojson.loads(str(geometry))
-        except ValueError as e:
-            error_dict = {
-                "spatial": ["Error decoding JSON object: {}".format(str(e))]}
-            raise tk.ValidationError(error_dict)
+        if extent.error:
+            raise tk.ValidationError(
+                {"spatial": list(extent.error["spatial"])})
 
-        if not hasattr(geometry, "is_valid") or not geometry.is_valid:
-            msg = "Error: Wrong GeoJSON object"
-            if hasattr(geometry, "errors"):
-                msg = msg + ": {}".format(geometry.errors())
-            error_dict = {"spatial": [msg]}
-            raise tk.ValidationError(error_dict)
+    def _get_spatial_extra_error(self, geometry):
+        '''
+        Returns the validation error dict for a spatial extra, or None if it
+        is a valid GeoJSON object
+        '''
+        log.debug("Received geometry: {}".format(geometry))
+
+        return get_geojson_error(geometry)
 
     # ITemplateHelpers
 
@@ -139,6 +152,25 @@ class SpatialQuery(SpatialQueryMixin, p.SingletonPlugin):
 
         return search_backend
 
+    def _quantize_bbox(self, bbox):
+        """
+        Returns the bbox snapped to the grid set in the
+        `ckanext.spatial.search_bbox_grid` option (a size in degrees or
+        `tiles`), or None if no grid is set.
+        """
+        grid = config.get("ckanext.spatial.search_bbox_grid")
+        if not grid or grid == "none":
+            return None
+        if grid == "tiles":
+            return quantize_bbox(bbox)
+        try:
+            grid = float(grid)
+        except ValueError:
+            raise ValueError(
+                "Wrong value for ckanext.spatial.search_bbox_grid: {}".format(grid)
+            )
+        return quantize_bbox(bbox, grid) if grid > 0 else None
+
     # IConfigure
 
     def update_config(self, config):
@@ -148,8 +180,10 @@ class SpatialQuery(SpatialQueryMixin, p.SingletonPlugin):
         qp = None
         if search_backend == "solr-bbox":
             qp = "frange"
-        elif search_backend == "solr-spatial-field":
+        elif search_backend in ("solr-spatial-field", "solr-bboxfield"):
             qp = "field"
+        elif search_backend == "solr-tiles":
+            qp = "terms"
         if qp:
             allowed_query_parsers = tk.aslist(config.get("ckan.search.solr_allowed_query_parsers", []))
             if qp not in allowed_query_parsers:
@@ -168,7 +202,7 @@ class SpatialQuery(SpatialQueryMixin, p.SingletonPlugin):
 
         search_backend = self._get_search_backend()
 
-        if search_backend not in ("solr-bbox", "solr-spatial-field"):
+        if search_backend not in search_backends:
             return pkg_dict
 
         if not pkg_dict.get('extras_spatial'):
@@ -200,7 +234,7 @@ class SpatialQuery(SpatialQueryMixin, p.SingletonPlugin):
                 raise SearchError('Wrong bounding box provided')
 
             search_params = search_backends[search_backend]().search_params(
-                bbox, search_params)
+                bbox, search_params, filter_bbox=self._quantize_bbox(bbox))
 
         return search_params
 
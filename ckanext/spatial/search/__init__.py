@@ -1,6 +1,8 @@
 import json
 import logging
+from collections import OrderedDict
 
+import shapely
 import shapely.geometry
 
 try:
@@ -10,19 +12,40 @@ except ImportError:
     # Previous version of shapely uses ValueError and TypeError
     GeometryError = (ValueError, TypeError)
 
+try:
+    import numpy as np
+    # Vectorized functions are available from shapely 2.0, and parsing
+    # GeoJSON needs GEOS 3.10
+    VECTORIZED = (
+        hasattr(shapely, "from_geojson") and shapely.geos_version >= (3, 10, 0)
+    )
+except ImportError:
+    VECTORIZED = False
+
 from ckantoolkit import config, asbool
-from ckanext.spatial.lib import normalize_bbox, fit_bbox, fit_linear_ring
+from ckanext.spatial.lib import (
+    normalize_bbox, fit_bbox, fit_bbox_array, fit_linear_ring
+)
+from ckanext.spatial.lib import extents, geojson_utils, simplify, tiles
+from ckanext.spatial.lib.geometry_cache import get_cached_extent, MISSING
 
 log = logging.getLogger(__name__)
 
+OUT_OF_BOUNDS_ERROR = """
+Geometries outside the -180, -90, 180, 90 boundaries are not supported,
+you need to split the geometry in order to fit the parts. Not indexing"""
+
 
 class SpatialSearchBackend:
     """Base class for all datastore backends."""
 
+    # Fields of the Solr document set when indexing a dataset
+    index_fields = ()
+
     def parse_geojson(self, geom_from_metadata):
 
         try:
-            geometry = json.loads(geom_from_metadata)
+            geometry = geojson_utils.loads(geom_from_metadata)
             return geometry
         except (AttributeError, ValueError) as e:
             log.error(
@@ -47,35 +70,141 @@ class SpatialSearchBackend:
             )
             return None
 
+    def shapes_from_geojson(self, values):
+        """
+        Returns an array with the shapely geometries of a list of GeoJSON
+        strings, parsed at once with the shapely 2 vectorized functions when
+        available. Missing values and geometries that can not be parsed
+        (which are logged) are None.
+        """
+        shapes = [None] * len(values)
+        indexes = [i for i, value in enumerate(values) if value]
+        if VECTORIZED and indexes:
+            parsed = shapely.from_geojson(
+                [values[i] for i in indexes], on_invalid="ignore")
+            for i, shape in zip(indexes, parsed):
+                shapes[i] = shape
+        # Parse one by one the ones that failed, to log the errors
+        for i in indexes:
+            if shapes[i] is None:
+                geometry = self.parse_geojson(values[i])
+                if geometry:
+                    shapes[i] = self.shape_from_geometry(geometry)
+        return shapes
+
+    def bounds_from_geojson(self, values):
+        """
+        Returns a list with the (minx, miny, maxx, maxy) bounds of each
+        GeoJSON string in `values`. Bounds of missing or wrong geometries
+        are None.
+
+        Bounds are kept in the geometry cache, so each distinct string is
+        only parsed once.
+        """
+        cached = _get_cached_extents(values)
+
+        pending = [
+            value for value, extent in cached.items()
+            if extent.bounds is MISSING
+        ]
+        for value, bounds in zip(pending, self._get_bounds(pending)):
+            cached[value].bounds = (
+                tuple(bounds) if _valid_bounds(bounds) else None)
+
+        return [cached[value].bounds if value else None for value in values]
+
+    def _get_bounds(self, values):
+        """
+        Returns the bounds of each GeoJSON string in `values`.
+
+        Bounds of points and rectangles are read straight from their
+        coordinates, shapely is only used for the rest of geometries.
+        """
+        all_bounds = [None] * len(values)
+        pending = []
+        for i, value in enumerate(values):
+            geometry = self.parse_geojson(value)
+            if geometry is None:
+                continue
+            bounds = extents.simple_bounds(geometry)
+            if bounds:
+                all_bounds[i] = bounds
+            else:
+                pending.append(i)
+
+        if pending:
+            shapes = self.shapes_from_geojson([values[i] for i in pending])
+            if VECTORIZED:
+                pending_bounds = shapely.bounds(_to_array(shapes)).tolist()
+            else:
+                pending_bounds = [
+                    shape.bounds if shape else None for shape in shapes]
+            for i, bounds in zip(pending, pending_bounds):
+                all_bounds[i] = bounds
+
+        return all_bounds
 
-class SolrBBoxSearchBackend(SpatialSearchBackend):
     def index_dataset(self, dataset_dict):
+        return self.index_datasets([dataset_dict])[0]
+
+    def index_datasets(self, dataset_dicts):
         """
-        We always index the envelope of the geometry regardless of
-        if it's an actual bounding box (polygon)
+        Adds the spatial fields to index to each of the dataset dicts,
+        returning them.
         """
+        raise NotImplementedError
+
 
-        geom_from_metadata = dataset_dict.get("spatial")
-        if not geom_from_metadata:
-            return dataset_dict
+def _get_cached_extents(values):
+    """
+    Returns a dict with the CachedExtent of each distinct non empty value
+    """
+    cached = OrderedDict()
+    for value in values:
+        if value and value not in cached:
+            cached[value] = get_cached_extent(value)
+    return cached
 
-        geometry = self.parse_geojson(geom_from_metadata)
-        shape = self.shape_from_geometry(geometry)
 
-        if not shape:
-            return dataset_dict
+def _to_array(shapes):
+    array = np.empty(len(shapes), dtype=object)
+    array[:] = shapes
+    return array
 
-        bounds = shape.bounds
 
-        bbox = normalize_bbox(list(bounds))
-        if not bbox:
-            return dataset_dict
+def _valid_bounds(bounds):
+    return (
+        bounds is not None
+        and len(bounds) == 4
+        and not any(value != value for value in bounds)
+    )
 
-        dataset_dict.update(bbox)
 
-        return dataset_dict
+class SolrBBoxSearchBackend(SpatialSearchBackend):
+    index_fields = ("minx", "miny", "maxx", "maxy")
 
-    def search_params(self, bbox, search_params):
+    def index_datasets(self, dataset_dicts):
+        """
+        We always index the envelope of the geometry regardless of
+        if it's an actual bounding box (polygon)
+        """
+
+        all_bounds = self.bounds_from_geojson(
+            [dataset_dict.get("spatial") for dataset_dict in dataset_dicts])
+
+        for dataset_dict, bounds in zip(dataset_dicts, all_bounds):
+            if not _valid_bounds(bounds):
+                continue
+
+            bbox = normalize_bbox(list(bounds))
+            if not bbox:
+                continue
+
+            dataset_dict.update(bbox)
+
+        return dataset_dicts
+
+    def search_params(self, bbox, search_params, filter_bbox=None):
         """
         This will add the following parameters to the query:
 
@@ -89,18 +218,38 @@ class SolrBBoxSearchBackend(SpatialSearchBackend):
                  target geometry T. It gives a ratio from 0 to 1 where 0 means
                  no overlap at all and 1 a perfect fit
 
-             fq - Adds a filter that force the value returned by the previous
-                  function to be between 0 and 1, effectively applying the
-                  spatial filter.
+             fq - Adds two filters:
+
+                  * A range query on the indexed bbox fields that selects the
+                    datasets whose extent intersects the query area. This is
+                    cheap and cached by Solr on its own. If `filter_bbox`
+                    is provided (eg a quantized version of the query bbox)
+                    it is used instead of `bbox`, so nearby searches reuse
+                    the same cached filter.
+
+                  * A filter that force the value returned by the previous
+                    function to be between 0 and 1, effectively applying the
+                    spatial filter. It is run as a post filter, so the
+                    function is only computed for the documents matching all
+                    the other filters, and not cached.
 
         """
 
-        while bbox["minx"] < -180:
-            bbox["minx"] += 360
-            bbox["maxx"] += 360
-        while bbox["minx"] > 180:
-            bbox["minx"] -= 360
-            bbox["maxx"] -= 360
+        shift = 0
+        while bbox["minx"] + shift < -180:
+            shift += 360
+        while bbox["minx"] + shift > 180:
+            shift -= 360
+
+        bbox = dict(bbox, minx=bbox["minx"] + shift, maxx=bbox["maxx"] + shift)
+        if filter_bbox:
+            filter_bbox = dict(
+                filter_bbox,
+                minx=filter_bbox["minx"] + shift,
+                maxx=filter_bbox["maxx"] + shift,
+            )
+        else:
+            filter_bbox = bbox
 
         values = dict(
             input_minx=bbox["minx"],
@@ -126,8 +275,16 @@ class SolrBBoxSearchBackend(SpatialSearchBackend):
             .replace(" ", "")
         )
 
+        range_query = (
+            "+maxx:[{minx} TO *] +minx:[* TO {maxx}] "
+            "+maxy:[{miny} TO *] +miny:[* TO {maxy}]".format(**filter_bbox)
+        )
+
         search_params["fq_list"] = search_params.get("fq_list", [])
-        search_params["fq_list"].append("{!frange incl=false l=0 u=1}%s" % bf)
+        search_params["fq_list"].append(range_query)
+        search_params["fq_list"].append(
+            "{!frange incl=false l=0 u=1 cache=false cost=100}%s" % bf
+        )
 
         search_params["bf"] = bf
         search_params["defType"] = "edismax"
@@ -136,16 +293,25 @@ class SolrBBoxSearchBackend(SpatialSearchBackend):
 
 
 class SolrSpatialFieldSearchBackend(SpatialSearchBackend):
-    def index_dataset(self, dataset_dict):
-        wkt = None
-        geom_from_metadata = dataset_dict.get("spatial")
-        if not geom_from_metadata:
-            return dataset_dict
+    index_fields = ("spatial_geom",)
+
+    def get_simplify_tolerance(self):
+        return float(config.get(
+            "ckanext.spatial.search_spatial_field.simplify_tolerance", 0))
 
-        geometry = self.parse_geojson(geom_from_metadata)
-        if not geometry:
-            return dataset_dict
+    def get_max_vertices(self):
+        return int(config.get(
+            "ckanext.spatial.search_spatial_field.max_vertices", 0))
 
+    def get_wkt_precision(self):
+        precision = config.get("ckanext.spatial.search_spatial_field.wkt_precision")
+        return int(precision) if precision not in (None, "") else None
+
+    def _bbox_wkts(self, geometry):
+        """
+        Returns the WKT of the bounding box polygons in the geometry, fixing
+        their orientation, or an empty list if there are none
+        """
         # We allow multiple geometries as GeometryCollections
         if geometry["type"] == "GeometryCollection":
             geometries = geometry["geometries"]
@@ -155,6 +321,15 @@ class SolrSpatialFieldSearchBackend(SpatialSearchBackend):
         # Check potential problems with bboxes in each geometry
         wkt = []
         for geom in geometries:
+            ring = extents.rectangle_ring(geom)
+            if ring:
+                # Axis-aligned rectangles are handled without shapely
+                polygon_wkt = extents.polygon_wkt(
+                    fit_linear_ring(ring if extents.is_ccw(ring) else ring[::-1])
+                )
+                if polygon_wkt:
+                    wkt.append(polygon_wkt)
+                    continue
             if (
                 geom["type"] == "Polygon"
                 and len(geom["coordinates"]) == 1
@@ -180,30 +355,104 @@ class SolrSpatialFieldSearchBackend(SpatialSearchBackend):
                         fit_linear_ring(lr_coords)
                     )
                     wkt.append(polygon.wkt)
+        return wkt
 
-        shape = self.shape_from_geometry(geometry)
-
-        if not wkt:
-            shape = shapely.geometry.shape(geometry)
-            if not shape.is_valid:
+    def _get_wkts(self, values):
+        """
+        Returns the WKT (or list of WKTs) to index for each GeoJSON string
+        in `values`, or None if it can not be indexed
+        """
+        wkts = [None] * len(values)
+
+        # Geometries that are not bounding boxes or points, which are
+        # parsed and checked with shapely all at once
+        pending = []
+
+        for i, value in enumerate(values):
+            geometry = self.parse_geojson(value)
+            if not geometry:
+                continue
+
+            wkt = self._bbox_wkts(geometry)
+            if wkt:
+                wkts[i] = wkt
+                continue
+
+            point = extents.point_coordinates(geometry)
+            wkt = point and extents.point_wkt(*point)
+            if wkt:
+                if -180 <= point[0] <= 180:
+                    wkts[i] = wkt
+                else:
+                    log.error(OUT_OF_BOUNDS_ERROR)
+                continue
+
+            pending.append(i)
+
+        if not pending:
+            return wkts
+
+        tolerance = self.get_simplify_tolerance()
+        max_vertices = self.get_max_vertices()
+        precision = self.get_wkt_precision()
+
+        shapes = self.shapes_from_geojson([values[i] for i in pending])
+        if VECTORIZED:
+            array = _to_array(shapes)
+            valid = shapely.is_valid(array)
+            all_bounds = shapely.bounds(array)
+            # Only valid geometries are simplified
+            array = simplify.simplify_array(
+                np.where(valid, array, None), tolerance, max_vertices)
+            pending_wkts = shapely.to_wkt(
+                array, rounding_precision=-1 if precision is None else precision)
+        else:
+            valid = [shape.is_valid if shape else False for shape in shapes]
+            all_bounds = [shape.bounds if shape else None for shape in shapes]
+            pending_wkts = [
+                simplify.to_wkt(
+                    simplify.simplify(shape, tolerance, max_vertices), precision)
+                if is_valid else None
+                for shape, is_valid in zip(shapes, valid)
+            ]
+
+        for i, is_valid, bounds, wkt in zip(
+            pending, valid, all_bounds, pending_wkts
+        ):
+            if not is_valid:
                 log.error("Wrong geometry, not indexing")
-                return dataset_dict
-            if shape.bounds[0] < -180 or shape.bounds[2] > 180:
-                log.error(
-                    """
-Geometries outside the -180, -90, 180, 90 boundaries are not supported,
-you need to split the geometry in order to fit the parts. Not indexing"""
-                )
-                return dataset_dict
-            wkt = shape.wkt
+                continue
+            if bounds[0] < -180 or bounds[2] > 180:
+                log.error(OUT_OF_BOUNDS_ERROR)
+                continue
+            wkts[i] = str(wkt)
+
+        return wkts
+
+    def index_datasets(self, dataset_dicts):
 
-        dataset_dict["spatial_geom"] = wkt
+        cached = _get_cached_extents(
+            [dataset_dict.get("spatial") for dataset_dict in dataset_dicts])
 
-        return dataset_dict
+        pending = [
+            value for value, extent in cached.items() if extent.wkt is MISSING
+        ]
+        for value, wkt in zip(pending, self._get_wkts(pending)):
+            cached[value].wkt = wkt
 
-    def search_params(self, bbox, search_params):
+        for dataset_dict in dataset_dicts:
+            value = dataset_dict.get("spatial")
+            wkt = cached[value].wkt if value else None
+            if wkt:
+                # Don't share the cached lists between datasets
+                dataset_dict["spatial_geom"] = (
+                    list(wkt) if isinstance(wkt, list) else wkt)
 
-        bbox = fit_bbox(bbox)
+        return dataset_dicts
+
+    def search_params(self, bbox, search_params, filter_bbox=None):
+
+        bbox = fit_bbox(filter_bbox or bbox)
 
         if not search_params.get("fq_list"):
             search_params["fq_list"] = []
@@ -219,7 +468,141 @@ you need to split the geometry in order to fit the parts. Not indexing"""
         return search_params
 
 
+class SolrBBoxFieldSearchBackend(SpatialSearchBackend):
+    """
+    Indexes the extent of the geometries in a Solr BBoxField, which
+    supports filtering and overlap ratio scoring natively.
+    """
+
+    field_name = "spatial_bbox"
+    index_fields = (field_name,)
+
+    def index_datasets(self, dataset_dicts):
+
+        all_bounds = self.bounds_from_geojson(
+            [dataset_dict.get("spatial") for dataset_dict in dataset_dicts])
+
+        # Extents crossing the antimeridian end up with minx > maxx, which
+        # BBoxField supports
+        if VECTORIZED:
+            all_bounds = fit_bbox_array([
+                bounds if _valid_bounds(bounds) else [np.nan] * 4
+                for bounds in all_bounds
+            ])
+        else:
+            all_bounds = [
+                fit_bbox(normalize_bbox(list(bounds)))
+                if _valid_bounds(bounds) else None
+                for bounds in all_bounds
+            ]
+            all_bounds = [
+                (bbox["minx"], bbox["miny"], bbox["maxx"], bbox["maxy"])
+                if bbox else None
+                for bbox in all_bounds
+            ]
+
+        for dataset_dict, bounds in zip(dataset_dicts, all_bounds):
+            if not _valid_bounds(bounds):
+                continue
+            dataset_dict[self.field_name] = "ENVELOPE({}, {}, {}, {})".format(
+                float(bounds[0]), float(bounds[2]), float(bounds[3]), float(bounds[1])
+            )
+
+        return dataset_dicts
+
+    def search_params(self, bbox, search_params, filter_bbox=None):
+        """
+        This will add the following parameters to the query:
+
+            fq - An Intersects filter with the query bbox (or `filter_bbox`
+                 if provided)
+            boost - A boost function with the overlap ratio between the
+                    query bbox and the dataset extent, computed by Solr, to
+                    sort the results spatially. (bf is not used because it
+                    is split on whitespace)
+            defType - edismax (We need to define EDisMax to use boost)
+        """
+
+        envelope = "ENVELOPE({minx},{maxx},{maxy},{miny})"
+
+        search_params["fq_list"] = search_params.get("fq_list", [])
+        search_params["fq_list"].append(
+            "{{!field f={field}}}Intersects({envelope})".format(
+                field=self.field_name,
+                envelope=envelope.format(**fit_bbox(filter_bbox or bbox)),
+            )
+        )
+
+        search_params["boost"] = (
+            "query({{!field f={field} score=overlapRatio "
+            "v='Intersects({envelope})'}})".format(
+                field=self.field_name,
+                envelope=envelope.format(**fit_bbox(bbox)),
+            )
+        )
+        search_params["defType"] = "edismax"
+
+        return search_params
+
+
+class SolrTilesSearchBackend(SpatialSearchBackend):
+    """
+    Indexes the extent of the geometries as a set of multi-resolution tile
+    keys (see ckanext.spatial.lib.tiles) in a multivalued string field, so
+    spatial filters are plain term queries.
+
+    Results are approximate: extents that don't intersect the query bbox
+    but share a tile with it are also returned. It does not support
+    spatial sorting.
+    """
+
+    field_name = "spatial_tiles"
+    index_fields = (field_name,)
+
+    def get_max_tokens(self):
+        return int(config.get("ckanext.spatial.search_tiles.max_tokens", 64))
+
+    def index_datasets(self, dataset_dicts):
+
+        all_bounds = self.bounds_from_geojson(
+            [dataset_dict.get("spatial") for dataset_dict in dataset_dicts])
+        max_tokens = self.get_max_tokens()
+
+        for dataset_dict, bounds in zip(dataset_dicts, all_bounds):
+            if not _valid_bounds(bounds):
+                continue
+
+            bbox = normalize_bbox(list(bounds))
+            if not bbox:
+                continue
+
+            dataset_dict[self.field_name] = tiles.index_tokens(
+                bbox, max_tokens=max_tokens)
+
+        return dataset_dicts
+
+    def search_params(self, bbox, search_params, filter_bbox=None):
+        """
+        This will add a filter query with the tile tokens that match the
+        extents intersecting the query bbox (or `filter_bbox` if provided)
+        """
+
+        tokens = tiles.query_tokens(
+            filter_bbox or bbox, max_tokens=self.get_max_tokens())
+
+        search_params["fq_list"] = search_params.get("fq_list", [])
+        search_params["fq_list"].append(
+            "{{!terms f={field}}}{tokens}".format(
+                field=self.field_name, tokens=",".join(tokens)
+            )
+        )
+
+        return search_params
+
+
 search_backends = {
     "solr-bbox": SolrBBoxSearchBackend,
     "solr-spatial-field": SolrSpatialFieldSearchBackend,
+    "solr-bboxfield": SolrBBoxFieldSearchBackend,
+    "solr-tiles": SolrTilesSearchBackend,
 }
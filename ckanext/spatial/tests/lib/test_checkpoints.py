@@ -0,0 +1,98 @@
+import logging
+
+from ckanext.spatial.lib import checkpoints
+from ckanext.spatial.lib.checkpoints import GatherCheckpoint
+
+
+query = {"url": "http://csw.example.com", "outputschema": "gmd", "cql": None}
+
+
+def _checkpoint(tmp_path, job_id="job-1", query=query, max_age=3600):
+    return GatherCheckpoint(
+        "source-1", job_id, query, directory=str(tmp_path), max_age=max_age
+    )
+
+
+def test_no_checkpoint(tmp_path):
+    assert _checkpoint(tmp_path).load() == (0, set())
+
+
+def test_resume_from_last_page(tmp_path):
+    checkpoint = _checkpoint(tmp_path)
+    checkpoint.start()
+    checkpoint.add_page(10, ["a", "b"])
+    checkpoint.add_page(20, ["c"])
+
+    retry = _checkpoint(tmp_path, job_id="job-2")
+    assert retry.load() == (20, {"a", "b", "c"})
+
+
+def test_incomplete_last_line_ignored(tmp_path):
+    checkpoint = _checkpoint(tmp_path)
+    checkpoint.start()
+    checkpoint.add_page(10, ["a"])
+    with open(checkpoint.path, "a") as f:
+        f.write('{"next": 20, "identif')
+
+    retry = _checkpoint(tmp_path, job_id="job-2")
+    assert retry.load() == (10, {"a"})
+
+    retry.start()
+    retry.add_page(20, ["b"])
+    assert _checkpoint(tmp_path).load() == (20, {"a", "b"})
+
+
+def test_different_query_discarded(tmp_path):
+    checkpoint = _checkpoint(tmp_path)
+    checkpoint.start()
+    checkpoint.add_page(10, ["a"])
+
+    other = _checkpoint(tmp_path, query=dict(query, cql="dc:type = 'dataset'"))
+    assert other.load() == (0, set())
+
+
+def test_expired_checkpoint_discarded(tmp_path):
+    checkpoint = _checkpoint(tmp_path)
+    checkpoint.start()
+    checkpoint.add_page(10, ["a"])
+
+    assert _checkpoint(tmp_path, max_age=-1).load() == (0, set())
+
+
+def test_start_without_resume_resets(tmp_path):
+    checkpoint = _checkpoint(tmp_path)
+    checkpoint.start()
+    checkpoint.add_page(10, ["a"])
+
+    _checkpoint(tmp_path, job_id="job-2").start(resume=False)
+    assert _checkpoint(tmp_path).load() == (0, set())
+
+
+def test_clear(tmp_path):
+    checkpoint = _checkpoint(tmp_path)
+    checkpoint.start()
+    checkpoint.add_page(10, ["a"])
+    checkpoint.clear()
+
+    assert _checkpoint(tmp_path).load() == (0, set())
+
+
+def test_no_checkpoint_logged(tmp_path, caplog):
+    with caplog.at_level(logging.INFO):
+        _checkpoint(tmp_path).load()
+
+    assert "No gather checkpoint found at" in caplog.text
+
+
+def test_disabled_without_directory(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(checkpoints, "get_checkpoint_dir", lambda: None)
+    with caplog.at_level(logging.WARNING):
+        checkpoint = GatherCheckpoint("source-1", "job-1", query)
+
+    assert "checkpoint_dir is not set" in caplog.text
+    assert not checkpoint.enabled
+    checkpoint.start()
+    checkpoint.add_page(10, ["a"])
+    checkpoint.clear()
+    assert checkpoint.load() == (0, set())
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,54 @@
+import threading
+
+from ckanext.spatial.lib.compiled import CompiledPool
+
+
+def test_compiled_objects_are_reused():
+    pool = CompiledPool()
+    built = []
+
+    def build():
+        built.append(object())
+        return built[-1]
+
+    pool.warmup("a", build)
+    with pool.get("a", build) as value:
+        assert value is built[0]
+    with pool.get("a", build) as value:
+        assert value is built[0]
+
+    assert len(built) == 1
+    assert pool.size("a") == 1
+
+
+def test_compiled_objects_in_use_are_not_shared():
+    pool = CompiledPool()
+    pool.warmup("a", object)
+
+    with pool.get("a", object) as first:
+        with pool.get("a", object) as second:
+            assert first is not second
+            assert pool.size("a") == 0
+
+    assert pool.size("a") == 2
+
+
+def test_compiled_objects_from_other_threads():
+    pool = CompiledPool()
+    built = []
+
+    def build():
+        built.append(object())
+        return built[-1]
+
+    pool.warmup("a", build)
+
+    def work():
+        with pool.get("a", build) as value:
+            assert value is built[0]
+
+    thread = threading.Thread(target=work)
+    thread.start()
+    thread.join()
+
+    assert len(built) == 1
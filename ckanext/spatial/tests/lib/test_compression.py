@@ -0,0 +1,55 @@
+import gzip
+
+import pytest
+
+from ckanext.spatial.lib import compression
+
+DOCUMENT = u'<?xml version="1.0" encoding="UTF-8"?>\n<doc>caf\xe9</doc>' * 50
+
+
+def test_gzip_roundtrip():
+    value = compression.compress_document(DOCUMENT, 'gzip')
+
+    assert isinstance(value, str)
+    assert len(value) < len(DOCUMENT)
+    assert compression.decompress_document(value, 'gzip') == DOCUMENT
+    assert gzip.decompress(
+        compression.get_compressed_bytes(value, 'gzip')
+    ).decode('utf-8') == DOCUMENT
+
+
+def test_gzip_is_deterministic():
+    assert (compression.compress_document(DOCUMENT, 'gzip') ==
+            compression.compress_document(DOCUMENT, 'gzip'))
+
+
+def test_plain_documents_are_returned_as_is():
+    assert compression.decompress_document(DOCUMENT, None) == DOCUMENT
+    assert compression.get_compressed_bytes(DOCUMENT, None) is None
+
+
+def test_zstd_roundtrip():
+    pytest.importorskip('zstandard')
+    value = compression.compress_document(DOCUMENT, 'zstd')
+
+    assert compression.decompress_document(value, 'zstd') == DOCUMENT
+    assert compression.get_compressed_bytes(value, 'zstd') is None
+
+
+@pytest.mark.parametrize('codec', [None, 'gzip', 'zstd'])
+def test_iter_decompressed(codec):
+    if codec == 'zstd':
+        pytest.importorskip('zstandard')
+    value = DOCUMENT
+    if codec:
+        value = compression.compress_document(DOCUMENT, codec)
+
+    chunks = list(compression.iter_decompressed(value, codec, chunk_size=100))
+
+    assert all(len(chunk) <= 100 for chunk in chunks if codec)
+    assert b''.join(chunks).decode('utf-8') == DOCUMENT
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        compression.compress_document(DOCUMENT, 'lzma')
@@ -0,0 +1,82 @@
+import pytest
+
+from shapely.geometry import Point, Polygon, LinearRing
+
+from ckanext.spatial.lib import extents
+
+
+def _polygon(ring):
+    return {"type": "Polygon", "coordinates": [ring]}
+
+
+rectangle = [[-84, 38], [-80, 38], [-80, 42], [-84, 42], [-84, 38]]
+
+
+def test_point():
+    geometry = {"type": "Point", "coordinates": [100, 2.5]}
+
+    assert extents.point_coordinates(geometry) == (100.0, 2.5)
+    assert extents.simple_bounds(geometry) == (100.0, 2.5, 100.0, 2.5)
+
+
+@pytest.mark.parametrize("geometry", [
+    {"type": "Point", "coordinates": [100, 2, 3]},
+    {"type": "Point", "coordinates": [100, "2"]},
+    {"type": "Point", "coordinates": [100, True]},
+    {"type": "Point", "coordinates": [100, float("nan")]},
+    {"type": "LineString", "coordinates": [[100, 0], [101, 1]]},
+    [100, 2],
+])
+def test_not_a_point(geometry):
+    assert extents.point_coordinates(geometry) is None
+
+
+def test_rectangle():
+    geometry = _polygon(rectangle)
+
+    assert extents.rectangle_ring(geometry) == [tuple(map(float, p)) for p in rectangle]
+    assert extents.simple_bounds(geometry) == (-84.0, 38.0, -80.0, 42.0)
+
+
+@pytest.mark.parametrize("ring", [
+    # Not axis-aligned
+    [[-84, 38], [-84, 40], [-80, 42], [-80, 38], [-84, 38]],
+    # Not closed
+    [[-84, 38], [-80, 38], [-80, 42], [-84, 42], [-84, 39]],
+    # No area
+    [[-84, 38], [-80, 38], [-80, 42], [-80, 38], [-84, 38]],
+    [[5, 5], [5, 5], [5, 5], [5, 5], [5, 5]],
+    # 3D
+    [[-84, 38, 0], [-80, 38, 0], [-80, 42, 0], [-84, 42, 0], [-84, 38, 0]],
+])
+def test_not_a_rectangle(ring):
+    assert extents.rectangle_ring(_polygon(ring)) is None
+    assert extents.simple_bounds(_polygon(ring)) is None
+
+
+def test_rectangle_with_holes():
+    geometry = {"type": "Polygon", "coordinates": [rectangle, rectangle]}
+
+    assert extents.rectangle_ring(geometry) is None
+
+
+def test_is_ccw():
+    ring = [tuple(p) for p in rectangle]
+
+    assert extents.is_ccw(ring) == LinearRing(ring).is_ccw
+    assert extents.is_ccw(ring[::-1]) == LinearRing(ring[::-1]).is_ccw
+
+
+@pytest.mark.parametrize("x, y", [
+    (100, 2), (-0.0, 0.5), (174.123456, -38.1), (0.0001, 1e-3), (12.5, -45.123),
+])
+def test_wkt_like_shapely(x, y):
+    assert extents.point_wkt(x, y) == Point(x, y).wkt
+
+    ring = [(x, y), (x + 1, y), (x + 1, y + 1), (x, y + 1), (x, y)]
+    assert extents.polygon_wkt(ring) == Polygon(ring).wkt
+
+
+def test_wkt_number_not_supported():
+    assert extents.format_wkt_number(1e-5) is None
+    assert extents.point_wkt(1e-5, 2) is None
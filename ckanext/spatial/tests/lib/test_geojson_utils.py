@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+from ckanext.spatial.lib import geojson_utils
+
+
+ring = [[-84, 38], [-80, 38], [-80, 42], [-84, 42], [-84, 38]]
+
+extents = [
+    {"type": "Point", "coordinates": [100, 2.5]},
+    {"type": "Point", "coordinates": [100, 2.5, 3]},
+    {"type": "Point", "coordinates": [100]},
+    {"type": "Point", "coordinates": [100, [2, 3]]},
+    {"type": "Point", "coordinates": [100, True]},
+    {"type": "Point", "coordinates": []},
+    {"type": "Point"},
+    {"type": "MultiPoint", "coordinates": [[100, 2], [101, 3]]},
+    {"type": "MultiPoint", "coordinates": [[100, 2], [101], 5]},
+    {"type": "LineString", "coordinates": [[100, 0], [101, 1]]},
+    {"type": "LineString", "coordinates": [[100, 0]]},
+    {"type": "LineString", "coordinates": [[100, 0], 5]},
+    {"type": "MultiLineString", "coordinates": [[[100, 0], [101, 1]], 5]},
+    {"type": "Polygon", "coordinates": [ring]},
+    {"type": "Polygon", "coordinates": [ring, ring]},
+    {"type": "Polygon", "coordinates": [ring[:3]]},
+    {"type": "Polygon", "coordinates": [ring[:4] + [[-84, 39]]]},
+    {"type": "Polygon", "coordinates": [ring[:4] + [[-84.0000001, 38]]]},
+    {"type": "Polygon", "coordinates": [ring, 5]},
+    {"type": "Polygon", "coordinates": []},
+    {"type": "MultiPolygon", "coordinates": [[ring], [ring[:3]], 5]},
+    {"type": "GeometryCollection", "geometries": [
+        {"type": "Point", "coordinates": [100]},
+        {"type": "Polygon", "coordinates": [ring]},
+        {"type": "GeometryCollection", "geometries": [
+            {"type": "LineString", "coordinates": [[100, 0]]},
+        ]},
+    ]},
+    {"type": "GeometryCollection"},
+    # Handled by python-geojson
+    {"type": "Point", "coordinates": [100, "2"]},
+    {"type": "Point", "coordinates": [100, None]},
+    {"type": "Point", "coordinates": [100, 2], "bbox": [100, 2, 100, 2]},
+    {"type": "Feature", "geometry": {"type": "Point", "coordinates": [100]},
+     "properties": {}},
+    {"type": "FeatureCollection", "features": []},
+    {"type": "Unknown", "coordinates": [100, 2]},
+    {"coordinates": [100, 2]},
+    [100, 2],
+]
+
+
+def _geojson_error(value):
+    return geojson_utils._geojson_error(value)
+
+
+@pytest.mark.parametrize("extent", extents)
+def test_same_errors_as_geojson(extent):
+    value = json.dumps(extent)
+
+    assert geojson_utils.get_geojson_error(value) == _geojson_error(value)
+
+
+@pytest.mark.parametrize("value", [
+    "",
+    "not json",
+    '{"type": "Point", "coordinates": [NaN, 1]}',
+    '{"type": "Point", "coordinates": [Infinity, 1]}',
+])
+def test_same_decoding_errors_as_geojson(value):
+    error = geojson_utils.get_geojson_error(value)
+
+    assert error == _geojson_error(value)
+    assert error["spatial"][0].startswith("Error decoding JSON object")
+
+
+def test_valid_extent():
+    value = json.dumps({"type": "Polygon", "coordinates": [ring]})
+
+    assert geojson_utils.get_geojson_error(value) is None
+
+
+def test_geometry_errors_unsupported():
+    with pytest.raises(geojson_utils.UnsupportedGeoJSON):
+        geojson_utils.geometry_errors(
+            {"type": "Feature", "geometry": None, "properties": {}})
+
+
+def test_loads_rejects_constants():
+    with pytest.raises(ValueError):
+        geojson_utils.loads('{"type": "Point", "coordinates": [NaN, 1]}')
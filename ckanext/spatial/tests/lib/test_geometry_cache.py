@@ -0,0 +1,33 @@
+import pytest
+
+from ckanext.spatial.lib import geometry_cache
+from ckanext.spatial.lib.lru import LRUCache
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = LRUCache(10)
+    monkeypatch.setattr(geometry_cache, "_geometry_cache", cache)
+    return cache
+
+
+def test_same_extent_is_shared(cache):
+    extent = geometry_cache.get_cached_extent('{"type":"Point","coordinates":[1,2]}')
+    assert extent.bounds is geometry_cache.MISSING
+
+    extent.bounds = (1, 2, 1, 2)
+
+    assert geometry_cache.get_cached_extent(
+        '{"type":"Point","coordinates":[1,2]}').bounds == (1, 2, 1, 2)
+    assert geometry_cache.get_cached_extent(
+        '{"type":"Point","coordinates":[2,1]}').bounds is geometry_cache.MISSING
+    assert len(cache) == 2
+
+
+def test_cache_disabled(cache):
+    cache.maxsize = 0
+    extent = geometry_cache.get_cached_extent('{"type":"Point","coordinates":[1,2]}')
+    extent.bounds = (1, 2, 1, 2)
+
+    assert geometry_cache.get_cached_extent(
+        '{"type":"Point","coordinates":[1,2]}').bounds is geometry_cache.MISSING
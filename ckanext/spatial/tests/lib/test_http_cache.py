@@ -0,0 +1,142 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Thread
+
+import pytest
+import requests
+
+from ckanext.spatial.lib import http_cache
+
+
+class CountingHandler(BaseHTTPRequestHandler):
+    requests_received = 0
+
+    def _respond(self, body):
+        CountingHandler.requests_received += 1
+        body = body.encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._respond("<xml>{}</xml>".format(self.path))
+
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        self._respond(self.rfile.read(length).decode("utf8"))
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    CountingHandler.requests_received = 0
+    httpd = HTTPServer(("127.0.0.1", 0), CountingHandler)
+    thread = Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield "http://127.0.0.1:{}".format(httpd.server_address[1])
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    yield str(tmp_path / "cache.sqlite")
+    http_cache.close_caches()
+
+
+def test_cache_mode_serves_stored_responses(server, cache_path):
+    session = http_cache.get_session("cache", cache_path)
+
+    first = session.get(server + "/doc.xml")
+    second = session.get(server + "/doc.xml")
+
+    assert CountingHandler.requests_received == 1
+    assert second.status_code == 200
+    assert second.text == first.text == "<xml>/doc.xml</xml>"
+    assert second.encoding == "utf-8"
+    assert b"".join(second.iter_content(4)) == b"<xml>/doc.xml</xml>"
+
+
+def test_cache_mode_max_age(server, cache_path):
+    session = http_cache.get_session("cache", cache_path, max_age=60)
+    session.get(server + "/doc.xml")
+    session.get(server + "/doc.xml")
+    assert CountingHandler.requests_received == 1
+
+    # Stored two minutes ago
+    cache = http_cache.get_cache(cache_path)
+    cache._conn.execute("UPDATE responses SET created = created - 120")
+
+    session.get(server + "/doc.xml")
+    assert CountingHandler.requests_received == 2
+
+
+def test_post_body_is_part_of_the_key(server, cache_path):
+    session = http_cache.get_session("cache", cache_path)
+
+    first = session.post(server + "/csw", data="<GetRecords page='1'/>")
+    second = session.post(server + "/csw", data="<GetRecords page='2'/>")
+    session.post(server + "/csw", data="<GetRecords page='1'/>")
+
+    assert CountingHandler.requests_received == 2
+    assert first.text != second.text
+
+
+def test_replay_after_record(server, cache_path):
+    session = http_cache.get_session("record", cache_path)
+    session.get(server + "/doc.xml")
+    session.get(server + "/doc.xml")
+    assert CountingHandler.requests_received == 2
+
+    session = http_cache.get_session("replay", cache_path, max_age=1)
+    cache = http_cache.get_cache(cache_path)
+    cache._conn.execute("UPDATE responses SET created = created - 120")
+    response = session.get(server + "/doc.xml")
+    assert CountingHandler.requests_received == 2
+    assert response.text == "<xml>/doc.xml</xml>"
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        session.get(server + "/other.xml")
+    assert CountingHandler.requests_received == 2
+
+
+def test_other_requests_not_cached(server, cache_path):
+    session = http_cache.get_session("cache", cache_path)
+    session.get(server + "/doc.xml")
+
+    requests.get(server + "/doc.xml")
+    assert CountingHandler.requests_received == 2
+
+
+def test_use_session(server, cache_path):
+    session = http_cache.get_session("cache", cache_path)
+    session.get(server + "/doc.xml")
+
+    with http_cache.use_session(session):
+        # Requests from libraries that don't accept a session
+        requests.get(server + "/doc.xml")
+    assert CountingHandler.requests_received == 1
+
+    requests.get(server + "/doc.xml")
+    assert CountingHandler.requests_received == 2
+
+
+def test_off_by_default(server, cache_path):
+    session = http_cache.get_session()
+
+    session.get(server + "/doc.xml")
+    session.get(server + "/doc.xml")
+    assert CountingHandler.requests_received == 2
+
+
+@pytest.mark.parametrize("mode", ["off", "cache"])
+def test_adapter_pool_size(cache_path, mode):
+    session = http_cache.get_session(mode, cache_path, pool_maxsize=20)
+
+    adapter = session.get_adapter("https://example.com")
+    assert adapter._pool_maxsize == 20
+    assert session.get_adapter("http://example.com") is adapter
@@ -0,0 +1,56 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from ckanext.spatial.lib.lru import LRUCache
+
+
+def test_lru_discards_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+
+    cache.set("c", 3)
+
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.get("b") is None
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_lru_disabled():
+    cache = LRUCache(maxsize=0)
+    cache.set("a", 1)
+    assert cache.get("a", "missing") == "missing"
+    assert len(cache) == 0
+
+
+def test_lru_maxbytes():
+    cache = LRUCache(maxsize=10, maxbytes=10)
+    cache.set("a", b"1234")
+    cache.set("b", b"1234")
+    assert cache.bytes == 8
+
+    cache.set("c", b"1234")
+
+    assert "a" not in cache
+    assert cache.bytes == 8
+
+    # Values larger than the limit are not cached
+    cache.set("b", b"12345678901")
+    assert "b" not in cache
+    assert cache.bytes == 4
+    assert cache.get("c") == b"1234"
+
+
+def test_lru_from_multiple_threads():
+    cache = LRUCache(maxsize=50)
+
+    def work(i):
+        cache.set(i % 80, i)
+        return cache.get(i % 80)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(work, range(2000)))
+
+    assert len(cache) == 50
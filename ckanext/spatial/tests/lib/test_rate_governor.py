@@ -0,0 +1,161 @@
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+from ckanext.spatial.lib import rate_governor
+from ckanext.spatial.lib.rate_governor import HostGovernor, GovernedAdapter
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    """Stand-in for a slow metadata server"""
+
+    latency = 0.1
+    status = 200
+    in_flight = 0
+    max_in_flight = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with SlowHandler.lock:
+            SlowHandler.in_flight += 1
+            SlowHandler.max_in_flight = max(
+                SlowHandler.max_in_flight, SlowHandler.in_flight
+            )
+        time.sleep(SlowHandler.latency)
+        with SlowHandler.lock:
+            SlowHandler.in_flight -= 1
+        self.send_response(SlowHandler.status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    SlowHandler.latency = 0.1
+    SlowHandler.status = 200
+    SlowHandler.max_in_flight = 0
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), SlowHandler)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield "http://127.0.0.1:{}".format(httpd.server_address[1])
+    httpd.shutdown()
+    httpd.server_close()
+    rate_governor.reset()
+
+
+def _session():
+    session = requests.Session()
+    session.mount("http://", GovernedAdapter())
+    return session
+
+
+def _get_many(url, count, workers=8):
+    session = _session()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda i: session.get(url), range(count)))
+
+
+def test_backs_off_on_errors():
+    governor = HostGovernor(max_concurrency=8, target_latency=1)
+
+    governor.acquire()
+    governor.release(0.1, error=True)
+    assert governor.concurrency == 4
+    assert governor.interval > 0
+
+    interval = governor.interval
+    governor.acquire()
+    governor.release(2)
+    assert governor.concurrency == 2
+    assert governor.interval == interval
+
+
+def test_recovers_on_success():
+    governor = HostGovernor(max_concurrency=4, target_latency=1)
+    governor.acquire()
+    governor.release(0.1, error=True)
+
+    for i in range(20):
+        governor.acquire()
+        governor.release(0.1)
+
+    assert governor.concurrency == 4
+    assert governor.interval == 0
+
+
+def test_never_below_min_concurrency():
+    governor = HostGovernor(
+        max_concurrency=8, min_concurrency=2, target_latency=1
+    )
+    for i in range(10):
+        governor.acquire()
+        governor.release(2)
+
+    assert governor.concurrency == 2
+
+
+def test_not_governed_by_default(server):
+    assert rate_governor.get_governor(server) is None
+
+
+def test_concurrency_limit(server):
+    rate_governor.configure_host(server, {"max_concurrency": 2})
+
+    _get_many(server, 8)
+
+    assert SlowHandler.max_in_flight == 2
+
+
+def test_max_rate(server):
+    SlowHandler.latency = 0
+    rate_governor.configure_host(server, {"max_rate": 10})
+
+    start = time.time()
+    _get_many(server, 5)
+
+    # Five requests at 10 per second need at least 0.4 seconds
+    assert time.time() - start >= 0.4
+
+
+def test_limits_divided_among_processes(server, monkeypatch):
+    monkeypatch.setitem(
+        rate_governor.config, "ckanext.spatial.harvest.rate_governor.processes", "3"
+    )
+    rate_governor.configure_host(server, {"max_concurrency": 7, "max_rate": 6})
+
+    governor = rate_governor.get_governor(server)
+
+    assert governor.max_concurrency == 2
+    assert governor.min_interval == 0.5
+
+
+def test_slow_server_reduces_concurrency(server):
+    SlowHandler.latency = 0.3
+    rate_governor.configure_host(
+        server, {"max_concurrency": 4, "target_latency": 0.1}
+    )
+
+    _get_many(server, 8)
+
+    governor = rate_governor.get_governor(server)
+    assert governor.concurrency == 1
+    assert governor.interval == 0
+
+
+def test_server_errors_reduce_concurrency(server):
+    SlowHandler.latency = 0
+    SlowHandler.status = 503
+    rate_governor.configure_host(server, {"max_concurrency": 4})
+
+    responses = _get_many(server, 4, workers=1)
+
+    assert all(r.status_code == 503 for r in responses)
+    assert rate_governor.get_governor(server).concurrency == 1
@@ -0,0 +1,58 @@
+import csv
+import datetime
+import json
+from io import StringIO
+
+from ckanext.spatial.lib.report import (
+    CSVReportWriter,
+    JSONLReportWriter,
+    ReportTable,
+)
+
+COLUMNS = ["Id", "Date", "Errors"]
+ROWS = [
+    {"Id": "a", "Date": datetime.datetime(2020, 1, 2, 3, 4), "Errors": "Bad"},
+    {"Id": "b", "Date": None, "Errors": u"Caf\xe9"},
+]
+
+
+def test_csv_writer_streams_rows():
+    out = StringIO()
+    writer = CSVReportWriter(out, COLUMNS)
+    writer.add_row_dict(ROWS[0])
+    # Rows are written straight away
+    assert out.getvalue().count("\n") == 2
+
+    writer.add_row_dict(ROWS[1])
+    assert writer.row_count == 2
+
+    out.seek(0)
+    assert list(csv.reader(out)) == [
+        COLUMNS,
+        ["a", "2020-01-02 03:04", "Bad"],
+        ["b", "", u"Caf\xe9"],
+    ]
+
+
+def test_jsonl_writer():
+    out = StringIO()
+    writer = JSONLReportWriter(out, COLUMNS)
+    for row in ROWS:
+        writer.add_row_dict(row)
+
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert lines == [
+        {"Id": "a", "Date": "2020-01-02T03:04:00", "Errors": "Bad"},
+        {"Id": "b", "Date": None, "Errors": u"Caf\xe9"},
+    ]
+
+
+def test_report_table_csv_matches_writer():
+    table = ReportTable(COLUMNS)
+    out = StringIO()
+    writer = CSVReportWriter(out, COLUMNS)
+    for row in ROWS:
+        table.add_row_dict(dict(row))
+        writer.add_row_dict(row)
+
+    assert table.get_csv() == out.getvalue()
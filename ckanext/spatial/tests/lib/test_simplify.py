@@ -0,0 +1,83 @@
+import math
+
+import pytest
+import shapely
+import shapely.geometry
+
+from ckanext.spatial.lib import simplify
+
+
+def _circle(vertices):
+    return shapely.geometry.Polygon([
+        (math.cos(2 * math.pi * i / vertices), math.sin(2 * math.pi * i / vertices))
+        for i in range(vertices)
+    ])
+
+
+def test_num_coordinates():
+    polygon = shapely.geometry.Polygon(
+        [(0, 0), (4, 0), (4, 4), (0, 4)], [[(1, 1), (2, 1), (2, 2), (1, 1)]])
+
+    assert simplify.num_coordinates(polygon) == 9
+    assert simplify.num_coordinates(
+        shapely.geometry.MultiPolygon([polygon, polygon])) == 18
+
+
+def test_simplify_tolerance():
+    circle = _circle(1000)
+
+    simplified = simplify.simplify(circle, tolerance=0.01)
+
+    assert simplify.num_coordinates(simplified) < 100
+    assert simplified.is_valid
+
+
+def test_simplify_nothing_to_do():
+    circle = _circle(100)
+
+    assert simplify.simplify(circle) is circle
+    assert simplify.simplify(circle, max_vertices=101) is circle
+
+
+@pytest.mark.parametrize("max_vertices", [5, 20, 100])
+def test_reduce_vertices(max_vertices):
+    reduced = simplify.reduce_vertices(_circle(1000), max_vertices)
+
+    assert simplify.num_coordinates(reduced) <= max_vertices
+    assert reduced.geom_type == "Polygon"
+
+
+def test_reduce_vertices_convex_hull():
+    islands = shapely.geometry.MultiPolygon([
+        shapely.geometry.box(i, 0, i + 0.5, 0.5) for i in range(10)
+    ])
+
+    reduced = simplify.reduce_vertices(islands, 10)
+
+    assert reduced.equals(islands.convex_hull)
+
+
+def test_reduce_vertices_envelope():
+    reduced = simplify.reduce_vertices(_circle(100), 3)
+
+    assert reduced.equals(shapely.geometry.box(-1, -1, 1, 1))
+
+
+def test_simplify_array():
+    if not hasattr(shapely, "from_wkt"):
+        pytest.skip("The vectorized functions need shapely 2")
+    shapes = shapely.from_wkt([_circle(1000).wkt, None, "POINT (1 2)"])
+
+    simplified = simplify.simplify_array(shapes, max_vertices=50)
+
+    assert simplify.num_coordinates(simplified[0]) <= 50
+    assert simplified[1] is None
+    assert simplified[2].equals(shapes[2])
+    assert simplify.num_coordinates(shapes[0]) == 1001
+
+
+def test_to_wkt():
+    point = shapely.geometry.Point(1.23456, -0.5)
+
+    assert simplify.to_wkt(point) == point.wkt
+    assert simplify.to_wkt(point, precision=2) == "POINT (1.23 -0.5)"
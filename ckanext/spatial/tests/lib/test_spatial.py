@@ -1,4 +1,4 @@
-from ckanext.spatial.lib import normalize_bbox, fit_bbox
+from ckanext.spatial.lib import normalize_bbox, fit_bbox, fit_bbox_array, quantize_bbox
 
 
 bbox_dict = {"minx": -4.96, "miny": 55.70, "maxx": -3.78, "maxy": 56.43}
@@ -43,3 +43,58 @@ def test_fit_out_of_bounds():
         "maxx": -165,
         "maxy": -85,
     }
+
+
+def test_quantize_grid():
+
+    bbox_dict = {"minx": -4.9612, "miny": 55.7034, "maxx": -3.781, "maxy": 56.4299}
+    assert quantize_bbox(bbox_dict, 0.01) == {
+        "minx": -4.97,
+        "miny": 55.7,
+        "maxx": -3.78,
+        "maxy": 56.43,
+    }
+
+
+def test_quantize_nearby_bboxes():
+
+    bbox_1 = {"minx": -4.961, "miny": 55.701, "maxx": -3.781, "maxy": 56.432}
+    bbox_2 = {"minx": -4.962, "miny": 55.704, "maxx": -3.785, "maxy": 56.431}
+    assert quantize_bbox(bbox_1) == quantize_bbox(bbox_2)
+
+
+def test_quantize_tiles_contains_bbox():
+
+    res = quantize_bbox(bbox_dict)
+    assert res["minx"] <= bbox_dict["minx"]
+    assert res["miny"] <= bbox_dict["miny"]
+    assert res["maxx"] >= bbox_dict["maxx"]
+    assert res["maxy"] >= bbox_dict["maxy"]
+    # Tiles of 360 / 2^10 degrees
+    assert res["minx"] * 2 ** 10 / 360 == int(res["minx"] * 2 ** 10 / 360)
+
+
+def test_quantize_bounds():
+
+    # 7 doesn't divide 360, the snapped world must not wrap around
+    res = quantize_bbox({"minx": -180, "miny": -89.99, "maxx": 180, "maxy": 89.99}, 7)
+    assert res == {"minx": -180, "miny": -90, "maxx": 180, "maxy": 90}
+    assert fit_bbox(res) == res
+
+
+def test_quantize_antimeridian():
+
+    res = quantize_bbox({"minx": 258, "miny": 37, "maxx": 281, "maxy": 51}, 7)
+    assert res == {"minx": 252, "miny": 35, "maxx": 287, "maxy": 56}
+
+    res = quantize_bbox({"minx": 170, "miny": 37, "maxx": 181, "maxy": 51}, 7)
+    assert res["maxx"] == 182
+
+
+def test_fit_bbox_array():
+
+    bounds = [[-185, -95, 195, 95], [-4.96, 55.70, -3.78, 56.43], [180, 90, 360, -90]]
+    res = fit_bbox_array(bounds)
+    for row, expected in zip(res, bounds):
+        bbox = fit_bbox(dict(zip(("minx", "miny", "maxx", "maxy"), expected)))
+        assert list(row) == [bbox["minx"], bbox["miny"], bbox["maxx"], bbox["maxy"]]
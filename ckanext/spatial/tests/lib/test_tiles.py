@@ -0,0 +1,66 @@
+import random
+
+from ckanext.spatial.lib import tiles
+
+
+def _bbox(minx, miny, maxx, maxy):
+    return {"minx": minx, "miny": miny, "maxx": maxx, "maxy": maxy}
+
+
+def _intersects(a, b):
+    return any(
+        p[0] <= q[2] and q[0] <= p[2] and p[1] <= q[3] and q[1] <= p[3]
+        for p in tiles._split_antimeridian(a)
+        for q in tiles._split_antimeridian(b)
+    )
+
+
+def test_quadkey():
+    assert tiles.quadkey(0, 0, 1) == "0"
+    assert tiles.quadkey(1, 1, 1) == "3"
+    assert tiles.quadkey(3, 2, 2) == "31"
+    assert tiles.quadkey(1, 2, 2) == "21"
+
+
+def test_covering_tiles():
+    assert tiles.covering_tiles(_bbox(-180, -90, 180, 90), 1) == {
+        "0", "1", "2", "3"}
+    assert tiles.covering_tiles(_bbox(10, 10, 20, 20), 1) == {"3"}
+
+
+def test_covering_tiles_antimeridian():
+    assert tiles.covering_tiles(_bbox(170, 10, 190, 20), 1) == {"2", "3"}
+
+
+def test_index_tokens_limit():
+    for max_tokens in (8, 16, 64):
+        tokens = tiles.index_tokens(
+            _bbox(-84, 38, -80, 42), max_tokens=max_tokens)
+        assert len(tokens) <= max_tokens
+        assert len(tokens) == len(set(tokens))
+
+
+def test_index_tokens_point():
+    tokens = tiles.index_tokens(_bbox(1, 1, 1, 1), max_level=10)
+    assert len(tokens) == 11
+    assert tokens[-1].endswith(tiles.LEAF_SUFFIX)
+
+
+def test_query_matches_all_intersecting_extents():
+    random.seed(1)
+
+    def random_bbox():
+        x, y = random.uniform(-200, 190), random.uniform(-90, 80)
+        width = random.choice([0, 0.01, 0.5, 5, 40, 200])
+        height = random.choice([0, 0.01, 0.5, 5, 40])
+        return _bbox(x, y, x + width, min(y + height, 90))
+
+    extents = [random_bbox() for _ in range(300)]
+    extent_tokens = [set(tiles.index_tokens(e, max_tokens=32)) for e in extents]
+
+    for _ in range(50):
+        query = random_bbox()
+        tokens = set(tiles.query_tokens(query, max_tokens=32))
+        for extent, indexed in zip(extents, extent_tokens):
+            if _intersects(extent, query):
+                assert indexed & tokens, (extent, query)
@@ -1,3 +1,6 @@
+import datetime
+import gzip
+
 import pytest
 
 from ckan.model import Session
@@ -78,3 +81,146 @@ class TestHarvestedMetadataAPI(SpatialTestBase):
             == '<?xml version="1.0" encoding="UTF-8"?>\n'
             + "<xml>Original Content 2</xml>"
         )
+
+    def test_conditional_requests(self, app, migrate_db_for):
+
+        migrate_db_for("harvest")
+
+        try:
+            from ckanext.harvest.model import (
+                HarvestObject,
+                HarvestJob,
+                HarvestSource,
+                HarvestObjectExtra,
+            )
+        except ImportError:
+            raise pytest.skip("The harvester extension is needed for these tests")
+
+        ho = HarvestObject(
+            guid="test-ho-1",
+            job=HarvestJob(source=HarvestSource(url="http://", type="xx")),
+            content="<xml>Content 1</xml>",
+            fetch_finished=datetime.datetime(2020, 5, 4, 10, 30),
+        )
+        hoe = HarvestObjectExtra(
+            key="original_document", value="<xml>Original 1</xml>", object=ho
+        )
+        Session.add(ho)
+        Session.add(hoe)
+        Session.commit()
+
+        for path in ("html", "original", "html/original"):
+            url = "/harvest/object/{0}/{1}".format(ho.id, path)
+            r = app.get(url, status=200)
+            etag = r.headers["ETag"]
+            assert etag.startswith('"')
+            assert r.headers["Last-Modified"] == "Mon, 04 May 2020 10:30:00 GMT"
+            assert "max-age" in r.headers["Cache-Control"]
+
+            r = app.get(url, headers={"If-None-Match": etag}, status=304)
+            assert r.headers["ETag"] == etag
+            app.get(url, headers={"If-None-Match": '"other"'}, status=200)
+
+            app.get(
+                url,
+                headers={"If-Modified-Since": "Mon, 04 May 2020 10:30:00 GMT"},
+                status=304,
+            )
+            app.get(
+                url,
+                headers={"If-Modified-Since": "Mon, 04 May 2020 10:29:59 GMT"},
+                status=200,
+            )
+
+        # Different representations have different ETags
+        etags = set(
+            app.get("/harvest/object/{0}/{1}".format(ho.id, path)).headers["ETag"]
+            for path in ("html", "original", "html/original")
+        )
+        assert len(etags) == 3
+
+        # Fetching the object again changes them
+        ho.fetch_finished = datetime.datetime(2020, 5, 5, 10, 30)
+        Session.commit()
+        assert etag != app.get(
+            "/harvest/object/{0}/html/original".format(ho.id)).headers["ETag"]
+
+    def test_compressed_responses(self, app, migrate_db_for):
+
+        migrate_db_for("harvest")
+
+        try:
+            from ckanext.harvest.model import (
+                HarvestObject,
+                HarvestJob,
+                HarvestSource,
+                HarvestObjectExtra,
+            )
+        except ImportError:
+            raise pytest.skip("The harvester extension is needed for these tests")
+
+        original = "<xml>{0}</xml>".format("<item>Original</item>" * 10000)
+        ho = HarvestObject(
+            guid="test-ho-1",
+            job=HarvestJob(source=HarvestSource(url="http://", type="xx")),
+            content="<xml>Content 1</xml>",
+        )
+        hoe = HarvestObjectExtra(key="original_document", value=original, object=ho)
+        Session.add(ho)
+        Session.add(hoe)
+        Session.commit()
+
+        url = "/harvest/object/{0}/original".format(ho.id)
+        plain = app.get(url, status=200)
+        assert "Content-Encoding" not in plain.headers
+
+        r = app.get(url, headers={"Accept-Encoding": "gzip"}, status=200)
+        assert r.headers["Content-Encoding"] == "gzip"
+        assert r.headers["Vary"] == "Accept-Encoding"
+        assert r.headers["ETag"] != plain.headers["ETag"]
+        assert len(r.data) < len(original)
+        assert gzip.decompress(r.data).decode("utf-8") == (
+            '<?xml version="1.0" encoding="UTF-8"?>\n' + original
+        )
+
+    def test_compressed_original_document(self, app, migrate_db_for):
+
+        migrate_db_for("harvest")
+
+        try:
+            from ckanext.harvest.model import (
+                HarvestObject,
+                HarvestJob,
+                HarvestSource,
+                HarvestObjectExtra,
+            )
+        except ImportError:
+            raise pytest.skip("The harvester extension is needed for these tests")
+
+        from ckanext.spatial.lib import compression
+
+        original = "<xml>{0}</xml>".format("<item>Original</item>" * 10000)
+        ho = HarvestObject(
+            guid="test-ho-1",
+            job=HarvestJob(source=HarvestSource(url="http://", type="xx")),
+            content="<xml>Content 1</xml>",
+        )
+        Session.add(ho)
+        Session.add(HarvestObjectExtra(
+            key="original_document",
+            value=compression.compress_document(original, "gzip"),
+            object=ho,
+        ))
+        Session.add(HarvestObjectExtra(
+            key=compression.ENCODING_EXTRA_KEY, value="gzip", object=ho
+        ))
+        Session.commit()
+
+        url = "/harvest/object/{0}/original".format(ho.id)
+        r = app.get(url, status=200)
+        assert r.body == '<?xml version="1.0" encoding="UTF-8"?>\n' + original
+
+        r = app.get(url, headers={"Accept-Encoding": "gzip"}, status=200)
+        assert gzip.decompress(r.data).decode("utf-8") == (
+            '<?xml version="1.0" encoding="UTF-8"?>\n' + original
+        )
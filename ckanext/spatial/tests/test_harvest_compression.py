@@ -0,0 +1,145 @@
+import pytest
+
+from ckan.model import Session
+
+from ckanext.spatial import util
+from ckanext.spatial.lib import compression
+
+DOCUMENT = u"<metadata><idinfo>Caf\xe9</idinfo></metadata>" * 100
+
+
+@pytest.fixture
+def harvest_model(migrate_db_for):
+    migrate_db_for("harvest")
+    try:
+        from ckanext.harvest import model as harvest_model
+    except ImportError:
+        raise pytest.skip("The harvester extension is needed for these tests")
+    return harvest_model
+
+
+def _create_object(harvest_model):
+    harvest_object = harvest_model.HarvestObject(
+        guid="test-ho",
+        job=harvest_model.HarvestJob(
+            source=harvest_model.HarvestSource(url="http://", type="xx")),
+    )
+    Session.add(harvest_object)
+    return harvest_object
+
+
+def _create_plain_object(harvest_model, value=DOCUMENT):
+    harvest_object = _create_object(harvest_model)
+    Session.add(harvest_model.HarvestObjectExtra(
+        key="original_document", value=value, object=harvest_object))
+    return harvest_object
+
+
+def _get_extras(harvest_model, harvest_object, key):
+    return Session.query(harvest_model.HarvestObjectExtra).filter_by(
+        harvest_object_id=harvest_object.id, key=key).all()
+
+
+@pytest.mark.usefixtures("with_plugins", "clean_db")
+@pytest.mark.ckan_config("ckan.plugins", "harvest")
+class TestOriginalDocumentStorage(object):
+    @pytest.mark.parametrize("codec", [None, "gzip", "zstd"])
+    def test_roundtrip(self, harvest_model, ckan_config, monkeypatch, codec):
+        if codec == "zstd":
+            pytest.importorskip("zstandard")
+        from ckanext.spatial.harvesters.base import SpatialHarvester
+
+        monkeypatch.setitem(
+            ckan_config,
+            "ckanext.spatial.harvest.original_document_compression",
+            codec or "none")
+        harvester = SpatialHarvester()
+        harvest_object = _create_object(harvest_model)
+        for extra in harvester._create_original_document_extras(
+                harvest_object, DOCUMENT, "fgdc"):
+            Session.add(extra)
+        Session.commit()
+
+        stored = _get_extras(harvest_model, harvest_object, "original_document")
+        encoding = _get_extras(
+            harvest_model, harvest_object, compression.ENCODING_EXTRA_KEY)
+        if codec:
+            assert stored[0].value != DOCUMENT
+            assert [extra.value for extra in encoding] == [codec]
+        else:
+            assert stored[0].value == DOCUMENT
+            assert encoding == []
+
+        assert harvester._get_original_document(harvest_object) == DOCUMENT
+        assert util.get_harvest_object_original_content(
+            harvest_object.id) == DOCUMENT
+
+    def test_legacy_plain_document(self, harvest_model):
+        from ckanext.spatial.harvesters.base import SpatialHarvester
+
+        harvest_object = _create_plain_object(harvest_model)
+        Session.commit()
+
+        assert SpatialHarvester()._get_original_document(
+            harvest_object) == DOCUMENT
+        assert util.get_harvest_object_original_content(
+            harvest_object.id) == DOCUMENT
+
+
+@pytest.mark.usefixtures("with_plugins", "clean_db")
+@pytest.mark.ckan_config("ckan.plugins", "harvest")
+class TestCompactOriginalDocuments(object):
+    def _create_objects(self, harvest_model):
+        plain = [_create_plain_object(harvest_model) for i in range(3)]
+        compressed = _create_object(harvest_model)
+        Session.add(harvest_model.HarvestObjectExtra(
+            key="original_document",
+            value=compression.compress_document(DOCUMENT, "gzip"),
+            object=compressed))
+        Session.add(harvest_model.HarvestObjectExtra(
+            key=compression.ENCODING_EXTRA_KEY, value="gzip",
+            object=compressed))
+        Session.commit()
+        return plain, compressed
+
+    def test_dry_run(self, harvest_model):
+        plain, compressed = self._create_objects(harvest_model)
+
+        count, before, after = util.compact_original_documents(dry_run=True)
+
+        assert count == 3
+        assert after < before
+        for harvest_object in plain:
+            assert _get_extras(harvest_model, harvest_object,
+                               "original_document")[0].value == DOCUMENT
+            assert not _get_extras(harvest_model, harvest_object,
+                                   compression.ENCODING_EXTRA_KEY)
+
+    def test_compact(self, harvest_model):
+        plain, compressed = self._create_objects(harvest_model)
+
+        count, before, after = util.compact_original_documents(batch_size=2)
+
+        assert count == 3
+        for harvest_object in plain + [compressed]:
+            encoding = _get_extras(harvest_model, harvest_object,
+                                   compression.ENCODING_EXTRA_KEY)
+            assert [extra.value for extra in encoding] == ["gzip"]
+            assert util.get_harvest_object_original_content(
+                harvest_object.id) == DOCUMENT
+
+    def test_compact_twice(self, harvest_model):
+        plain, compressed = self._create_objects(harvest_model)
+        util.compact_original_documents()
+        values = [
+            _get_extras(harvest_model, harvest_object,
+                        "original_document")[0].value
+            for harvest_object in plain
+        ]
+
+        assert util.compact_original_documents() == (0, 0, 0)
+        for harvest_object, value in zip(plain, values):
+            assert _get_extras(harvest_model, harvest_object,
+                               "original_document")[0].value == value
+            assert len(_get_extras(harvest_model, harvest_object,
+                                   compression.ENCODING_EXTRA_KEY)) == 1
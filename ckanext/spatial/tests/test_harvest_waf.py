@@ -0,0 +1,127 @@
+import json
+
+import pytest
+
+from ckan.model import Session
+
+from ckanext.spatial.tests.xml_file_server import serve, PORT
+
+WAF_URL = "http://127.0.0.1:{0}/gemini2.1-waf/index.html".format(PORT)
+
+
+@pytest.fixture(scope="module")
+def xml_server():
+    serve()
+
+
+@pytest.fixture
+def harvest_job(migrate_db_for, xml_server):
+    migrate_db_for("harvest")
+    try:
+        from ckanext.harvest.model import HarvestJob, HarvestSource
+    except ImportError:
+        raise pytest.skip("The harvester extension is needed for these tests")
+
+    def create(config):
+        source = HarvestSource(url=WAF_URL, type="waf", config=json.dumps(config))
+        job = HarvestJob(source=source)
+        Session.add(source)
+        Session.add(job)
+        Session.commit()
+        return job
+
+    return create
+
+
+def _get_harvester():
+    from ckanext.spatial.harvesters import WAFHarvester
+    return WAFHarvester()
+
+
+def _get_object(id_):
+    from ckanext.harvest.model import HarvestObject
+    return Session.query(HarvestObject).get(id_)
+
+
+def _object_errors(harvest_object):
+    from ckanext.harvest.model import HarvestObjectError
+    return Session.query(HarvestObjectError).filter_by(
+        harvest_object_id=harvest_object.id).all()
+
+
+@pytest.mark.usefixtures("with_plugins", "clean_db")
+@pytest.mark.ckan_config("ckan.plugins", "harvest waf_harvester")
+class TestWAFPrefetch(object):
+    def test_gather_prefetches_documents(self, harvest_job):
+        job = harvest_job({"prefetch": True, "prefetch_workers": 2})
+
+        ids = _get_harvester().gather_stage(job)
+
+        assert len(ids) == 2
+        for id_ in ids:
+            harvest_object = _get_object(id_)
+            assert "<gmd:MD_Metadata" in harvest_object.content
+            assert not _object_errors(harvest_object)
+
+    def test_gather_without_prefetch(self, harvest_job):
+        job = harvest_job({})
+
+        ids = _get_harvester().gather_stage(job)
+
+        assert len(ids) == 2
+        assert all(_get_object(id_).content is None for id_ in ids)
+
+    def test_fetch_skips_prefetched_documents(self, harvest_job, monkeypatch):
+        job = harvest_job({"prefetch": True})
+        harvester = _get_harvester()
+        ids = harvester.gather_stage(job)
+
+        def fail(*args, **kwargs):
+            raise AssertionError("The document should not be downloaded")
+
+        monkeypatch.setattr(harvester, "_get_content_as_unicode", fail)
+        for id_ in ids:
+            assert harvester.fetch_stage(_get_object(id_)) is True
+
+    def test_failed_prefetch_is_fetched_later(self, harvest_job, monkeypatch):
+        job = harvest_job({"prefetch": True})
+        harvester = _get_harvester()
+        get_content = harvester._get_content_as_unicode
+
+        def fail_wales1(url, session=None):
+            if url.endswith("wales1.xml"):
+                raise IOError("Connection reset")
+            return get_content(url, session=session)
+
+        monkeypatch.setattr(harvester, "_get_content_as_unicode", fail_wales1)
+        ids = harvester.gather_stage(job)
+
+        objects = {}
+        for id_ in ids:
+            harvest_object = _get_object(id_)
+            url = harvester._get_object_extra(harvest_object, "waf_location")
+            objects[url.rsplit("/", 1)[1]] = harvest_object
+        # The failed download is not reported as an error yet
+        assert objects["wales1.xml"].content is None
+        assert not _object_errors(objects["wales1.xml"])
+        assert objects["wales2.xml"].content
+
+        monkeypatch.setattr(harvester, "_get_content_as_unicode", get_content)
+        assert harvester.fetch_stage(objects["wales1.xml"]) is True
+        assert "<gmd:MD_Metadata" in _get_object(objects["wales1.xml"].id).content
+
+    def test_failed_fetch_is_reported(self, harvest_job, monkeypatch):
+        job = harvest_job({"prefetch": True})
+        harvester = _get_harvester()
+
+        def fail(url, session=None):
+            raise IOError("Connection reset")
+
+        monkeypatch.setattr(harvester, "_get_content_as_unicode", fail)
+        ids = harvester.gather_stage(job)
+
+        harvest_object = _get_object(ids[0])
+        assert harvester.fetch_stage(harvest_object) is False
+        errors = _object_errors(harvest_object)
+        assert len(errors) == 1
+        assert "Connection reset" in errors[0].message
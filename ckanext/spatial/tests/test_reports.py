@@ -0,0 +1,44 @@
+import pytest
+
+from ckan import model
+import ckan.tests.factories as factories
+
+
+@pytest.fixture
+def get_chunk_publishers(migrate_db_for):
+    migrate_db_for("harvest")
+    try:
+        from ckanext.spatial.lib.reports import _get_chunk_publishers
+    except ImportError:
+        raise pytest.skip("The harvester extension is needed for these tests")
+    return _get_chunk_publishers
+
+
+@pytest.mark.usefixtures("with_plugins", "clean_db")
+@pytest.mark.ckan_config("ckan.plugins", "harvest")
+class TestChunkPublishers(object):
+    def _create_dataset(self):
+        org = factories.Organization(title="Publisher")
+        group = factories.Group(title="A group")
+        dataset = factories.Dataset(
+            owner_org=org["id"], groups=[{"id": group["id"]}])
+        return org, group, dataset
+
+    def test_organization_preferred(self, get_chunk_publishers):
+        org, group, dataset = self._create_dataset()
+
+        assert get_chunk_publishers([dataset["id"]]) == {
+            dataset["id"]: "Publisher"}
+
+    def test_deleted_groups_ignored(self, get_chunk_publishers):
+        org, group, dataset = self._create_dataset()
+        model.Group.get(org["id"]).state = "deleted"
+        model.Session.commit()
+
+        assert get_chunk_publishers([dataset["id"]]) == {
+            dataset["id"]: "A group"}
+
+        model.Group.get(group["id"]).state = "deleted"
+        model.Session.commit()
+
+        assert get_chunk_publishers([dataset["id"]]) == {}
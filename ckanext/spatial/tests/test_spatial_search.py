@@ -1,13 +1,24 @@
 # -*- coding: utf-8 -*-
 import json
+import math
+
 import pytest
 
+from ckan import model
 from ckan.lib.search import SearchError
+from ckan.model.package_extra import PackageExtra
 
 import ckan.tests.helpers as helpers
 import ckan.tests.factories as factories
 
-from ckanext.spatial.tests.base import SpatialTestBase
+from ckanext.spatial import util
+from ckanext.spatial.search import (
+    SolrBBoxSearchBackend,
+    SolrBBoxFieldSearchBackend,
+    SolrSpatialFieldSearchBackend,
+    search_backends,
+)
+from ckanext.spatial.tests.base import SpatialTestBase, geojson_examples
 
 extents = {
     "nz": """
@@ -78,6 +89,108 @@ class TestBBoxSearch(SpatialTestBase):
                 extras={"ext_bbox": "-10,-20,10,a"},
             )
 
+    def _change_extent_without_indexing(self):
+        dataset = factories.Dataset(
+            extras=[{"key": "spatial", "value": extents["ohio"]}]
+        )
+        extra = model.Session.query(PackageExtra).filter_by(
+            package_id=dataset["id"], key="spatial").one()
+        extra.value = extents["nz"]
+        model.Session.commit()
+        return dataset
+
+    def _assert_reindexed(self, dataset):
+        result = helpers.call_action(
+            "package_search", extras={"ext_bbox": "170,-45,180,-35"}
+        )
+        assert result["count"] == 1
+        assert result["results"][0]["id"] == dataset["id"]
+        assert result["results"][0]["title"] == dataset["title"]
+
+    def test_reindex(self):
+        dataset = self._change_extent_without_indexing()
+
+        from ckan.lib.search.common import make_connection
+        unstored = [
+            name for name in util.get_unstored_fields(make_connection())
+            if name not in SolrBBoxSearchBackend.index_fields
+        ]
+        if unstored:
+            with pytest.raises(ValueError):
+                util.reindex(workers=1)
+            pytest.skip("The Solr index has unstored fields: {}".format(unstored))
+
+        assert util.reindex(workers=1) == (1, 0)
+        self._assert_reindexed(dataset)
+
+    def test_reindex_rebuild(self):
+        dataset = self._change_extent_without_indexing()
+
+        assert util.reindex(workers=1, rebuild=True) == (1, 0)
+        self._assert_reindexed(dataset)
+
+    def test_reindex_rebuild_other_backend(self):
+        with pytest.raises(ValueError):
+            util.reindex("solr-spatial-field", workers=1, rebuild=True)
+
+    def test_spatial_query_touching_bbox(self):
+        # The range prefilter matches extents that only share an edge with
+        # the query area, but the overlap filter excludes them
+        factories.Dataset(
+            extras=[{"key": "spatial", "value": extents["ohio"]}]
+        )
+
+        result = helpers.call_action(
+            "package_search", extras={"ext_bbox": "-80,38,-70,42"}
+        )
+
+        assert result["count"] == 0
+
+    @pytest.mark.ckan_config("ckanext.spatial.search_bbox_grid", "1")
+    def test_spatial_query_quantized_bbox(self):
+        # The quantized range filter (-80 to -70) touches the extent, but
+        # the overlap filter uses the exact bbox
+        factories.Dataset(
+            extras=[{"key": "spatial", "value": extents["ohio"]}]
+        )
+
+        result = helpers.call_action(
+            "package_search", extras={"ext_bbox": "-79.5,38.5,-70.5,41.5"}
+        )
+        assert result["count"] == 0
+
+        result = helpers.call_action(
+            "package_search", extras={"ext_bbox": "-80.5,38.5,-70.5,41.5"}
+        )
+        assert result["count"] == 1
+
+    def test_search_params_quantized_filter(self):
+        search_params = SolrBBoxSearchBackend().search_params(
+            {"minx": -9.5, "miny": -19.5, "maxx": 9.5, "maxy": 19.5},
+            {},
+            filter_bbox={"minx": -10, "miny": -20, "maxx": 10, "maxy": 20},
+        )
+
+        range_query, overlap_filter = search_params["fq_list"]
+        assert range_query == (
+            "+maxx:[-10 TO *] +minx:[* TO 10] +maxy:[-20 TO *] +miny:[* TO 20]"
+        )
+        assert "-9.5" in search_params["bf"]
+
+    def test_search_params_filters(self):
+        search_params = SolrBBoxSearchBackend().search_params(
+            {"minx": -10, "miny": -20, "maxx": 10, "maxy": 20}, {}
+        )
+
+        range_query, overlap_filter = search_params["fq_list"]
+        assert range_query == (
+            "+maxx:[-10 TO *] +minx:[* TO 10] +maxy:[-20 TO *] +miny:[* TO 20]"
+        )
+        assert overlap_filter.startswith(
+            "{!frange incl=false l=0 u=1 cache=false cost=100}"
+        )
+        assert search_params["bf"] in overlap_filter
+
     def test_spatial_real_multipolygon_inside_extent_no_intersect(self):
         """
         Testing this scenario, will return a result as the whole extent of
@@ -373,6 +486,120 @@ class TestBBoxSearch(SpatialTestBase):
 
 
 
+@pytest.mark.parametrize("backend", sorted(search_backends.keys()))
+def test_index_datasets_batch(backend):
+    values = list(extents.values()) + list(geojson_examples.values()) + [
+        "not a geometry",
+        None,
+    ]
+
+    batch = search_backends[backend]().index_datasets(
+        [{"spatial": value} for value in values]
+    )
+
+    assert len(batch) == len(values)
+    for value, dataset_dict in zip(values, batch):
+        assert search_backends[backend]().index_dataset(
+            {"spatial": value}) == dataset_dict
+
+
+class TestBBoxFieldBackend(object):
+    def test_index_dataset(self):
+        dataset_dict = SolrBBoxFieldSearchBackend().index_dataset(
+            {"spatial": extents["ohio"]}
+        )
+
+        assert dataset_dict["spatial_bbox"] == "ENVELOPE(-84.0, -80.0, 42.0, 38.0)"
+
+    def test_index_dataset_antimeridian(self):
+        dataset_dict = SolrBBoxFieldSearchBackend().index_dataset(
+            {"spatial": extents["antimeridian_bbox"]}
+        )
+
+        assert dataset_dict["spatial_bbox"] == "ENVELOPE(169.0, -168.0, 70.0, 60.0)"
+
+    def test_index_dataset_wrong_geometry(self):
+        dataset_dict = SolrBBoxFieldSearchBackend().index_dataset(
+            {"spatial": "not a geometry"}
+        )
+
+        assert "spatial_bbox" not in dataset_dict
+
+    def test_search_params(self):
+        search_params = SolrBBoxFieldSearchBackend().search_params(
+            {"minx": -10, "miny": -20, "maxx": 190, "maxy": 20}, {}
+        )
+
+        assert search_params["fq_list"] == [
+            "{!field f=spatial_bbox}Intersects(ENVELOPE(-10,-170,20,-20))"
+        ]
+        assert search_params["boost"] == (
+            "query({!field f=spatial_bbox score=overlapRatio "
+            "v='Intersects(ENVELOPE(-10,-170,20,-20))'})"
+        )
+        assert search_params["defType"] == "edismax"
+
+
+def _circle(x, y, radius, vertices):
+    ring = [
+        [
+            round(x + radius * math.cos(2 * math.pi * i / vertices), 6),
+            round(y + radius * math.sin(2 * math.pi * i / vertices), 6),
+        ]
+        for i in range(vertices)
+    ]
+    return json.dumps({"type": "Polygon", "coordinates": [ring + ring[:1]]})
+
+
+def _vertices(wkt):
+    return len(wkt.split(","))
+
+
+class TestSpatialFieldBackend(object):
+    @pytest.mark.ckan_config(
+        "ckanext.spatial.search_spatial_field.simplify_tolerance", "0.5")
+    def test_index_dataset_simplified(self):
+        dataset_dict = SolrSpatialFieldSearchBackend().index_dataset(
+            {"spatial": _circle(10, 10, 5, 500)}
+        )
+
+        assert _vertices(dataset_dict["spatial_geom"]) < 50
+
+    @pytest.mark.ckan_config(
+        "ckanext.spatial.search_spatial_field.max_vertices", "100")
+    def test_index_dataset_max_vertices(self):
+        dataset_dict = SolrSpatialFieldSearchBackend().index_dataset(
+            {"spatial": _circle(20, 20, 5, 1000)}
+        )
+
+        assert dataset_dict["spatial_geom"].startswith("POLYGON")
+        assert _vertices(dataset_dict["spatial_geom"]) <= 100
+
+    @pytest.mark.ckan_config(
+        "ckanext.spatial.search_spatial_field.max_vertices", "3")
+    def test_index_dataset_max_vertices_envelope(self):
+        dataset_dict = SolrSpatialFieldSearchBackend().index_dataset(
+            {"spatial": _circle(30, 30, 5, 100)}
+        )
+
+        assert dataset_dict["spatial_geom"] == (
+            "POLYGON ((25 25, 35 25, 35 35, 25 35, 25 25))")
+
+    @pytest.mark.ckan_config(
+        "ckanext.spatial.search_spatial_field.wkt_precision", "1")
+    def test_index_dataset_wkt_precision(self):
+        dataset_dict = SolrSpatialFieldSearchBackend().index_dataset(
+            {"spatial": """
+                {"type": "Polygon", "coordinates": [[[-84.123, 38.123],
+                [-84.123, 40.456], [-82.5, 41.06], [-80.789, 42.123],
+                [-80.789, 38.123], [-84.123, 38.123]]]}"""}
+        )
+
+        assert dataset_dict["spatial_geom"] == (
+            "POLYGON ((-84.1 38.1, -84.1 40.5, -82.5 41.1, -80.8 42.1, "
+            "-80.8 38.1, -84.1 38.1))")
+
+
 @pytest.mark.usefixtures("clean_db", "clean_index", "with_plugins")
 @pytest.mark.ckan_config("ckanext.spatial.search_backend", "solr-spatial-field")
 class TestSpatialFieldSearch(SpatialTestBase):
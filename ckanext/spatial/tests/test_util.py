@@ -0,0 +1,101 @@
+import logging
+import os
+
+import pytest
+
+from ckanext.spatial import util
+
+with open(os.path.join(os.path.dirname(__file__), "xml", "gemini2.1",
+                       "dataset1.xml")) as f:
+    # The content is parsed as text, which can not declare an encoding
+    DOCUMENT = f.read().split("?>", 1)[1]
+
+
+@pytest.fixture
+def html_cache(monkeypatch):
+    monkeypatch.setattr(util, "_html_cache", None)
+    return util.get_html_cache()
+
+
+class TestTransformToHtml(object):
+    def test_xslt_reused(self, caplog):
+        with caplog.at_level(logging.DEBUG, logger=util.__name__):
+            util.transform_to_html(DOCUMENT)
+            caplog.clear()
+            util.transform_to_html(DOCUMENT)
+
+        assert not [
+            r for r in caplog.records if r.getMessage().startswith("Compiling")
+        ]
+        key = (util.__name__,
+               "templates/ckanext/spatial/gemini2-html-stylesheet.xsl")
+        assert util._xslt_transforms.size(key) == 1
+
+    def test_cache_hit(self, html_cache):
+        first = util.transform_to_html(DOCUMENT, object_id="ho-1")
+        assert (html_cache.hits, html_cache.misses) == (0, 1)
+
+        assert util.transform_to_html(DOCUMENT, object_id="ho-1") == first
+        assert (html_cache.hits, html_cache.misses) == (1, 1)
+        assert len(html_cache) == 1
+
+    def test_changed_document_new_entry(self, html_cache):
+        util.transform_to_html(DOCUMENT, object_id="ho-1")
+        changed = DOCUMENT.replace("</gmd:MD_Metadata>",
+                                   "<!-- changed --></gmd:MD_Metadata>")
+
+        util.transform_to_html(changed, object_id="ho-1")
+
+        assert html_cache.hits == 0
+        assert len(html_cache) == 2
+
+    def test_cache_max_bytes(self, html_cache, monkeypatch):
+        monkeypatch.setattr(html_cache, "maxbytes", 10)
+
+        util.transform_to_html(DOCUMENT, object_id="ho-1")
+
+        assert len(html_cache) == 0
+
+
+class FakeSolrConnection(object):
+    url = "http://solr/ckan"
+    timeout = 10
+
+    def __init__(self, responses):
+        self.responses = responses
+
+    def get_session(self):
+        return self
+
+    def get(self, url, params=None, auth=None, timeout=None):
+        response = self.responses[url[len(self.url) + 1:]]
+        return type("Response", (object, ), {
+            "raise_for_status": lambda self: None,
+            "json": lambda self: response,
+        })()
+
+
+def test_get_unstored_fields():
+    conn = FakeSolrConnection({
+        "schema/fields": {"fields": [
+            {"name": "id", "stored": True},
+            {"name": "text", "stored": False},
+            {"name": "urls", "stored": False},
+            {"name": "spatial_bbox", "stored": False},
+            {"name": "unused", "stored": False},
+        ]},
+        "schema/dynamicfields": {"dynamicFields": [
+            {"name": "extras_*", "stored": True},
+            {"name": "*_date", "stored": False, "docValues": True},
+            {"name": "*", "stored": False},
+        ]},
+        "schema/copyfields": {"copyFields": [
+            {"source": "title", "dest": "text"},
+        ]},
+        "admin/luke": {"fields": dict((name, {}) for name in [
+            "id", "text", "urls", "spatial_bbox", "extras_theme",
+            "metadata_date", "custom",
+        ])},
+    })
+
+    assert util.get_unstored_fields(conn) == ["custom", "spatial_bbox", "urls"]
@@ -1,8 +1,13 @@
 import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+import pytest
 from lxml import etree
 
 from ckanext.spatial import validation
+from ckanext.spatial.validation.cache import ValidationCache
 
 # other validation tests are in test_harvest.py
 
@@ -213,3 +218,323 @@ class TestValidation(object):
         message, line = errors[1]
         assert "This element is not expected" in message
         assert line == 3
+
+    def test_cached_validation(self, tmp_path):
+
+        class CountingValidator(validation.BaseValidator):
+            name = "counting"
+            calls = 0
+
+            @classmethod
+            def is_valid(cls, xml):
+                cls.calls += 1
+                return False, [("Counted", 1)]
+
+        cache = ValidationCache(str(tmp_path / "validation.sqlite"))
+        validators = validation.Validators(profiles=["counting"], cache=cache)
+        validators.add_validator(CountingValidator)
+
+        xml = etree.parse(self._get_file_path("iso19139/dataset.xml"))
+        first = validators.is_valid(xml)
+        second = validators.is_valid(xml)
+
+        assert CountingValidator.calls == 1
+        assert first == second == (False, "counting", [("Counted", 1)])
+
+        # Different content or profiles are validated again
+        other_xml = etree.parse(self._get_file_path("iso19139/dataset-invalid.xml"))
+        validators.is_valid(other_xml)
+        assert CountingValidator.calls == 2
+
+        validators.profiles = ["counting", "counting"]
+        validators.is_valid(xml)
+        assert CountingValidator.calls == 3
+
+    def test_cached_validation_real_profile(self, tmp_path):
+        cache = ValidationCache(str(tmp_path / "validation.sqlite"))
+        xml = etree.parse(self._get_file_path("iso19139/dataset-invalid.xml"))
+
+        uncached = validation.Validators(profiles=["iso19139"]).is_valid(xml)
+        validators = validation.Validators(profiles=["iso19139"], cache=cache)
+        validators.is_valid(xml)
+
+        assert validators.is_valid(xml) == uncached
+
+    def test_parallel_validation_keeps_first_failure(self):
+        profiles = ["iso19139eden", "constraints-1.4", "gemini2"]
+        for file_name in (
+            "gemini2.1/validation/01_Dataset_Invalid_XSD_No_Such_Element.xml",
+            "gemini2.1/validation/02_Dataset_Invalid_19139_Missing_Data_Format.xml",
+            "gemini2.1/validation/03_Dataset_Invalid_GEMINI_Missing_Keyword.xml",
+            "gemini2.1/validation/04_Dataset_Valid.xml",
+        ):
+            xml = etree.parse(self._get_file_path(file_name))
+            serial = validation.Validators(profiles=profiles).is_valid(xml)
+            parallel = validation.Validators(
+                profiles=profiles, parallel=True
+            ).is_valid(xml)
+            assert serial == parallel, file_name
+
+    def test_parallel_validation_threads(self):
+        profiles = ["iso19139eden", "constraints-1.4", "gemini2"]
+        xml = etree.parse(
+            self._get_file_path("gemini2.1/validation/04_Dataset_Valid.xml")
+        )
+        validation.shutdown_executors()
+        for i in range(3):
+            validation.Validators(profiles=profiles, parallel=True).is_valid(xml)
+
+        # One thread per profile, shared by all instances
+        assert len(validation.validation._executors) == len(profiles)
+        threads = [
+            thread for thread in threading.enumerate()
+            if thread.name.startswith("spatial-validation")
+        ]
+        assert len(threads) == len(profiles)
+
+        validation.shutdown_executors()
+        assert validation.validation._executors == {}
+
+    def test_parallel_validation_busy_thread(self):
+        threads = []
+
+        class RecordingValidator(validation.BaseValidator):
+            name = "recording"
+            title = "Recording validator"
+
+            @classmethod
+            def is_valid(cls, xml):
+                threads.append(threading.current_thread().name)
+                return True, []
+
+        validators = validation.Validators(
+            profiles=["recording", "iso19139eden"], parallel=True,
+            precheck=False,
+        )
+        validators.add_validator(RecordingValidator)
+        xml = etree.parse(
+            self._get_file_path("gemini2.1/validation/04_Dataset_Valid.xml")
+        )
+
+        assert validators.is_valid(xml) == (True, None, [])
+        assert threads[-1].startswith("spatial-validation-recording")
+
+        # Wait until the thread is released, then mark it as validating
+        # another document
+        executor = validation.validation._executors[RecordingValidator]
+        executor.submit(lambda: None).result()
+        validation.validation._busy_validators.add(RecordingValidator)
+        try:
+            assert validators.is_valid(xml) == (True, None, [])
+        finally:
+            validation.validation._busy_validators.discard(RecordingValidator)
+        assert threads[-1] == threading.current_thread().name
+
+    def test_validate_all(self):
+        xml = etree.parse(
+            self._get_file_path("gemini2.1/validation/01_Dataset_Invalid_XSD_No_Such_Element.xml")
+        )
+        validators = validation.Validators(
+            profiles=["iso19139eden", "constraints-1.4", "gemini2"],
+            parallel=True,
+            precheck=False,
+        )
+        is_valid, failures = validators.validate_all(xml)
+
+        assert not is_valid
+        assert failures[0][0] == "iso19139eden"
+        assert failures[0][1] == validators.is_valid(xml)[2]
+
+        xml = etree.parse(
+            self._get_file_path("gemini2.1/validation/04_Dataset_Valid.xml")
+        )
+        assert validators.validate_all(xml) == (True, [])
+
+    def test_validation_from_multiple_threads(self):
+        validators = validation.Validators(
+            profiles=["iso19139eden", "constraints-1.4", "gemini2"]
+        )
+        file_names = [
+            "gemini2.1/validation/02_Dataset_Invalid_19139_Missing_Data_Format.xml",
+            "gemini2.1/validation/03_Dataset_Invalid_GEMINI_Missing_Keyword.xml",
+            "gemini2.1/validation/04_Dataset_Valid.xml",
+        ] * 4
+
+        def validate(file_name):
+            return validators.is_valid(etree.parse(self._get_file_path(file_name)))
+
+        expected = [validate(file_name) for file_name in file_names]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            assert list(executor.map(validate, file_names)) == expected
+
+    def test_structure_precheck_rejects_non_iso_documents(self):
+        xml = etree.parse(
+            self._get_file_path("fgdc/climate-sensitivity-of-sierra-nevada-lakes.xml")
+        )
+        validators = validation.Validators(profiles=["iso19139", "gemini2"])
+        is_valid, profile, errors = validators.is_valid(xml)
+
+        assert not is_valid
+        assert profile == "iso19139-structure"
+        assert "is not an ISO19139 metadata record" in errors[0][0]
+
+        is_valid, failures = validators.validate_all(xml)
+        assert [name for name, errors in failures] == ["iso19139-structure"]
+
+    def _remove_element(self, xml, name):
+        root = xml.getroot()
+        for element in root.findall(name, validation.ISO_NAMESPACES):
+            root.remove(element)
+        return xml
+
+    def test_structure_precheck_missing_paths(self):
+        xml = self._remove_element(
+            etree.parse(self._get_file_path("iso19139/dataset.xml")),
+            "gmd:dateStamp",
+        )
+        is_valid, profile, errors = validation.Validators(
+            profiles=["iso19139"]
+        ).is_valid(xml)
+
+        assert not is_valid
+        assert profile == "iso19139-structure"
+        assert errors == [("Missing metadata date (gmd:dateStamp)", 2)]
+
+        # Without the precheck the full schema validation is reported
+        is_valid, profile, errors = validation.Validators(
+            profiles=["iso19139"], precheck=False
+        ).is_valid(xml)
+        assert not is_valid
+        assert profile == "iso19139"
+
+    def test_structure_precheck_optional_file_identifier(self):
+        # gmd:fileIdentifier is optional in the XSD, harvesters generate one
+        xml = self._remove_element(
+            etree.parse(self._get_file_path("iso19139/dataset.xml")),
+            "gmd:fileIdentifier",
+        )
+
+        assert validation.Validators(profiles=["iso19139"]).is_valid(xml) == (
+            True, None, [])
+        assert validation.Validators(
+            profiles=["iso19139"], precheck=False
+        ).is_valid(xml) == (True, None, [])
+
+    @pytest.mark.parametrize("file_name", [
+        "gemini2.1/validation/01_Dataset_Invalid_XSD_No_Such_Element.xml",
+        "gemini2.1/validation/05_Series_Invalid_XSD_No_Such_Element.xml",
+        "gemini2.1/validation/09_Service_Invalid_No_Such_Element.xml",
+    ])
+    def test_structure_precheck_keeps_xsd_errors(self, file_name):
+        xml = etree.parse(self._get_file_path(file_name))
+
+        assert validation.Validators(profiles=["iso19139eden"]).is_valid(
+            xml) == validation.Validators(
+                profiles=["iso19139eden"], precheck=False).is_valid(xml)
+
+    def test_structure_precheck_valid_documents(self):
+        for file_name in (
+            "iso19139/dataset.xml",
+            "gemini2.1/validation/04_Dataset_Valid.xml",
+            "gemini2.1/validation/12_Service_Valid.xml",
+        ):
+            xml = etree.parse(self._get_file_path(file_name))
+            assert validation.ISO19139StructureValidator.is_valid(xml) == (True, [])
+
+    def test_catalog_resolver_lookup(self):
+        resolver = validation.get_catalog_resolver()
+        xml_dir = os.path.dirname(validation.CATALOG_PATH)
+
+        assert resolver.lookup(
+            "http://schemas.opengis.net/iso/19139/20070417/gmd/gmd.xsd"
+        ) == os.path.join(xml_dir, "iso19139eden/", "gmd/gmd.xsd")
+        assert resolver.lookup(
+            "http://www.w3.org/1999/xlink.xsd"
+        ) == os.path.join(xml_dir, "iso19139eden/xlink/xlinks.xsd")
+        assert resolver.lookup("http://example.com/other.xsd") is None
+        assert resolver.lookup("../gco/gco.xsd") is None
+
+    def test_remote_schema_imports_resolved_offline(self, tmp_path):
+        xsd_path = tmp_path / "remote.xsd"
+        xsd_path.write_text(
+            """<?xml version="1.0" encoding="UTF-8"?>
+<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema"
+           xmlns:gmd="http://www.isotc211.org/2005/gmd"
+           targetNamespace="http://example.com/remote"
+           elementFormDefault="qualified">
+  <xs:import namespace="http://www.isotc211.org/2005/gmd"
+    schemaLocation="http://schemas.opengis.net/iso/19139/20070417/gmd/gmd.xsd"/>
+  <xs:element name="wrapper">
+    <xs:complexType>
+      <xs:sequence>
+        <xs:element ref="gmd:MD_Metadata"/>
+      </xs:sequence>
+    </xs:complexType>
+  </xs:element>
+</xs:schema>"""
+        )
+        xsd = etree.parse(str(xsd_path), validation.get_xsd_parser())
+        schema = etree.XMLSchema(xsd)
+
+        wrapper = etree.Element("{http://example.com/remote}wrapper")
+        assert not schema.validate(wrapper)
+        assert "MD_Metadata" in str(schema.error_log)
+
+
+@pytest.mark.ckan_config("ckan.spatial.validator.profiles", "iso19139eden,constraints,gemini2")
+@pytest.mark.parametrize("workers", [1, 2])
+def test_validate_batch(tmp_path, workers):
+    from ckanext.spatial import util
+
+    directory = os.path.join(os.path.dirname(__file__), "xml", "gemini2.1", "validation")
+    output = tmp_path / "results.jsonl"
+
+    failed = util.validate_batch(directory, output=str(output), workers=workers)
+
+    results = [json.loads(line) for line in output.read_text().splitlines()]
+    assert len(results) == len(os.listdir(directory))
+    assert failed == len([r for r in results if not r["Valid"]])
+    by_file = dict((os.path.basename(r["File"]), r) for r in results)
+    assert by_file["04_Dataset_Valid.xml"]["Valid"]
+    assert by_file["03_Dataset_Invalid_GEMINI_Missing_Keyword.xml"]["Failed profile"] == "gemini2"
+    assert all(r["Seconds"] >= 0 for r in results)
+
+
+def test_validators_warmup():
+    validators = validation.Validators(profiles=["iso19139eden", "gemini2"])
+    validators.warmup()
+
+    for xsd_filepath, xsd_name in validation.ISO19139EdenSchema.xsd_files:
+        assert validation.validation._schemas.size(xsd_filepath) >= 1
+    assert validation.validation._schematrons.size(validation.Gemini2Schematron) >= 1
+
+
+def test_warmup_shared_by_threads(caplog):
+    profiles = ["iso19139eden", "gemini2"]
+    validation.Validators(profiles=profiles).warmup()
+    xml = etree.parse(
+        os.path.join(os.path.dirname(__file__), "xml",
+                     "gemini2.1", "validation", "04_Dataset_Valid.xml")
+    )
+
+    with caplog.at_level("INFO", logger="ckanext.spatial.validation.validation"):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            result = executor.submit(
+                validation.Validators(profiles=profiles).is_valid, xml
+            ).result()
+
+    assert result == (True, None, [])
+    assert not [r for r in caplog.records if r.getMessage().startswith("Compiling")]
+
+
+def test_iso_document_warmup():
+    from ckanext.spatial.harvested_metadata import ISODocument
+
+    file_path = os.path.join(os.path.dirname(__file__), "xml", "iso19139", "dataset.xml")
+    cold = ISODocument(xml_tree=etree.parse(file_path).getroot()).read_values()
+
+    ISODocument.warmup()
+    guid = [e for e in ISODocument.elements if e.name == "guid"][0]
+    assert guid.get_search_paths()[0] in guid._xpaths
+
+    assert ISODocument(xml_tree=etree.parse(file_path).getroot()).read_values() == cold
@@ -3,6 +3,14 @@
 from __future__ import print_function
 import os
 import sys
+import time
+import fnmatch
+import zlib
+import hashlib
+import calendar
+import multiprocessing
+from collections import Counter, deque
+from email.utils import formatdate, mktime_tz, parsedate_tz
 from io import StringIO
 
 from pkg_resources import resource_stream
@@ -11,11 +19,20 @@ from ckan.lib.helpers import json
 from lxml import etree
 from pprint import pprint
 
+from sqlalchemy import and_
+from sqlalchemy.orm import aliased
+
 from ckan import model
 from ckan.model.package_extra import PackageExtra
 
+from ckanext.spatial.lib import compression
+from ckanext.spatial.lib.compiled import CompiledPool
+from ckanext.spatial.lib.lru import LRUCache
+from ckanext.spatial.lib.report import format_row_html, report_writers
+
 try:
-    from ckanext.spatial.lib.reports import validation_report
+    from ckanext.spatial.lib.reports import iter_validation_report, \
+        write_validation_report, VALIDATION_REPORT_COLUMNS
     from ckanext.spatial.harvesters import SpatialHarvester
     from ckanext.spatial.harvested_metadata import ISODocument
 except ImportError:
@@ -37,11 +54,14 @@ def report(pkg=None):
             print('Package ref "%s" not recognised' % package_ref)
             sys.exit(1)
 
-    report = validation_report(package_id=pkg.id)
-    for row in report.get_rows_html_formatted():
+    # Rows are printed as they are generated, so memory use is constant
+    for row_dict in iter_validation_report(
+            package_id=pkg.id if pkg else None):
+        row = format_row_html(
+            [row_dict[col_name] for col_name in VALIDATION_REPORT_COLUMNS])
         print()
-        for i, col_name in enumerate(report.column_names):
-            print('  %s: %s' % (col_name, row[i]))
+        for col_name, value in zip(VALIDATION_REPORT_COLUMNS, row):
+            print('  %s: %s' % (col_name, value))
 
 
 def validate_file(metadata_filepath):
@@ -86,11 +106,118 @@ def validate_file(metadata_filepath):
     print('***************')
 
 
-def report_csv(csv_filepath):
-    from ckanext.spatial.lib.reports import validation_report
-    report = validation_report()
-    with open(csv_filepath, 'wb') as f:
-        f.write(report.get_csv())
+BATCH_COLUMNS = ['File', 'Valid', 'Failed profile', 'Errors', 'Seconds']
+
+# Validators of the current batch worker process
+_batch_validators = None
+
+
+def _init_batch_worker():
+    global _batch_validators
+    _batch_validators = SpatialHarvester()._get_validator()
+
+
+def _validate_batch_file(filepath):
+    start = time.time()
+    try:
+        xml = etree.parse(filepath)
+    except etree.XMLSyntaxError as e:
+        valid, profile, errors = False, 'xml', [(str(e), e.lineno)]
+    else:
+        valid, profile, errors = _batch_validators.is_valid(xml)
+    return {
+        'File': filepath,
+        'Valid': valid,
+        'Failed profile': profile,
+        'Errors': '; '.join(error[0] for error in errors),
+        'Seconds': round(time.time() - start, 3),
+    }
+
+
+def _find_batch_files(directory, pattern):
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for file_name in sorted(files):
+            if fnmatch.fnmatch(file_name, pattern):
+                yield os.path.join(root, file_name)
+
+
+def validate_batch(directory, output=None, format='jsonl', workers=None,
+                   pattern='*.xml'):
+    '''
+    Validates all the metadata files in a directory (and its
+    subdirectories) whose name matches `pattern`, spreading them across a
+    pool of `workers` processes (by default one per CPU). Each worker keeps
+    its own compiled validators.
+
+    Results are written as they arrive to the `output` file (or stdout) in
+    JSON lines or CSV format, and a summary with a histogram of the failing
+    profiles is printed at the end.
+
+    Returns the number of files that failed validation.
+    '''
+    if not os.path.isdir(directory):
+        print('Directory %s not found' % directory)
+        sys.exit(1)
+
+    workers = workers or multiprocessing.cpu_count()
+    filepaths = _find_batch_files(directory, pattern)
+
+    out = open(output, 'w', newline='', encoding='utf-8') \
+        if output else sys.stdout
+    writer = report_writers[format](out, BATCH_COLUMNS)
+    failed_profiles = Counter()
+    start = time.time()
+    try:
+        if workers == 1:
+            _init_batch_worker()
+            results = map(_validate_batch_file, filepaths)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(workers,
+                                        initializer=_init_batch_worker)
+            results = pool.imap_unordered(_validate_batch_file, filepaths,
+                                          chunksize=8)
+        for result in results:
+            if not result['Valid']:
+                failed_profiles[result['Failed profile']] += 1
+            writer.add_row_dict(result)
+            out.flush()
+        if pool:
+            pool.close()
+            pool.join()
+    finally:
+        if output:
+            out.close()
+
+    total = writer.row_count
+    failed = sum(failed_profiles.values())
+    elapsed = time.time() - start
+    summary = sys.stderr if not output else sys.stdout
+    print('***************', file=summary)
+    print('Summary', file=summary)
+    print('***************', file=summary)
+    print('Files: %i, valid: %i, invalid: %i' % (total, total - failed,
+                                                 failed), file=summary)
+    print('Time: %.2fs (%.3fs per file)' % (
+        elapsed, elapsed / total if total else 0), file=summary)
+    if failed_profiles:
+        print('Failing profiles:', file=summary)
+        width = max(len(str(profile)) for profile in failed_profiles)
+        top = max(failed_profiles.values())
+        for profile, count in failed_profiles.most_common():
+            print('  %s %6i %s' % (str(profile).ljust(width), count,
+                                   '#' * max(1, int(40 * count / top))),
+                  file=summary)
+    print('***************', file=summary)
+    return failed
+
+
+def report_csv(csv_filepath, format='csv'):
+    # Rows are written to the file as they are generated
+    with open(csv_filepath, 'w', newline='', encoding='utf-8') as f:
+        count = write_validation_report(f, format=format)
+    print('Written %i rows to %s' % (count, csv_filepath))
 
 
 def get_xslt(original=False):
@@ -116,19 +243,31 @@ def get_xslt(original=False):
     return xslt_package, xslt_path
 
 
-def get_harvest_object_original_content(id):
+def get_harvest_object_original_stored_content(id):
+    '''
+    Returns a (value, codec) tuple with the original document extra as
+    stored in the database and the codec used to compress it (None if it is
+    plain text), or (None, None) if the harvest object has no original
+    document.
+    '''
     from ckanext.harvest.model import HarvestObject, HarvestObjectExtra
 
-    extra = model.Session.query(
-        HarvestObjectExtra
+    extras = dict(model.Session.query(
+        HarvestObjectExtra.key, HarvestObjectExtra.value
     ).join(HarvestObject).filter(HarvestObject.id == id).filter(
-        HarvestObjectExtra.key == 'original_document'
-    ).first()
+        HarvestObjectExtra.key.in_(
+            ['original_document', compression.ENCODING_EXTRA_KEY])
+    ))
 
-    if extra:
-        return extra.value
-    else:
-        return None
+    return (extras.get('original_document'),
+            extras.get(compression.ENCODING_EXTRA_KEY))
+
+
+def get_harvest_object_original_content(id):
+    value, codec = get_harvest_object_original_stored_content(id)
+    if value:
+        return compression.decompress_document(value, codec)
+    return value
 
 
 def get_harvest_object_content(id):
@@ -140,21 +279,641 @@ def get_harvest_object_content(id):
         return None
 
 
-def transform_to_html(content, xslt_package=None, xslt_path=None):
+XML_DECLARATION = u'<?xml version="1.0" encoding="UTF-8"?>\n'
+# Only the beginning of the document is checked for the XML declaration
+XML_DECLARATION_PREFIX_SIZE = 1024
+RESPONSE_CHUNK_SIZE = 64 * 1024
+
+
+def has_xml_declaration(content):
+    '''
+    Returns whether the first line of the document contains an XML
+    declaration, without copying or scanning the whole document.
+    '''
+    prefix = content[:XML_DECLARATION_PREFIX_SIZE]
+    if isinstance(prefix, bytes):
+        return b'<?xml' in prefix.split(b'\n', 1)[0]
+    return '<?xml' in prefix.split('\n', 1)[0]
 
+
+def get_gzip_document_with_declaration(value, codec):
+    '''
+    For original documents stored compressed with gzip, returns the
+    compressed bytes if the document has an XML declaration (so it can be
+    sent as is to clients accepting gzip), otherwise None.
+    '''
+    data = compression.get_compressed_bytes(value, codec)
+    if not data:
+        return None
+    prefix = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(
+        data, XML_DECLARATION_PREFIX_SIZE)
+    if not has_xml_declaration(prefix):
+        return None
+    return data
+
+
+def iter_original_document(value, codec, chunk_size=RESPONSE_CHUNK_SIZE):
+    '''
+    Yields the original document as stored in the database (see
+    `get_harvest_object_original_stored_content`) as UTF-8 encoded chunks,
+    decompressing it incrementally, and preceded by an XML declaration if
+    it doesn't have one.
+    '''
+    chunks = compression.iter_decompressed(value, codec, chunk_size)
+    head = b''
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= XML_DECLARATION_PREFIX_SIZE:
+            break
+    if not has_xml_declaration(head):
+        yield XML_DECLARATION.encode('utf-8')
+    if head:
+        yield head
+    for chunk in chunks:
+        yield chunk
+
+
+def iter_content_chunks(content, prefix=None,
+                        chunk_size=RESPONSE_CHUNK_SIZE):
+    '''
+    Yields the (optional) prefix and the content as UTF-8 encoded chunks of
+    up to `chunk_size`. The content is already in memory, only its encoded
+    copy is built one chunk at a time.
+    '''
+    if prefix:
+        yield prefix.encode('utf-8')
+    for start in range(0, len(content), chunk_size):
+        chunk = content[start:start + chunk_size]
+        yield chunk if isinstance(chunk, bytes) else chunk.encode('utf-8')
+
+
+def iter_gzip(chunks, level=6):
+    '''Compresses an iterable of byte chunks in gzip format'''
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def accepts_gzip(accept_encoding):
+    '''Checks whether the Accept-Encoding request header allows gzip'''
+    qualities = {}
+    for coding in (accept_encoding or '').split(','):
+        coding, _, params = coding.partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                pass
+        qualities[coding.strip().lower()] = quality
+    for coding in ('gzip', 'x-gzip', '*'):
+        if coding in qualities:
+            return qualities[coding] > 0
+    return False
+
+
+DEFAULT_HARVEST_OBJECT_MAX_AGE = 3600
+
+
+def get_harvest_object_cache_info(id, original=False):
+    '''
+    Returns a (version, fetch finished date) tuple for the content of the
+    harvest object (or its original document), or None if there is no
+    content.
+
+    Harvest objects are not modified once fetched, so the version is built
+    from their fetch and metadata modified dates (and the encoding of the
+    stored original document), without reading the content itself.
+    '''
+    from ckanext.harvest.model import HarvestObject, HarvestObjectExtra
+
+    columns = [HarvestObject.fetch_finished,
+               HarvestObject.metadata_modified_date]
+    if original:
+        encoding = aliased(HarvestObjectExtra)
+        query = model.Session.query(*(columns + [encoding.value])).join(
+            HarvestObjectExtra,
+            HarvestObjectExtra.harvest_object_id == HarvestObject.id).\
+            outerjoin(encoding, and_(
+                encoding.harvest_object_id == HarvestObject.id,
+                encoding.key == compression.ENCODING_EXTRA_KEY)).\
+            filter(HarvestObjectExtra.key == 'original_document').\
+            filter(HarvestObjectExtra.value.isnot(None))
+    else:
+        query = model.Session.query(*columns).filter(
+            HarvestObject.content.isnot(None))
+    row = query.filter(HarvestObject.id == id).first()
+    if not row:
+        return None
+    version = u'\0'.join(u'{0}'.format(value) for value in row)
+    return version, row[0]
+
+
+def get_harvest_object_cache_headers(id, version, last_modified, variant=''):
+    '''
+    Returns the ETag, Last-Modified and Cache-Control headers for a
+    representation of a harvest object. `variant` identifies the
+    representation (eg the XSLT stylesheet used).
+
+    Harvest objects don't change once fetched, so the strong ETag derived
+    from the object id and version identifies the response.
+    '''
+    etag = hashlib.sha1(
+        u'{0}\0{1}\0{2}'.format(id, version, variant).encode('utf-8')
+    ).hexdigest()
+    headers = {
+        'ETag': '"{0}"'.format(etag),
+        'Cache-Control': 'public, max-age={0}'.format(int(config.get(
+            'ckanext.spatial.harvest.object_max_age',
+            DEFAULT_HARVEST_OBJECT_MAX_AGE))),
+    }
+    if last_modified:
+        headers['Last-Modified'] = formatdate(
+            calendar.timegm(last_modified.utctimetuple()), usegmt=True)
+    return headers
+
+
+def is_not_modified(headers, if_none_match=None, if_modified_since=None):
+    '''
+    Checks the If-None-Match and If-Modified-Since request headers against
+    the headers returned by `get_harvest_object_cache_headers`, returning
+    True if a 304 Not Modified response can be sent.
+    '''
+    if if_none_match:
+        etags = [etag.strip() for etag in if_none_match.split(',')]
+        return '*' in etags or headers['ETag'] in etags
+    if if_modified_since and 'Last-Modified' in headers:
+        since = parsedate_tz(if_modified_since)
+        modified = parsedate_tz(headers['Last-Modified'])
+        if since and modified:
+            return mktime_tz(modified) <= mktime_tz(since)
+    return False
+
+
+DEFAULT_HTML_CACHE_SIZE = 128
+DEFAULT_HTML_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# Compiled XSLT transforms, keyed by (package, path)
+_xslt_transforms = CompiledPool()
+
+# Rendered HTML of harvest objects
+_html_cache = None
+
+
+def get_xslt_transform(xslt_package=None, xslt_path=None):
+    '''
+    Context manager that provides the compiled XSLT transform for the
+    stylesheet. Transforms are shared by all threads, so the stylesheet is
+    only read and compiled again when several threads use it at once.
+    '''
     xslt_package = xslt_package or __name__
     xslt_path = xslt_path or \
         'templates/ckanext/spatial/gemini2-html-stylesheet.xsl'
 
-    # optimise -- read transform only once and compile rather
-    # than at each request
-    with resource_stream(xslt_package, xslt_path) as style:
-        style_xml = etree.parse(style)
-        transformer = etree.XSLT(style_xml)
+    def build():
+        log.debug('Compiling XSLT stylesheet %s:%s', xslt_package, xslt_path)
+        with resource_stream(xslt_package, xslt_path) as style:
+            return etree.XSLT(etree.parse(style))
+
+    return _xslt_transforms.get((xslt_package, xslt_path), build)
+
+
+def get_html_cache():
+    '''
+    Returns the LRU cache of rendered harvest object HTML. Its number of
+    pages is set with `ckanext.spatial.harvest.html_cache_size` (0 to
+    disable it) and their total size in bytes with
+    `ckanext.spatial.harvest.html_cache_max_bytes`.
+    '''
+    global _html_cache
+    if _html_cache is None:
+        _html_cache = LRUCache(
+            int(config.get('ckanext.spatial.harvest.html_cache_size',
+                           DEFAULT_HTML_CACHE_SIZE)),
+            maxbytes=int(config.get(
+                'ckanext.spatial.harvest.html_cache_max_bytes',
+                DEFAULT_HTML_CACHE_MAX_BYTES)))
+    return _html_cache
+
+
+def transform_to_html(content, xslt_package=None, xslt_path=None,
+                      object_id=None):
+    '''
+    Renders the XML content as HTML with the XSLT stylesheet.
+
+    If the id of the harvest object the content belongs to is provided,
+    the result is kept in the HTML cache, keyed by the object id, the
+    stylesheet and a digest of the content.
+    '''
+    key = None
+    if object_id:
+        digest = hashlib.sha1(
+            (content or '').encode('utf-8')).hexdigest()
+        key = (object_id, xslt_package, xslt_path, digest)
+        result = get_html_cache().get(key)
+        if result is not None:
+            return result
 
     xml = etree.parse(StringIO(content and str(content)))
-    html = transformer(xml)
+    with get_xslt_transform(xslt_package, xslt_path) as transformer:
+        html = transformer(xml)
 
     result = etree.tostring(html, pretty_print=True)
 
+    if key:
+        get_html_cache().set(key, result)
     return result
+
+
+def warmup():
+    '''
+    Compiles in advance the validators of the configured profiles, the
+    XSLT stylesheets used to render harvested documents and the XPath
+    expressions used to parse them.
+
+    The compiled objects are used by all the threads of the process, and
+    it is meant to be called in a parent process before forking workers, so
+    they all share them instead of building them on their first request or
+    harvest object.
+    '''
+    start = time.time()
+
+    try:
+        validators = SpatialHarvester()._get_validator()
+    except NameError:
+        # ckanext-harvest not loaded
+        log.debug('Harvester not available, skipping validators warmup')
+    else:
+        validators.warmup()
+        log.debug('Compiled validators for profiles %s',
+                  ','.join(validators.profiles))
+
+    for original in (False, True):
+        xslt_package, xslt_path = get_xslt(original=original)
+        with get_xslt_transform(xslt_package, xslt_path):
+            pass
+
+    try:
+        ISODocument.warmup()
+    except NameError:
+        pass
+    try:
+        from ckanext.spatial.harvested_metadata_fgdc import FGDCDocument
+        FGDCDocument.warmup()
+    except ImportError:
+        pass
+
+    log.info('Spatial warmup finished in %.2fs', time.time() - start)
+
+
+def compact_original_documents(codec='gzip', batch_size=500, dry_run=False):
+    '''
+    Compresses the original documents of existing harvest objects that
+    are stored as plain text.
+
+    Extras are read in batches of `batch_size` ordered by id, committing
+    after each batch, so the command can be interrupted and run again.
+
+    Returns a (count, bytes_before, bytes_after) tuple.
+    '''
+    from ckanext.harvest.model import HarvestObjectExtra
+
+    if codec not in compression.CODECS:
+        raise ValueError('Unknown codec: {0}'.format(codec))
+
+    encoded = model.Session.query(HarvestObjectExtra.harvest_object_id).\
+        filter(HarvestObjectExtra.key == compression.ENCODING_EXTRA_KEY)
+
+    count = bytes_before = bytes_after = 0
+    last_id = None
+    while True:
+        query = model.Session.query(HarvestObjectExtra).\
+            filter(HarvestObjectExtra.key == 'original_document').\
+            filter(~HarvestObjectExtra.harvest_object_id.in_(encoded)).\
+            order_by(HarvestObjectExtra.id)
+        if last_id is not None:
+            query = query.filter(HarvestObjectExtra.id > last_id)
+        extras = query.limit(batch_size).all()
+        if not extras:
+            break
+
+        for extra in extras:
+            last_id = extra.id
+            if not extra.value:
+                continue
+            compressed = compression.compress_document(extra.value, codec)
+            count += 1
+            bytes_before += len(extra.value.encode('utf-8'))
+            bytes_after += len(compressed)
+            if dry_run:
+                continue
+            extra.value = compressed
+            model.Session.add(HarvestObjectExtra(
+                harvest_object_id=extra.harvest_object_id,
+                key=compression.ENCODING_EXTRA_KEY,
+                value=codec))
+
+        if dry_run:
+            model.Session.rollback()
+        else:
+            model.Session.commit()
+        log.info('Compressed %i original documents', count)
+
+    return count, bytes_before, bytes_after
+
+
+# Search backend of the current reindex worker process
+_reindex_backend = None
+
+# Values of the geometry cache sent back by the reindex workers
+CACHED_EXTENT_ATTRIBUTES = ('error', 'bounds', 'wkt')
+
+
+def _init_reindex_worker(search_backend):
+    global _reindex_backend
+    from ckanext.spatial.search import search_backends
+    _reindex_backend = search_backends[search_backend]()
+
+
+def _get_reindex_fields(rows):
+    '''
+    Computes the spatial fields of a batch of (dataset id, spatial extra)
+    rows. Returns a tuple with:
+
+    * the list of (dataset id, spatial fields) tuples. Fields that are not
+      set (eg for wrong geometries) are None, so they are removed from the
+      index.
+    * a dict with the computed values of the geometry cache for each
+      extent, so the main process can reuse them when indexing the full
+      documents.
+    '''
+    from ckanext.spatial.lib.geometry_cache import get_cached_extent, MISSING
+
+    dataset_dicts = _reindex_backend.index_datasets(
+        [{'id': id_, 'spatial': value} for id_, value in rows])
+    fields = [
+        (dataset_dict['id'], dict(
+            (field, dataset_dict.get(field))
+            for field in _reindex_backend.index_fields))
+        for dataset_dict in dataset_dicts
+    ]
+
+    extents = {}
+    for _, value in rows:
+        extent = get_cached_extent(value)
+        extents[value] = dict(
+            (name, getattr(extent, name))
+            for name in CACHED_EXTENT_ATTRIBUTES
+            if getattr(extent, name) is not MISSING)
+    return fields, extents
+
+
+def _iter_spatial_extras(batch_size):
+    '''
+    Yields lists of at most `batch_size` (dataset id, spatial extra) rows
+    of the active datasets, ordered by id
+    '''
+    last_id = None
+    while True:
+        query = model.Session.query(model.Package.id, PackageExtra.value).\
+            join(PackageExtra, PackageExtra.package_id == model.Package.id).\
+            filter(PackageExtra.key == 'spatial').\
+            filter(model.Package.state == 'active').\
+            order_by(model.Package.id)
+        if last_id is not None:
+            query = query.filter(model.Package.id > last_id)
+        rows = [tuple(row) for row in query.limit(batch_size).all()]
+        # Don't keep the session open while the batch is processed
+        model.Session.remove()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        yield rows
+
+
+def _imap_bounded(pool, func, iterable, size):
+    '''
+    Like `pool.imap`, but only reads the next items of `iterable` (in the
+    current thread) when there are less than `size` pending results, so
+    they are not all loaded in memory at once
+    '''
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= size:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def _solr_get(conn, path, params=None):
+    params = dict(params or {}, wt='json')
+    response = conn.get_session().get(
+        '{0}/{1}'.format(conn.url.rstrip('/'), path),
+        params=params,
+        auth=getattr(conn, 'auth', None),
+        timeout=conn.timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+def _get_solr_schema(conn, path, key):
+    return _solr_get(
+        conn, 'schema/{0}'.format(path), {'showDefaults': 'true'})[key]
+
+
+def _match_dynamic_field(name, dynamic_fields):
+    '''
+    Returns the dynamic field definition that applies to the field `name`,
+    ie the longest matching pattern, as Solr does
+    '''
+    matches = [
+        field for field in dynamic_fields
+        if (field['name'].startswith('*') and
+            name.endswith(field['name'][1:])) or
+        (field['name'].endswith('*') and
+         name.startswith(field['name'][:-1]))
+    ]
+    if matches:
+        return max(matches, key=lambda field: len(field['name']))
+    return None
+
+
+def get_unstored_fields(conn):
+    '''
+    Returns the names of the fields that have values in the Solr index but
+    are neither stored nor docValues (and not copyField destinations).
+    Solr rebuilds the documents from the stored values on atomic updates,
+    so the values of these fields would be lost.
+
+    Fields only defined in the schema (eg by the catch-all `*` dynamic
+    field) that no document uses are not taken into account.
+    '''
+    copied = [
+        copy_field['dest']
+        for copy_field in _get_solr_schema(conn, 'copyfields', 'copyFields')]
+    fields = dict(
+        (field['name'], field)
+        for field in _get_solr_schema(conn, 'fields', 'fields'))
+    dynamic_fields = _get_solr_schema(conn, 'dynamicfields', 'dynamicFields')
+
+    # Names of the fields with values in the index
+    names = _solr_get(conn, 'admin/luke', {'numTerms': 0})['fields']
+
+    unstored = []
+    for name in sorted(names):
+        field = fields.get(name) or _match_dynamic_field(name, dynamic_fields)
+        if (field is None or field.get('stored', True) or
+                field.get('docValues', False) or
+                any(fnmatch.fnmatchcase(name, dest) for dest in copied)):
+            continue
+        unstored.append(name)
+    return unstored
+
+
+def _get_index_ids(conn, ids):
+    '''Returns the Solr index id of each dataset in `ids` that is indexed'''
+    results = conn.search(
+        q='*:*',
+        fq=['+site_id:"%s"' % config.get('ckan.site_id'),
+            '{!terms f=id}%s' % ','.join(ids)],
+        fl='id,index_id',
+        rows=len(ids))
+    return dict((doc['id'], doc['index_id']) for doc in results.docs)
+
+
+def _update_spatial_fields(conn, fields, field_updates):
+    '''
+    Sends the spatial fields of a batch to Solr as atomic updates.
+    Returns the number of datasets updated.
+    '''
+    index_ids = _get_index_ids(conn, [id_ for id_, _ in fields])
+    docs = []
+    for id_, values in fields:
+        if id_ not in index_ids:
+            continue
+        doc = {'index_id': index_ids[id_]}
+        doc.update(values)
+        docs.append(doc)
+    if docs:
+        conn.add(docs, fieldUpdates=field_updates, commit=True)
+    return len(docs)
+
+
+def _rebuild_documents(fields, extents):
+    '''
+    Rebuilds the full Solr documents of a batch with the CKAN indexer,
+    reusing the spatial values computed by the workers. Returns the number
+    of datasets indexed.
+    '''
+    from ckan.lib import search
+    from ckanext.spatial.lib.geometry_cache import get_cached_extent
+
+    for value, values in extents.items():
+        extent = get_cached_extent(value)
+        for name, computed in values.items():
+            setattr(extent, name, computed)
+
+    search.rebuild(package_ids=[id_ for id_, _ in fields],
+                   defer_commit=True, quiet=True)
+    search.commit()
+    return len(fields)
+
+
+def reindex(search_backend=None, batch_size=500, workers=None,
+            rebuild=False):
+    '''
+    Reindexes the spatial fields of all the datasets with a spatial extra.
+
+    Dataset ids and extents are read from the database in batches of
+    `batch_size`, and the fields to index are computed by the search
+    backend (by default the configured one) in a pool of `workers` processes
+    (by default one per CPU). Each batch is committed after it is sent.
+
+    The batches are sent as atomic updates of the spatial fields only, and
+    datasets that are not in the index are skipped. Solr rebuilds the
+    documents from their stored values on atomic updates, so a ValueError
+    is raised if the index has values in fields that are not stored (see
+    `get_unstored_fields`).
+
+    If `rebuild` is True the full documents are rebuilt instead with the
+    CKAN indexer, reusing the spatial values computed by the workers. The
+    CKAN indexer uses the configured search backend, so `search_backend`
+    can not be a different one.
+
+    Returns a (updated, skipped) tuple.
+    '''
+    from ckan.lib.search.common import make_connection
+    from ckanext.spatial.plugin import SpatialQuery
+    from ckanext.spatial.search import search_backends
+
+    configured_backend = SpatialQuery()._get_search_backend()
+    search_backend = search_backend or configured_backend
+    index_fields = search_backends[search_backend].index_fields
+    field_updates = dict((field, 'set') for field in index_fields)
+
+    conn = make_connection()
+    if rebuild:
+        if search_backend != configured_backend:
+            raise ValueError(
+                'The full documents are indexed with the configured search '
+                'backend ({0}), not {1}'.format(
+                    configured_backend, search_backend))
+    else:
+        # The spatial fields are replaced, so they don't need to be stored
+        unstored = [name for name in get_unstored_fields(conn)
+                    if name not in index_fields]
+        if unstored:
+            raise ValueError(
+                'The Solr index has values in fields that are not stored '
+                '({0}), which atomic updates would lose. Store them in the '
+                'Solr schema or rebuild the full documents'.format(
+                    ', '.join(unstored)))
+
+    total = model.Session.query(PackageExtra.package_id).\
+        join(model.Package, PackageExtra.package_id == model.Package.id).\
+        filter(PackageExtra.key == 'spatial').\
+        filter(model.Package.state == 'active').count()
+    model.Session.remove()
+
+    workers = workers or multiprocessing.cpu_count()
+    batches = _iter_spatial_extras(batch_size)
+    if workers == 1:
+        _init_reindex_worker(search_backend)
+        results = map(_get_reindex_fields, batches)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(workers,
+                                    initializer=_init_reindex_worker,
+                                    initargs=(search_backend,))
+        results = _imap_bounded(pool, _get_reindex_fields, batches,
+                                workers * 2)
+
+    updated = skipped = 0
+    start = time.time()
+    try:
+        for fields, extents in results:
+            if rebuild:
+                count = _rebuild_documents(fields, extents)
+            else:
+                count = _update_spatial_fields(conn, fields, field_updates)
+            updated += count
+            skipped += len(fields) - count
+
+            elapsed = time.time() - start
+            log.info('Reindexed %i/%i datasets (%.1f datasets/s)',
+                     updated + skipped, total,
+                     (updated + skipped) / elapsed if elapsed else 0)
+    except BaseException:
+        if pool:
+            pool.terminate()
+        raise
+    if pool:
+        pool.close()
+        pool.join()
+
+    return updated, skipped
@@ -0,0 +1,110 @@
+'''
+Persistent cache of validation outcomes.
+
+Outcomes are keyed by the digest of the validated document, the ordered
+list of profiles (and the validator classes implementing them) and a hash
+of the validator files shipped with the extension, so any change in the
+document, the profiles or the schemas and schematrons results in a new
+validation.
+'''
+import os
+import json
+import sqlite3
+import hashlib
+import logging
+import threading
+
+from lxml import etree
+
+log = logging.getLogger(__name__)
+
+_validator_files_hash = None
+
+
+def get_validator_files_hash():
+    '''
+    Returns a hash of the contents of the XSD, schematron and XSLT files
+    used by the validators, plus the validators module itself.
+    '''
+    global _validator_files_hash
+    if _validator_files_hash is None:
+        here = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha1()
+        paths = [os.path.join(here, 'validation.py')]
+        for root, dirs, files in os.walk(os.path.join(here, 'xml')):
+            dirs.sort()
+            paths.extend(os.path.join(root, f) for f in sorted(files))
+        for path in paths:
+            digest.update(os.path.relpath(path, here).encode('utf8'))
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+        _validator_files_hash = digest.hexdigest()
+    return _validator_files_hash
+
+
+class ValidationCache(object):
+    '''
+    Stores the outcome of `Validators.is_valid` calls in a SQLite database.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30,
+                                     check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS validation_results (
+                key TEXT PRIMARY KEY,
+                is_valid INTEGER,
+                profile TEXT,
+                errors TEXT
+            )''')
+        self._conn.commit()
+
+    @staticmethod
+    def key(xml, profiles):
+        '''
+        Returns the cache key for an XML etree validated against the
+        provided profiles, a list of (profile name, validator class) tuples.
+        '''
+        if hasattr(xml, 'getroot'):
+            xml = xml.getroot()
+        digest = hashlib.sha256(etree.tostring(xml))
+        digest.update(get_validator_files_hash().encode('utf8'))
+        for name, validator_class in profiles:
+            digest.update('\0{0}={1}.{2}'.format(
+                name, validator_class.__module__,
+                validator_class.__name__).encode('utf8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        '''
+        Returns the stored (is_valid, failed_profile_name, errors) tuple or
+        None if not present.
+        '''
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT is_valid, profile, errors FROM validation_results '
+                'WHERE key = ?', (key,)).fetchone()
+        if not row:
+            return None
+        is_valid, profile, errors = row
+        return (bool(is_valid), profile,
+                [tuple(error) for error in json.loads(errors)])
+
+    def set(self, key, result):
+        is_valid, profile, errors = result
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO validation_results VALUES (?, ?, ?, ?)',
+                (key, int(is_valid), profile, json.dumps(errors)))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,16 +1,162 @@
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pkg_resources import resource_stream
 from ckanext.spatial.harvested_metadata import ISODocument
+from ckanext.spatial.lib.compiled import CompiledPool
 
 from lxml import etree
 
 log = __import__("logging").getLogger(__name__)
 
+# Compiled XSD schemas (keyed by file path) and schematrons (keyed by
+# validator class), shared by all threads
+_schemas = CompiledPool()
+_schematrons = CompiledPool()
+
+
+# Threads used to run the profiles in parallel. Each validator class has a
+# thread of its own, shared by all Validators instances, so there are no
+# more threads than profiles. Validators whose thread is busy with another
+# document are run in the calling thread instead (see `_submit`)
+_executors = {}
+_busy_validators = set()
+_executors_lock = threading.Lock()
+
+
+def _submit(validator, xml):
+    '''
+    Runs the validator in its thread, returning the future of its result,
+    or None if the thread is already validating another document
+    '''
+    with _executors_lock:
+        if validator in _busy_validators:
+            return None
+        _busy_validators.add(validator)
+        executor = _executors.get(validator)
+        if executor is None:
+            executor = _executors[validator] = ThreadPoolExecutor(
+                max_workers=1,
+                thread_name_prefix='spatial-validation-{0}'.format(
+                    validator.name))
+
+    def release(future):
+        with _executors_lock:
+            _busy_validators.discard(validator)
+
+    future = executor.submit(validator.is_valid, xml)
+    future.add_done_callback(release)
+    return future
+
+
+def shutdown_executors(wait=True):
+    '''Stops the threads used to run the profiles in parallel'''
+    with _executors_lock:
+        executors = list(_executors.values())
+        _executors.clear()
+        _busy_validators.clear()
+    for executor in executors:
+        executor.shutdown(wait=wait)
+
+
+def _reset_executors():
+    global _executors_lock
+    _executors.clear()
+    _busy_validators.clear()
+    _executors_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    # Threads are not copied to forked processes
+    os.register_at_fork(after_in_child=_reset_executors)
+
+
+CATALOG_PATH = os.path.join(os.path.dirname(__file__), 'xml', 'catalog.xml')
+CATALOG_NAMESPACE = 'urn:oasis:names:tc:entity:xmlns:xml:catalog'
+
+_catalog_resolvers = {}
+_catalog_lock = threading.Lock()
+
+
+class CatalogResolver(etree.Resolver):
+    '''
+    Resolves schema imports and includes using an OASIS XML catalog, so
+    remote schema locations are mapped to local files.
+
+    Only the `uri`, `system`, `rewriteURI` and `rewriteSystem` entries are
+    supported. Remote locations not present in the catalog are never
+    fetched.
+    '''
+
+    def __init__(self, catalog_path=CATALOG_PATH):
+        super(CatalogResolver, self).__init__()
+        self.catalog_path = catalog_path
+        self.entries = {}
+        self.prefixes = []
+
+        base = os.path.dirname(os.path.abspath(catalog_path))
+        catalog = etree.parse(catalog_path).getroot()
+        for element in catalog.iter('{%s}*' % CATALOG_NAMESPACE):
+            tag = etree.QName(element).localname
+            if tag == 'uri':
+                self.entries[element.get('name')] = os.path.join(
+                    base, element.get('uri'))
+            elif tag == 'system':
+                self.entries[element.get('systemId')] = os.path.join(
+                    base, element.get('uri'))
+            elif tag in ('rewriteURI', 'rewriteSystem'):
+                start = element.get('uriStartString') or \
+                    element.get('systemIdStartString')
+                self.prefixes.append(
+                    (start, os.path.join(base, element.get('rewritePrefix'))))
+        # The longest matching prefix wins
+        self.prefixes.sort(key=lambda prefix: len(prefix[0]), reverse=True)
+
+    def lookup(self, url):
+        '''Returns the local path for the provided URL, or None'''
+        if url in self.entries:
+            return self.entries[url]
+        for start, rewrite_prefix in self.prefixes:
+            if url.startswith(start):
+                return os.path.join(rewrite_prefix, url[len(start):])
+        return None
+
+    def resolve(self, url, pubid, context):
+        path = self.lookup(url)
+        if path:
+            return self.resolve_filename(path, context)
+        if url.startswith(('http://', 'https://', 'ftp://')):
+            log.warning('Schema location %s not found in the XML catalog, '
+                        'it will not be fetched', url)
+        return None
+
+
+def get_catalog_resolver(catalog_path=CATALOG_PATH):
+    with _catalog_lock:
+        resolver = _catalog_resolvers.get(catalog_path)
+        if resolver is None:
+            resolver = _catalog_resolvers[catalog_path] = \
+                CatalogResolver(catalog_path)
+    return resolver
+
+
+def get_xsd_parser(catalog_path=CATALOG_PATH):
+    '''
+    Returns a parser for XSD files that resolves imports with the XML
+    catalog and never accesses the network.
+    '''
+    parser = etree.XMLParser(no_network=True)
+    parser.resolvers.add(get_catalog_resolver(catalog_path))
+    return parser
+
 
 class BaseValidator(object):
     '''Base class for a validator.'''
     name = None
     title = None
+    # Cheap validator that is run before this one by `Validators`, to reject
+    # documents that can not possibly pass without the full validation cost
+    precheck = None
 
     @classmethod
     def is_valid(cls, xml):
@@ -25,9 +171,105 @@ class BaseValidator(object):
         '''
         raise NotImplementedError
 
+    @classmethod
+    def warmup(cls):
+        '''
+        Builds in advance anything that the validator would otherwise build
+        on the first validation (eg compiled schemas).
+        '''
+        pass
+
+
+ISO_NAMESPACES = {
+    'gmd': 'http://www.isotc211.org/2005/gmd',
+    'gmi': 'http://www.isotc211.org/2005/gmi',
+    'gco': 'http://www.isotc211.org/2005/gco',
+}
+
+
+class ISO19139StructureValidator(BaseValidator):
+    '''
+    Fast structural check for ISO 19139 documents.
+
+    It only checks the root element and the presence of the top level
+    elements that the ISO19139 XSD requires, so obviously wrong documents
+    (eg non-ISO content) are rejected before running the XSD and Schematron
+    validators. Optional elements (like gmd:fileIdentifier, which the
+    harvesters generate when missing) are not checked, so documents valid
+    against the XSD always pass.
+    '''
+    name = 'iso19139-structure'
+    title = 'ISO19139 Document Structure'
+
+    root_elements = (
+        '{%s}MD_Metadata' % ISO_NAMESPACES['gmd'],
+        '{%s}MI_Metadata' % ISO_NAMESPACES['gmi'],
+    )
+    # (XPath expression relative to the root, error message), for the
+    # elements with minOccurs="1" in MD_Metadata_Type
+    required_paths = (
+        ('gmd:contact', 'Missing metadata point of contact (gmd:contact)'),
+        ('gmd:dateStamp', 'Missing metadata date (gmd:dateStamp)'),
+        ('gmd:identificationInfo',
+         'Missing identification information (gmd:identificationInfo)'),
+    )
+    _xpaths = {}
+
+    @classmethod
+    def is_valid(cls, xml):
+        root = xml.getroot() if hasattr(xml, 'getroot') else xml
+        if root.tag not in cls.root_elements:
+            return False, [(
+                'Root element {0} is not an ISO19139 metadata record '
+                '(expected gmd:MD_Metadata or gmi:MI_Metadata)'.format(
+                    root.tag), root.sourceline)]
+
+        errors = []
+        for path, message in cls.required_paths:
+            if not cls._get_xpath(path)(root):
+                errors.append((message, root.sourceline))
+        return not errors, errors
+
+    @classmethod
+    def _get_xpath(cls, path):
+        # XPath objects can be used from several threads
+        xpath = cls._xpaths.get(path)
+        if xpath is None:
+            xpath = cls._xpaths[path] = etree.XPath(
+                path, namespaces=ISO_NAMESPACES)
+        return xpath
+
+    @classmethod
+    def warmup(cls):
+        for path, message in cls.required_paths:
+            cls._get_xpath(path)
+
 
 class XsdValidator(BaseValidator):
-    '''Base class for validators that use an XSD schema.'''
+    '''
+    Base class for validators that use an XSD schema.
+
+    Schema imports are resolved with the XML catalog in `catalog_path`.
+    Subclasses list the (XSD file path, XSD name) tuples they use in
+    `xsd_files`, so they can be compiled in advance.
+    '''
+    catalog_path = CATALOG_PATH
+    xsd_files = []
+
+    @classmethod
+    def warmup(cls):
+        for xsd_filepath, xsd_name in cls.xsd_files:
+            _schemas.warmup(
+                xsd_filepath, cls._schema_builder(xsd_filepath, xsd_name))
+
+    @classmethod
+    def _schema_builder(cls, xsd_filepath, xsd_name):
+        '''Returns a function that compiles the schema'''
+        def build():
+            log.info('Compiling XSD schema "%s"', xsd_name)
+            xsd = etree.parse(xsd_filepath, get_xsd_parser(cls.catalog_path))
+            return etree.XMLSchema(xsd)
+        return build
 
     @classmethod
     def _is_valid(cls, xml, xsd_filepath, xsd_name):
@@ -44,8 +286,6 @@ class XsdValidator(BaseValidator):
         Returns:
           (is_valid, [(error_message_string, error_line_number)])
         '''
-        xsd = etree.parse(xsd_filepath)
-        schema = etree.XMLSchema(xsd)
         # With libxml2 versions before 2.9, this fails with this error:
         #    gmx_schema = etree.XMLSchema(gmx_xsd)
         # File "xmlschema.pxi", line 103, in
@@ -53,29 +293,33 @@ class XsdValidator(BaseValidator):
         # XMLSchemaParseError: local list type: A type, derived by list or
         # union, must have the simple ur-type definition as base type,
         # not '{http://www.opengis.net/gml/3.2}doubleList'., line 118
-        try:
-            schema.assertValid(xml)
-        except etree.DocumentInvalid:
-            log.info(
-                'Validation errors found using schema {0}'.format(xsd_name))
-            errors = []
-            for error in schema.error_log:
-                errors.append((error.message, error.line))
-            errors.insert
-            return False, errors
+        with _schemas.get(xsd_filepath,
+                          cls._schema_builder(xsd_filepath, xsd_name)) as schema:
+            try:
+                schema.assertValid(xml)
+            except etree.DocumentInvalid:
+                log.info(
+                    'Validation errors found using schema {0}'.format(xsd_name))
+                errors = []
+                for error in schema.error_log:
+                    errors.append((error.message, error.line))
+                errors.insert
+                return False, errors
         return True, []
 
 
 class ISO19139Schema(XsdValidator):
     name = 'iso19139'
     title = 'ISO19139 XSD Schema'
+    precheck = ISO19139StructureValidator
+    xsd_files = [
+        (os.path.join(os.path.dirname(__file__), 'xml/iso19139', 'gmx/gmx.xsd'),
+         'Dataset schema (gmx.xsd)'),
+    ]
 
     @classmethod
     def is_valid(cls, xml):
-        xsd_path = 'xml/iso19139'
-        gmx_xsd_filepath = os.path.join(os.path.dirname(__file__),
-                                        xsd_path, 'gmx/gmx.xsd')
-        xsd_name = 'Dataset schema (gmx.xsd)'
+        gmx_xsd_filepath, xsd_name = cls.xsd_files[0]
         is_valid, errors = cls._is_valid(xml, gmx_xsd_filepath, xsd_name)
         if not is_valid:
             # TODO: not sure if we need this one,
@@ -87,17 +331,22 @@ class ISO19139Schema(XsdValidator):
 class ISO19139EdenSchema(XsdValidator):
     name = 'iso19139eden'
     title = 'ISO19139 XSD Schema (EDEN 2009-03-16)'
+    precheck = ISO19139StructureValidator
+    xsd_files = [
+        (os.path.join(os.path.dirname(__file__), 'xml/iso19139eden',
+                      'gmx/gmx.xsd'),
+         'Dataset schema (gmx.xsd)'),
+        (os.path.join(os.path.dirname(__file__), 'xml/iso19139eden',
+                      'gmx_and_srv.xsd'),
+         'Service schemas (gmx.xsd & srv.xsd)'),
+    ]
 
     @classmethod
     def is_valid(cls, xml):
-        xsd_path = 'xml/iso19139eden'
-
         metadata_type = cls.get_record_type(xml)
 
         if metadata_type in ('dataset', 'series'):
-            gmx_xsd_filepath = os.path.join(os.path.dirname(__file__),
-                                            xsd_path, 'gmx/gmx.xsd')
-            xsd_name = 'Dataset schema (gmx.xsd)'
+            gmx_xsd_filepath, xsd_name = cls.xsd_files[0]
             is_valid, errors = cls._is_valid(xml, gmx_xsd_filepath, xsd_name)
             if not is_valid:
                 # TODO: not sure if we need this one, keeping for backwards
@@ -105,9 +354,7 @@ class ISO19139EdenSchema(XsdValidator):
                 errors.insert(
                     0, ('{0} Validation Error'.format(xsd_name), None))
         elif metadata_type == 'service':
-            gmx_and_srv_xsd_filepath = os.path.join(
-                os.path.dirname(__file__), xsd_path, 'gmx_and_srv.xsd')
-            xsd_name = 'Service schemas (gmx.xsd & srv.xsd)'
+            gmx_and_srv_xsd_filepath, xsd_name = cls.xsd_files[1]
             is_valid, errors = cls._is_valid(
                 xml, gmx_and_srv_xsd_filepath, xsd_name)
             if not is_valid:
@@ -151,14 +398,17 @@ class ISO19139NGDCSchema(XsdValidator):
     '''
     name = 'iso19139ngdc'
     title = 'ISO19139 XSD Schema (NGDC)'
+    precheck = ISO19139StructureValidator
+    xsd_files = [
+        (os.path.join(os.path.dirname(__file__), 'xml/iso19139ngdc',
+                      'schema.xsd'),
+         'NGDC Schema (schema.xsd)'),
+    ]
 
     @classmethod
     def is_valid(cls, xml):
-        xsd_path = 'xml/iso19139ngdc'
-
-        xsd_filepath = os.path.join(os.path.dirname(__file__),
-                                    xsd_path, 'schema.xsd')
-        return cls._is_valid(xml, xsd_filepath, 'NGDC Schema (schema.xsd)')
+        xsd_filepath, xsd_name = cls.xsd_files[0]
+        return cls._is_valid(xml, xsd_filepath, xsd_name)
 
 
 class FGDCSchema(XsdValidator):
@@ -173,15 +423,16 @@ class FGDCSchema(XsdValidator):
 
     name = 'fgdc'
     title = 'FGDC XSD Schema'
+    xsd_files = [
+        (os.path.join(os.path.dirname(__file__), 'xml/fgdc',
+                      'fgdc-std-001-1998.xsd'),
+         'FGDC Schema (fgdc-std-001-1998.xsd)'),
+    ]
 
     @classmethod
     def is_valid(cls, xml):
-        xsd_path = 'xml/fgdc'
-
-        xsd_filepath = os.path.join(os.path.dirname(__file__),
-                                    xsd_path, 'fgdc-std-001-1998.xsd')
-        return cls._is_valid(
-            xml, xsd_filepath, 'FGDC Schema (fgdc-std-001-1998.xsd)')
+        xsd_filepath, xsd_name = cls.xsd_files[0]
+        return cls._is_valid(xml, xsd_filepath, xsd_name)
 
 
 class SchematronValidator(BaseValidator):
@@ -209,28 +460,35 @@ class SchematronValidator(BaseValidator):
           (is_valid, [(error_message_string, error_line_number)])
         '''
 
-        if not hasattr(cls, 'schematrons'):
-            log.info('Compiling schematron "%s"', cls.title)
-            cls.schematrons = cls.get_schematrons()
-        for schematron in cls.schematrons:
-            result = schematron(xml)
-            errors = []
-            for element in result.findall(
-                    "{http://purl.oclc.org/dsdl/svrl}failed-assert"):
-                errors.append(element)
-            if len(errors) > 0:
-                messages_already_reported = set()
-                error_details = []
-                for error in errors:
-                    message, details = cls.extract_error_details(error)
-                    if not message in messages_already_reported:
-                        # TODO: perhaps can extract the source line from the
-                        # error location
-                        error_details.append((details, None))
-                        messages_already_reported.add(message)
-                return False, error_details
+        with _schematrons.get(cls, cls._build_schematrons) as schematrons:
+            for schematron in schematrons:
+                result = schematron(xml)
+                errors = []
+                for element in result.findall(
+                        "{http://purl.oclc.org/dsdl/svrl}failed-assert"):
+                    errors.append(element)
+                if len(errors) > 0:
+                    messages_already_reported = set()
+                    error_details = []
+                    for error in errors:
+                        message, details = cls.extract_error_details(error)
+                        if not message in messages_already_reported:
+                            # TODO: perhaps can extract the source line from the
+                            # error location
+                            error_details.append((details, None))
+                            messages_already_reported.add(message)
+                    return False, error_details
         return True, []
 
+    @classmethod
+    def _build_schematrons(cls):
+        log.info('Compiling schematron "%s"', cls.title)
+        return cls.get_schematrons()
+
+    @classmethod
+    def warmup(cls):
+        _schematrons.warmup(cls, cls._build_schematrons)
+
     @classmethod
     def extract_error_details(cls, failed_assert_element):
         '''Given the XML Element describing a schematron test failure,
@@ -272,6 +530,7 @@ class SchematronValidator(BaseValidator):
 class ConstraintsSchematron(SchematronValidator):
     name = 'constraints'
     title = 'ISO19139 Table A.1 Constraints Schematron (Medin 1.3)'
+    precheck = ISO19139StructureValidator
 
     @classmethod
     def get_schematrons(cls):
@@ -285,6 +544,7 @@ class ConstraintsSchematron(SchematronValidator):
 class ConstraintsSchematron14(SchematronValidator):
     name = 'constraints-1.4'
     title = 'ISO19139 Table A.1 Constraints Schematron (Medin/Parslow 1.4)'
+    precheck = ISO19139StructureValidator
 
     @classmethod
     def get_schematrons(cls):
@@ -297,6 +557,7 @@ class ConstraintsSchematron14(SchematronValidator):
 class Gemini2Schematron(SchematronValidator):
     name = 'gemini2'
     title = 'GEMINI 2.1 Schematron 1.2'
+    precheck = ISO19139StructureValidator
 
     @classmethod
     def get_schematrons(cls):
@@ -309,6 +570,7 @@ class Gemini2Schematron(SchematronValidator):
 class Gemini2Schematron13(SchematronValidator):
     name = 'gemini2-1.3'
     title = 'GEMINI 2.1 Schematron 1.3'
+    precheck = ISO19139StructureValidator
 
     @classmethod
     def get_schematrons(cls):
@@ -316,7 +578,8 @@ class Gemini2Schematron13(SchematronValidator):
                              "xml/gemini2/Gemini2_R1r3.sch") as schema:
             return [cls.schematron(schema)]
 
-all_validators = (ISO19139Schema,
+all_validators = (ISO19139StructureValidator,
+                  ISO19139Schema,
                   ISO19139EdenSchema,
                   ISO19139NGDCSchema,
                   FGDCSchema,
@@ -329,9 +592,26 @@ all_validators = (ISO19139Schema,
 class Validators(object):
     '''
     Validates XML against one or more profiles (i.e. validators).
+
+    If `parallel` is True, the profiles are run concurrently (lxml releases
+    the GIL while validating), each one in a thread of its own shared by all
+    instances (see `shutdown_executors`). Profiles whose thread is busy
+    validating a document for another caller are run in the calling thread,
+    so concurrent callers don't queue behind each other. Otherwise they are
+    run one after the other.
+
+    If `precheck` is True, the cheap structural checks required by the
+    profiles (see `BaseValidator.precheck`) are run first, and if they fail
+    the rest of the profiles are not run. Their errors are reported under
+    the precheck validator name (eg "iso19139-structure").
     '''
-    def __init__(self, profiles=["iso19139", "constraints", "gemini2"]):
+    def __init__(self, profiles=["iso19139", "constraints", "gemini2"],
+                 cache=None, parallel=False, precheck=True):
         self.profiles = profiles
+        # Optional ValidationCache to reuse previous outcomes
+        self.cache = cache
+        self.parallel = parallel
+        self.precheck = precheck
 
         self.validators = {}  # name: class
         for validator_class in all_validators:
@@ -357,12 +637,43 @@ class Validators(object):
         Returns:
           (is_valid, failed_profile_name, [(error_message_string, error_line_number)])
         '''
+        if self.cache is None:
+            return self._is_valid(xml)
+
+        key = self.cache.key(
+            xml, [(validator.name, validator)
+                  for validator in self._get_prechecks() + [
+                      self.validators[name] for name in self.profiles]])
+        result = self.cache.get(key)
+        if result is not None:
+            log.debug('Using cached validation result')
+            return result
+
+        result = self._is_valid(xml)
+        self.cache.set(key, result)
+        return result
+
+    def validate_all(self, xml):
+        '''Validates the XML against all profiles, rather than stopping on
+        the first one that fails.
 
+        Params:
+          xml - etree of the XML to be validated
 
+        Returns:
+          (is_valid, [(failed_profile_name, [(error_message_string, error_line_number)])])
+        '''
+        failures = [
+            (validator.name, error_message_list)
+            for validator, is_valid, error_message_list
+            in self._run_profiles(xml)
+            if not is_valid
+        ]
+        return not failures, failures
+
+    def _is_valid(self, xml):
         log.debug('Starting validation against profile(s) %s' % ','.join(self.profiles))
-        for name in self.profiles:
-            validator = self.validators[name]
-            is_valid, error_message_list = validator.is_valid(xml)
+        for validator, is_valid, error_message_list in self._run_profiles(xml):
             if not is_valid:
                 #error_message_list.insert(0, 'Validating against "%s" profile failed' % validator.title)
                 log.info('Validating against "%s" profile failed' % validator.title)
@@ -372,6 +683,65 @@ class Validators(object):
         log.info('Validation passed')
         return True, None, []
 
+    def warmup(self):
+        '''
+        Compiles the schemas, schematrons and XPath expressions of all the
+        profiles (and their prechecks), which are then used by all threads.
+        '''
+        for validator in self._get_prechecks() + [
+                self.validators[name] for name in self.profiles]:
+            validator.warmup()
+
+    def _get_prechecks(self):
+        '''
+        Returns the precheck validators required by the profiles, excluding
+        the ones explicitly listed as profiles
+        '''
+        prechecks = []
+        if not self.precheck:
+            return prechecks
+        for name in self.profiles:
+            precheck = self.validators[name].precheck
+            if (precheck and precheck not in prechecks and
+                    precheck.name not in self.profiles):
+                prechecks.append(precheck)
+        return prechecks
+
+    def _run_profiles(self, xml):
+        '''
+        Generator that yields a (validator, is_valid, error_message_list)
+        tuple for each profile, in the order they were defined.
+
+        Prechecks are run first, if any of them fails no other profiles are
+        run. When running in parallel all profiles are started at once, if the
+        consumer stops early the ones not started yet are cancelled.
+        '''
+        for precheck in self._get_prechecks():
+            is_valid, error_message_list = precheck.is_valid(xml)
+            yield precheck, is_valid, error_message_list
+            if not is_valid:
+                return
+
+        validators = [self.validators[name] for name in self.profiles]
+        if not self.parallel or len(validators) < 2:
+            for validator in validators:
+                is_valid, error_message_list = validator.is_valid(xml)
+                yield validator, is_valid, error_message_list
+            return
+
+        futures = [_submit(validator, xml) for validator in validators]
+        try:
+            for validator, future in zip(validators, futures):
+                if future is None:
+                    is_valid, error_message_list = validator.is_valid(xml)
+                else:
+                    is_valid, error_message_list = future.result()
+                yield validator, is_valid, error_message_list
+        finally:
+            for future in futures:
+                if future is not None:
+                    future.cancel()
+
 if __name__ == '__main__':
     from sys import argv
     import logging
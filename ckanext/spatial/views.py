@@ -2,7 +2,7 @@
 
 import logging
 
-from flask import Blueprint, make_response
+from flask import Blueprint, Response, make_response, request
 
 import ckan.lib.helpers as h
 import ckan.plugins.toolkit as tk
@@ -24,41 +24,105 @@ def harvest_object_redirect_html(id):
     return h.redirect_to("/harvest/object/{}/html".format(id))
 
 
+def _get_cache_headers(id, original=False, variant=""):
+    """
+    Returns the caching headers for the harvest object and whether the
+    client copy is still valid, without loading the object content.
+    """
+    cache_info = util.get_harvest_object_cache_info(id, original=original)
+    if not cache_info:
+        return tk.abort(404)
+    version, fetch_finished = cache_info
+    if _accepts_gzip():
+        variant += ":gzip"
+    headers = util.get_harvest_object_cache_headers(
+        id, version, fetch_finished, variant)
+    headers["Vary"] = "Accept-Encoding"
+    not_modified = util.is_not_modified(
+        headers,
+        request.headers.get("If-None-Match"),
+        request.headers.get("If-Modified-Since"),
+    )
+    return headers, not_modified
+
+
+def _accepts_gzip():
+    return util.accepts_gzip(request.headers.get("Accept-Encoding"))
+
+
+def _make_streamed_response(chunks, headers):
+    """
+    Streams the chunks of encoded content, compressed with gzip if the
+    client accepts it.
+    """
+    if _accepts_gzip():
+        headers["Content-Encoding"] = "gzip"
+        chunks = util.iter_gzip(chunks)
+    return Response(chunks, 200, headers)
+
+
 def display_xml_original(id):
-    content = util.get_harvest_object_original_content(id)
+    headers, not_modified = _get_cache_headers(id, original=True,
+                                               variant="xml")
+    if not_modified:
+        return make_response(("", 304, headers))
 
-    if not content:
+    value, codec = util.get_harvest_object_original_stored_content(id)
+
+    if not value:
         return tk.abort(404)
 
-    headers = {"Content-Type": "application/xml; charset=utf-8"}
+    headers["Content-Type"] = "application/xml; charset=utf-8"
+
+    if _accepts_gzip():
+        # Documents stored with gzip can be sent as they are
+        compressed = util.get_gzip_document_with_declaration(value, codec)
+        if compressed:
+            headers["Content-Encoding"] = "gzip"
+            return Response(
+                util.iter_content_chunks(compressed), 200, headers)
 
-    if "<?xml" not in content.split("\n")[0]:
-        content = u'<?xml version="1.0" encoding="UTF-8"?>\n' + content
-    return make_response((content, 200, headers))
+    return _make_streamed_response(
+        util.iter_original_document(value, codec), headers)
 
 
 def display_html(id):
+    xslt_package, xslt_path = util.get_xslt()
+    headers, not_modified = _get_cache_headers(
+        id, variant="html:{}:{}".format(xslt_package, xslt_path))
+    if not_modified:
+        return make_response(("", 304, headers))
+
     content = util.get_harvest_object_content(id)
 
     if not content:
         return tk.abort(404)
-    headers = {"Content-Type": "text/html; charset=utf-8"}
+    headers["Content-Type"] = "text/html; charset=utf-8"
 
-    xslt_package, xslt_path = util.get_xslt()
-    content = util.transform_to_html(content, xslt_package, xslt_path)
-    return make_response((content, 200, headers))
+    content = util.transform_to_html(content, xslt_package, xslt_path,
+                                     object_id=id)
+    return _make_streamed_response(
+        util.iter_content_chunks(content), headers)
 
 
 def display_html_original(id):
+    xslt_package, xslt_path = util.get_xslt(original=True)
+    headers, not_modified = _get_cache_headers(
+        id, original=True,
+        variant="html:{}:{}".format(xslt_package, xslt_path))
+    if not_modified:
+        return make_response(("", 304, headers))
+
     content = util.get_harvest_object_original_content(id)
 
     if content is None:
         return tk.abort(404)
-    headers = {"Content-Type": "text/html; charset=utf-8"}
+    headers["Content-Type"] = "text/html; charset=utf-8"
 
-    xslt_package, xslt_path = util.get_xslt(original=True)
-    content = util.transform_to_html(content, xslt_package, xslt_path)
-    return make_response((content, 200, headers))
+    content = util.transform_to_html(content, xslt_package, xslt_path,
+                                     object_id=id)
+    return _make_streamed_response(
+        util.iter_content_chunks(content), headers)
 
 
 harvest_metadata.add_url_rule(